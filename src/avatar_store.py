@@ -0,0 +1,122 @@
+##      avatar_store.py
+##
+## This file is part of Gajim.
+##
+## Gajim is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published
+## by the Free Software Foundation; version 3 only.
+##
+## Gajim is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Gajim.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Keep decoded avatars in memory
+
+Images are stored by the SHA-1 of their data, so contacts and groupchat
+occupants using the same avatar share it. Each image is kept at its original
+size and at the sizes it was asked for, the least recently used ones are
+dropped first.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+# number of pixbufs (all sizes together) to keep
+AVATAR_CACHE_SIZE = 2000
+
+
+class AvatarStore:
+    """
+    decode(data) must return a pixbuf or None if data is not a valid image,
+    scale(pixbuf, size) the pixbuf scaled to size, which can be anything
+    hashable identifying the size
+    """
+
+    def __init__(self, decode, scale, size=AVATAR_CACHE_SIZE):
+        self.decode = decode
+        self.scale = scale
+        self.size = size
+        # {jid: sha} of the avatar a jid (or a groupchat fake jid) uses, None
+        # when it has none
+        self.shas = {}
+        # {(sha, size): pixbuf}, least recently used first. size None is the
+        # original image
+        self.pixbufs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, jid):
+        return jid in self.shas
+
+    def set_avatar(self, jid, data):
+        """
+        Use data as the avatar of jid and return its pixbuf, None if data is
+        not an image
+        """
+        sha = hashlib.sha1(data).hexdigest()
+        pixbuf = self._get((sha, None))
+        if pixbuf is None:
+            pixbuf = self.decode(data)
+            if pixbuf is None:
+                self.shas[jid] = None
+                return None
+            self._add((sha, None), pixbuf)
+        self.shas[jid] = sha
+        return pixbuf
+
+    def set_no_avatar(self, jid):
+        self.shas[jid] = None
+
+    def forget(self, jid):
+        """
+        The avatar of jid changed, its pixbufs are dropped when they are not
+        used anymore
+        """
+        self.shas.pop(jid, None)
+
+    def clear(self):
+        self.shas.clear()
+        self.pixbufs.clear()
+
+    def get_pixbuf(self, jid, size=None):
+        """
+        Return the avatar of jid scaled to size, or None if it has none.
+        Raise KeyError if the avatar of jid is not known or was dropped
+        """
+        sha = self.shas[jid]
+        if sha is None:
+            return None
+        key = (sha, size)
+        if key in self.pixbufs:
+            self.hits += 1
+            return self._get(key)
+        original = self._get((sha, None))
+        if original is None:
+            # dropped, the caller has to load it again
+            self.misses += 1
+            del self.shas[jid]
+            raise KeyError(jid)
+        self.misses += 1
+        if size is None:
+            return original
+        pixbuf = self.scale(original, size)
+        self._add(key, pixbuf)
+        return pixbuf
+
+    def _get(self, key):
+        pixbuf = self.pixbufs.get(key)
+        if pixbuf is not None:
+            self.pixbufs.move_to_end(key)
+        return pixbuf
+
+    def _add(self, key, pixbuf):
+        self.pixbufs[key] = pixbuf
+        self.pixbufs.move_to_end(key)
+        while len(self.pixbufs) > self.size:
+            self.pixbufs.popitem(last=False)
@@ -1289,10 +1289,9 @@ class ChatControl(ChatControlBase):
             jid = self.contact.jid
 
         if gajim.config.get('show_avatar_in_tabs'):
-            avatar_pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(jid)
+            avatar_pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(jid,
+                size=(16, 16))
             if avatar_pixbuf not in ('ask', None):
-                avatar_pixbuf = gtkgui_helpers.get_scaled_pixbuf_by_size(
-                    avatar_pixbuf, 16, 16)
                 return avatar_pixbuf
 
         if count_unread:
@@ -1551,7 +1550,8 @@ class ChatControl(ChatControlBase):
             return
 
         jid_with_resource = self.contact.get_full_jid()
-        pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(jid_with_resource)
+        pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(jid_with_resource,
+            kind='chat')
         if pixbuf == 'ask':
             # we don't have the vcard
             if self.TYPE_ID == message_control.TYPE_PM:
@@ -1567,10 +1567,8 @@ class ChatControl(ChatControlBase):
             else:
                 gajim.connections[self.account].request_vcard(jid_with_resource)
             return
-        elif pixbuf:
-            scaled_pixbuf = gtkgui_helpers.get_scaled_pixbuf(pixbuf, 'chat')
         else:
-            scaled_pixbuf = None
+            scaled_pixbuf = pixbuf
 
         image = self.xml.get_object('avatar_image')
         image.set_from_pixbuf(scaled_pixbuf)
@@ -0,0 +1,142 @@
+##      common/bootstrap.py
+##
+## This file is part of Gajim.
+##
+## Gajim is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published
+## by the Free Software Foundation; version 3 only.
+##
+## Gajim is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Gajim.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Schedule the requests sent after login
+
+Each step is started as soon as the steps it requires are done, so
+independent requests are in flight at the same time instead of waiting for
+each other's answer. The time each step took is recorded.
+"""
+
+import time
+import logging
+log = logging.getLogger('gajim.c.bootstrap')
+
+
+class BootstrapStep:
+    __slots__ = ('name', 'start', 'requires', 'wait', 'started', 'finished')
+
+    def __init__(self, name, start, requires, wait):
+        self.name = name
+        self.start = start
+        self.requires = requires
+        self.wait = wait
+        self.started = None
+        self.finished = None
+
+
+class Bootstrap:
+    """
+    A set of steps with dependencies between them
+
+    A step's start function sends its request, done(name) has to be called
+    when the answer arrived. Steps added with wait=False are done as soon as
+    they are started.
+    """
+
+    def __init__(self, account, on_finished=None):
+        self.account = account
+        self.on_finished = on_finished
+        # dict {name: BootstrapStep}, in the order steps were added
+        self.steps = {}
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+
+    def add_step(self, name, start, requires=(), wait=True):
+        for required in requires:
+            if required not in self.steps:
+                raise ValueError('Unknown bootstrap step: %s' % required)
+        self.steps[name] = BootstrapStep(name, start, tuple(requires), wait)
+
+    def start(self):
+        self.started = time.monotonic()
+        self._start_ready_steps()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_waiting_for(self, name):
+        step = self.steps.get(name)
+        return step is not None and step.started is not None and \
+            step.finished is None
+
+    def done(self, name):
+        """
+        Mark the step as done and start the steps that were waiting for it.
+        Unknown steps and steps that are not running are ignored
+        """
+        if self.cancelled or not self.is_waiting_for(name):
+            return
+        step = self.steps[name]
+        step.finished = time.monotonic()
+        log.debug('%s: bootstrap step %s done in %.3fs', self.account, name,
+            step.finished - step.started)
+        self._start_ready_steps()
+        if self.finished is None and all(s.finished is not None for s in \
+        self.steps.values()):
+            self.finished = time.monotonic()
+            log.info('%s: bootstrap done in %.3fs (%s)', self.account,
+                self.finished - self.started, self.format_timings())
+            if self.on_finished:
+                self.on_finished(self)
+
+    def _is_ready(self, step):
+        if step.started is not None:
+            return False
+        for required in step.requires:
+            if self.steps[required].finished is None:
+                return False
+        return True
+
+    def _start_ready_steps(self):
+        for step in list(self.steps.values()):
+            if self.cancelled:
+                return
+            if not self._is_ready(step):
+                continue
+            step.started = time.monotonic()
+            log.debug('%s: starting bootstrap step %s', self.account,
+                step.name)
+            step.start()
+            if not step.wait:
+                self.done(step.name)
+
+    def get_timings(self):
+        """
+        Return a list of (step name, start offset, duration) in seconds. Values
+        are None for steps that were not started or are not finished
+        """
+        timings = []
+        for step in self.steps.values():
+            offset = duration = None
+            if step.started is not None:
+                offset = step.started - self.started
+                if step.finished is not None:
+                    duration = step.finished - step.started
+            timings.append((step.name, offset, duration))
+        return timings
+
+    def format_timings(self):
+        result = []
+        for name, offset, duration in self.get_timings():
+            if duration is None:
+                result.append('%s: -' % name)
+            else:
+                result.append('%s: +%.3fs %.3fs' % (name, offset, duration))
+        return ', '.join(result)
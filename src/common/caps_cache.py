@@ -31,8 +31,10 @@ CapsCache caches features to hash relationships. The cache is queried
 through ClientCaps objects which are hold by contact instances.
 """
 
+import sys
 import base64
 import hashlib
+from collections import OrderedDict
 
 import logging
 log = logging.getLogger('gajim.c.caps_cache')
@@ -51,6 +53,10 @@ QUERIED = 1
 CACHED = 2 # got the answer
 FAKED = 3 # allow NullClientCaps to behave as it has a cached item
 
+# Maximum number of items kept in memory, others are loaded from the db when
+# needed
+CAPS_CACHE_SIZE = 1000
+
 ################################################################################
 ### Public API of this module
 ################################################################################
@@ -308,22 +314,24 @@ class CapsCache(object):
     def __init__(self, logger=None):
         # our containers:
         # __cache is a dictionary mapping: pair of hash method and hash maps
-        #   to CapsCacheItem object
+        #   to CapsCacheItem object, least recently used first
         # __CacheItem is a class that stores data about particular
         #   client (hash method/hash pair)
-        self.__cache = {}
+        self.__cache = OrderedDict()
 
         class CacheItem(object):
-            # __names is a string cache; every string long enough is given
-            #   another object, and we will have plenty of identical long
-            #   strings. therefore we can cache them
-            __names = {}
+            __slots__ = ('hash_method', 'hash', '_features', '_identities',
+                '_logger', 'status', '_recently_seen')
+
+            # many clients share the same features, keep one frozenset for
+            #   each set of features, least recently used first
+            __feature_sets = OrderedDict()
 
             def __init__(self, hash_method, hash_, logger):
                 # cached into db
                 self.hash_method = hash_method
                 self.hash = hash_
-                self._features = []
+                self._features = frozenset()
                 self._identities = []
                 self._logger = logger
 
@@ -334,9 +342,16 @@ class CapsCache(object):
                 return self._features
 
             def _set_features(self, value):
-                self._features = []
-                for feature in value:
-                    self._features.append(self.__names.setdefault(feature, feature))
+                features = frozenset(sys.intern(f) for f in value)
+                feature_sets = self.__feature_sets
+                if features in feature_sets:
+                    feature_sets.move_to_end(features)
+                    self._features = feature_sets[features]
+                    return
+                feature_sets[features] = features
+                if len(feature_sets) > CAPS_CACHE_SIZE:
+                    feature_sets.popitem(last=False)
+                self._features = features
 
             features = property(_get_features, _set_features)
 
@@ -359,9 +374,9 @@ class CapsCache(object):
                 self._identities = []
                 for identity in value:
                     # dict are not hashable, so transform it into a tuple
-                    t = (identity['category'], identity.get('type'),
-                            identity.get('xml:lang'), identity.get('name'))
-                    self._identities.append(self.__names.setdefault(t, t))
+                    self._identities.append((identity['category'],
+                        identity.get('type'), identity.get('xml:lang'),
+                        identity.get('name')))
 
             identities = property(_get_identities, _set_identities)
 
@@ -389,15 +404,24 @@ class CapsCache(object):
 
         self.__CacheItem = CacheItem
         self.logger = logger
+        # items are loaded from the db only once it's ready
+        self._load_from_db = False
 
     def initialize_from_db(self):
         self._remove_outdated_caps()
-        for hash_method, hash_, identities, features in \
-        self.logger.iter_caps_data():
-            x = self[(hash_method, hash_)]
-            x.identities = identities
-            x.features = features
-            x.status = CACHED
+        self._load_from_db = True
+        for item in list(self.__cache.values()):
+            if item.status == NEW:
+                self._load_item(item)
+
+    def _load_item(self, item):
+        if item.hash_method in ('no', 'dummy'):
+            # never stored in db
+            return
+        data = self.logger.get_caps_data(item.hash_method, item.hash)
+        if data:
+            item.identities, item.features = data
+            item.status = CACHED
 
     def _remove_outdated_caps(self):
         """
@@ -407,12 +431,17 @@ class CapsCache(object):
 
     def __getitem__(self, caps):
         if caps in self.__cache:
+            self.__cache.move_to_end(caps)
             return self.__cache[caps]
 
         hash_method, hash_ = caps
 
         x = self.__CacheItem(hash_method, hash_, self.logger)
+        if self._load_from_db:
+            self._load_item(x)
         self.__cache[(hash_method, hash_)] = x
+        if len(self.__cache) > CAPS_CACHE_SIZE:
+            self.__cache.popitem(last=False)
         return x
 
     def query_client_of_jid_if_unknown(self, connection, jid, client_caps):
@@ -72,16 +72,79 @@ def create_log_db():
                     show INTEGER,
                     message TEXT,
                     subject TEXT,
-                    additional_data TEXT DEFAULT '{}'
+                    additional_data TEXT DEFAULT '{}',
+                    stanza_id TEXT
             );
 
             CREATE INDEX idx_logs_jid_id_time ON logs (jid_id, time DESC);
+
+            CREATE UNIQUE INDEX idx_logs_stanza_id ON logs (jid_id, stanza_id);
             '''
             )
+    create_logs_fts(cur)
 
     con.commit()
     con.close()
 
+def create_logs_fts(cur):
+    """
+    Create the full-text index over logs and the triggers that keep it in sync
+
+    Return False if sqlite was built without FTS5, search then falls back to
+    LIKE queries.
+    """
+    try:
+        cur.executescript(
+                '''
+                CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(
+                        message,
+                        subject,
+                        content='logs',
+                        content_rowid='log_line_id'
+                );
+
+                CREATE TRIGGER IF NOT EXISTS logs_fts_ai AFTER INSERT ON logs
+                BEGIN
+                        INSERT INTO logs_fts(rowid, message, subject)
+                        VALUES (new.log_line_id, new.message, new.subject);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS logs_fts_ad AFTER DELETE ON logs
+                BEGIN
+                        INSERT INTO logs_fts(logs_fts, rowid, message, subject)
+                        VALUES ('delete', old.log_line_id, old.message,
+                        old.subject);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS logs_fts_au AFTER UPDATE ON logs
+                BEGIN
+                        INSERT INTO logs_fts(logs_fts, rowid, message, subject)
+                        VALUES ('delete', old.log_line_id, old.message,
+                        old.subject);
+                        INSERT INTO logs_fts(rowid, message, subject)
+                        VALUES (new.log_line_id, new.message, new.subject);
+                END;
+                '''
+                )
+    except sqlite.OperationalError as e:
+        print('cannot create full-text index: %s' % str(e), file=sys.stderr)
+        return False
+    return True
+
+def drop_logs_fts(cur):
+    """
+    Remove the full-text index over logs and its triggers, search then falls
+    back to LIKE queries
+    """
+    cur.executescript(
+            '''
+            DROP TRIGGER IF EXISTS logs_fts_ai;
+            DROP TRIGGER IF EXISTS logs_fts_ad;
+            DROP TRIGGER IF EXISTS logs_fts_au;
+            DROP TABLE IF EXISTS logs_fts;
+            '''
+            )
+
 def create_cache_db():
     print(_('creating cache database'))
     con = sqlite.connect(logger.CACHE_DB_PATH)
@@ -100,6 +163,22 @@ def create_cache_db():
                     data BLOB,
                     last_seen INTEGER);
 
+            CREATE INDEX idx_caps_cache ON caps_cache (hash_method, hash);
+
+            CREATE TABLE resolver_cache (
+                    host TEXT,
+                    type TEXT,
+                    data TEXT,
+                    expires INTEGER,
+                    PRIMARY KEY (host, type)
+            );
+
+            CREATE TABLE received_message_hashes (
+                    account TEXT,
+                    hash BLOB,
+                    PRIMARY KEY (account, hash)
+            );
+
             CREATE TABLE rooms_last_message_time(
                     jid_id INTEGER PRIMARY KEY UNIQUE,
                     time INTEGER
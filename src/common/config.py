@@ -176,6 +176,7 @@ class Config:
             'notify_on_new_gmail_email_extra': [ opt_bool, False ],
             'notify_on_new_gmail_email_command': [ opt_str, '', _('Specify the command to run when new mail arrives, e.g.: /usr/bin/getmail -q') ],
             'use_gpg_agent': [ opt_bool, False ],
+            'remember_received_message_hashes': [ opt_bool, False, _('Remember hashes of last received messages across restarts, so that messages sent again by the server are ignored.') ],
             'change_roster_title': [ opt_bool, True, _('Add * and [n] in roster title?')],
             'restore_lines': [opt_int, 4, _('Amount of previous messages to include when reopening a chat')],
             'restore_timeout': [opt_int, 60, _('How many minutes should last lines from previous conversation last.')],
@@ -376,6 +377,8 @@ class Config:
                     'time_for_ping_alive_answer': [ opt_int, 60, _('How many seconds to wait for the answer of ping alive packet before we try to reconnect?') ],
                     # try for 1 minutes before giving up (aka. timeout after those seconds)
                     'try_connecting_for_foo_secs': [ opt_int, 60 ],
+                    'race_connections': [ opt_bool, True, _('Try all servers and connection types at once, a short time apart, instead of waiting for each one to fail before trying the next one.') ],
+                    'last_connection_host': [ opt_str, '', _('Host, port and connection type that worked last time. They are tried first.') ],
                     'http_auth': [opt_str, 'ask'], # yes, no, ask
                     'dont_ack_subscription': [opt_bool, False, _('Jabberd2 workaround')],
                     # proxy65 for FT
@@ -414,11 +417,16 @@ class Config:
                     'last_archiving_time': [opt_str, '1970-01-01T00:00:00Z', _('Last time we syncronized with logs from server.')],
                     'enable_message_carbons': [ opt_bool, True, _('If enabled and if server supports this feature, Gajim will receive messages sent and received by other resources.')],
                     'ft_send_local_ips': [ opt_bool, True, _('If enabled, Gajim will send your local IPs so your contact can connect to your machine to transfer files.')],
+                    'ibb_block_size': [opt_int, 4096, _('Size of the blocks of files sent In-Band (IBB). Larger blocks are faster, but some servers refuse or drop the bigger stanzas.')],
                     'oauth2_refresh_token': [ opt_str, '', _('Latest token for OAuth 2.0 authentication.')],
                     'oauth2_client_id': [ opt_str, '0000000044077801', _('client_id for OAuth 2.0 authentication.')],
                     'oauth2_redirect_url': [ opt_str, 'https%3A%2F%2Fgajim.org%2Fmsnauth%2Findex.cgi', _('redirect_url for OAuth 2.0 authentication.')],
                     'opened_chat_controls': [opt_str, '', _('Space separated list of JIDs for which we want to re-open a chat window on next startup.')],
                     'last_mam_id': [opt_str, '', _('Last MAM id we are syncronized with')],
+                    'mam_sync_time': [opt_int, 0, _('Time (in seconds since EPOCH) until which we are synchronized with the server archive (MAM).')],
+                    'mam_catchup_windows': [opt_str, '', _('State of the time ranges of the server archive (MAM) that are being fetched. Used to resume after a disconnection.')],
+                    'mam_page_size': [opt_int, 100, _('Number of messages requested per page when synchronizing with the server archive (MAM).')],
+                    'mam_parallel_queries': [opt_int, 3, _('Number of pages of the server archive (MAM) requested at the same time.')],
             }, {}),
             'statusmsg': ({
                     'message': [ opt_str, '' ],
@@ -60,6 +60,8 @@ from common import gpg
 from common import passwords
 from common import exceptions
 from common import check_X509
+from common.connection_racer import ConnectionRacer
+from common.bootstrap import Bootstrap
 from common.connection_handlers import *
 
 from gtkgui_helpers import get_action
@@ -151,6 +153,10 @@ class CommonConnection:
         self.pep = {}
         # Do we continue connection when we get roster (send presence,get vcard..)
         self.continue_connect_info = None
+        # Bootstrap of the requests sent after login
+        self._bootstrap = None
+        # list of (step name, start offset, duration) of the last bootstrap
+        self.bootstrap_timings = []
 
         # Remember where we are in the register agent process
         self.agent_registrations = {}
@@ -783,6 +789,11 @@ class Connection(CommonConnection, ConnectionHandlers):
         # If we succeed to connect, remember it so next time we try (after a
         # disconnection) we try only this type.
         self.last_connection_type = None
+        # ConnectionRacer instance while several connections are tried at once
+        self._racer = None
+        # hosts to try with a plain connection once all encrypted connections
+        # raced failed, None when not falling back to plain
+        self._plain_hosts = None
         self.lang = None
         if locale.getdefaultlocale()[0]:
             self.lang = locale.getdefaultlocale()[0].split('_')[0]
@@ -898,6 +909,12 @@ class Connection(CommonConnection, ConnectionHandlers):
         self.privacy_rules_supported = False
         if on_purpose:
             self.sm = Smacks(self)
+        if self._racer:
+            self._racer.cancel()
+            self._racer = None
+        if self._bootstrap:
+            self._bootstrap.cancel()
+            self._bootstrap = None
         if self.connection:
             # make sure previous connection is completely closed
             gajim.proxy65_manager.disconnect(self.connection)
@@ -1221,6 +1238,7 @@ class Connection(CommonConnection, ConnectionHandlers):
                     'custom_port')
             for i in self._hosts:
                 i['ssl_port'] = ssl_p
+        self._plain_hosts = None
         self._connect_to_next_host()
 
 
@@ -1248,6 +1266,13 @@ class Connection(CommonConnection, ConnectionHandlers):
                 else:
                     self._connection_types = ['plain']
 
+            if self._plain_hosts is not None:
+                # all encrypted connections failed, plain is tried alone
+                self._connection_types = ['plain']
+            elif self._can_race_connections():
+                self._race_connections()
+                return
+
             host = self._select_next_host(self._hosts)
             self._current_host = host
             self._hosts.remove(host)
@@ -1279,40 +1304,11 @@ class Connection(CommonConnection, ConnectionHandlers):
                 self.last_connection = None
                 self.connection = None
 
-            if self._current_type == 'ssl':
-                # SSL (force TLS on different port than plain)
-                # If we do TLS over BOSH, port of XMPP server should be the standard one
-                # and TLS should be negotiated because TLS on 5223 is deprecated
-                if self._proxy and self._proxy['type']=='bosh':
-                    port = self._current_host['port']
-                else:
-                    port = self._current_host['ssl_port']
-            elif self._current_type == 'tls':
-                # TLS - negotiate tls after XMPP stream is estabilished
-                port = self._current_host['port']
-            elif self._current_type == 'plain':
-                # plain connection on defined port
-                port = self._current_host['port']
-
-            cacerts = os.path.join(common.gajim.DATA_DIR, 'other', 'cacerts.pem')
-            if not os.path.exists(cacerts):
-                cacerts = ''
-            mycerts = common.gajim.MY_CACERTS
-            tls_version = gajim.config.get_per('accounts', self.name,
-                'tls_version')
-            cipher_list = gajim.config.get_per('accounts', self.name,
-                'cipher_list')
-            secure_tuple = (self._current_type, cacerts, mycerts, tls_version, cipher_list)
-
-            con = nbxmpp.NonBlockingClient(
-                domain=self._hostname,
-                caller=self,
-                idlequeue=gajim.idlequeue)
+            port = self._get_port(self._current_host, self._current_type)
+            secure_tuple = self._get_secure_tuple(self._current_type)
+            con = self._create_client()
 
             self.last_connection = con
-            # increase default timeout for server responses
-            nbxmpp.dispatcher_nb.DEFAULT_TIMEOUT_SECONDS = \
-                self.try_connecting_for_foo_secs
             # FIXME: this is a hack; need a better way
             if self.on_connect_success == self._on_new_account:
                 con.RegisterDisconnectHandler(self._on_new_account)
@@ -1328,6 +1324,143 @@ class Connection(CommonConnection, ConnectionHandlers):
         else:
             self._connect_to_next_host(retry)
 
+    def _get_port(self, host, type_):
+        if type_ == 'ssl':
+            # SSL (force TLS on different port than plain)
+            # If we do TLS over BOSH, port of XMPP server should be the standard one
+            # and TLS should be negotiated because TLS on 5223 is deprecated
+            if self._proxy and self._proxy['type']=='bosh':
+                return host['port']
+            return host['ssl_port']
+        # TLS - negotiate tls after XMPP stream is estabilished
+        # plain - plain connection on defined port
+        return host['port']
+
+    def _get_secure_tuple(self, type_):
+        cacerts = os.path.join(common.gajim.DATA_DIR, 'other', 'cacerts.pem')
+        if not os.path.exists(cacerts):
+            cacerts = ''
+        mycerts = common.gajim.MY_CACERTS
+        tls_version = gajim.config.get_per('accounts', self.name,
+            'tls_version')
+        cipher_list = gajim.config.get_per('accounts', self.name,
+            'cipher_list')
+        return (type_, cacerts, mycerts, tls_version, cipher_list)
+
+    def _create_client(self):
+        con = nbxmpp.NonBlockingClient(
+            domain=self._hostname,
+            caller=self,
+            idlequeue=gajim.idlequeue)
+        # increase default timeout for server responses
+        nbxmpp.dispatcher_nb.DEFAULT_TIMEOUT_SECONDS = \
+            self.try_connecting_for_foo_secs
+        return con
+
+    def _can_race_connections(self):
+        """
+        Whether all hosts and connection types can be tried at once instead of
+        one after the other
+        """
+        if self.name not in gajim.config.get_per('accounts'):
+            # new account, _on_new_account must see each failure
+            return False
+        if not gajim.config.get_per('accounts', self.name, 'race_connections'):
+            return False
+        if self._proxy or self.redirected:
+            return False
+        if self.on_connect_success == self._on_new_account:
+            return False
+        if self.client_cert and gajim.config.get_per('accounts', self.name,
+        'client_cert_encrypted'):
+            # we would ask the passphrase for each attempt
+            return False
+        secure_types = [t for t in self._connection_types if t != 'plain']
+        return len(self._hosts) * len(secure_types) > 1
+
+    def _race_connections(self):
+        """
+        Try all hosts with all encrypted connection types at once. A plain
+        connection would win against slower encrypted ones, so plain is only
+        tried afterwards, one host after the other
+        """
+        candidates = []
+        hosts = self._hosts
+        self._hosts = []
+        if 'plain' in self._connection_types:
+            self._plain_hosts = list(hosts)
+        while hosts:
+            host = self._select_next_host(hosts)
+            hosts.remove(host)
+            for type_ in self._connection_types:
+                if type_ == 'plain':
+                    continue
+                candidates.append({'host': host, 'type': type_,
+                    'port': self._get_port(host, type_)})
+        # try what worked last time first
+        last = gajim.config.get_per('accounts', self.name,
+            'last_connection_host').split()
+        if len(last) == 3:
+            for candidate in candidates:
+                if [candidate['host']['host'], str(candidate['port']),
+                candidate['type']] == last:
+                    candidates.remove(candidate)
+                    candidates.insert(0, candidate)
+                    break
+        log.info('Racing %d connections for %s', len(candidates), self.name)
+        self.client_cert_passphrase = ''
+        self._racer = ConnectionRacer(candidates, self._start_race_attempt,
+            self._cancel_race_attempt, self._on_race_won, self._on_race_lost)
+        self._racer.start()
+
+    def _start_race_attempt(self, candidate, on_success, on_failure):
+        log.info('>>>>>> Connecting to %s [%s:%d], type = %s', self.name,
+            candidate['host']['host'], candidate['port'], candidate['type'])
+        con = self._create_client()
+        con.connect(
+            hostname=candidate['host']['host'],
+            port=candidate['port'],
+            on_connect=on_success,
+            on_proxy_failure=self.on_proxy_failure,
+            on_connect_failure=on_failure,
+            on_stream_error_cb=self._StreamCB,
+            proxy=None,
+            secure_tuple=self._get_secure_tuple(candidate['type']))
+        return con
+
+    def _cancel_race_attempt(self, con):
+        if con.socket:
+            con.socket.disconnect()
+
+    def _on_race_won(self, candidate, con, con_type):
+        # types not tried yet for this host, see connection_accepted()
+        self._connection_types = [c['type'] for c in self._racer.pending if \
+            c['host'] is candidate['host']]
+        self._racer = None
+        self._plain_hosts = None
+        self._current_host = candidate['host']
+        self._current_type = candidate['type']
+        self.last_connection = con
+        gajim.config.set_per('accounts', self.name, 'last_connection_host',
+            '%s %s %s' % (candidate['host']['host'], candidate['port'],
+            candidate['type']))
+        return self.on_connect_success(con, con_type)
+
+    def _on_race_lost(self, retry=False):
+        self._racer = None
+        self._connection_types = []
+        if self.redirected:
+            self.connect_to_next_type()
+            return
+        if self._plain_hosts:
+            log.info('All encrypted connections failed for %s, trying plain',
+                self.name)
+            self._hosts = self._plain_hosts
+            self._plain_hosts = []
+        else:
+            self._plain_hosts = None
+        self._connect_to_next_host(retry)
+
     def on_client_cert_passphrase(self, passphrase, con, port, secure_tuple):
         self.client_cert_passphrase = passphrase
 
@@ -1903,14 +2036,7 @@ class Connection(CommonConnection, ConnectionHandlers):
         gajim.nec.push_incoming_event(OurShowEvent(None, conn=self,
             show='invisible'))
         if initial:
-            # ask our VCard
-            self.request_vcard(None)
-
-            # Get bookmarks from private namespace
-            self.get_bookmarks()
-
-            # Get annotations
-            self.get_annotations()
+            self._first_presence_sent()
 
             # Inform GUI we just signed in
             gajim.nec.push_incoming_event(SignedInEvent(None, conn=self))
@@ -1943,8 +2069,7 @@ class Connection(CommonConnection, ConnectionHandlers):
         # If we are not resuming, we ask for discovery info
         # and archiving preferences
         if not self.sm.supports_sm or (not self.sm.resuming and self.sm.enabled):
-            self.discoverInfo(gajim.config.get_per('accounts', self.name,
-                'hostname'), id_prefix='Gajim_')
+            self._start_bootstrap()
 
         self.sm.resuming = False # back to previous state
         # Discover Stun server(s)
@@ -1955,6 +2080,52 @@ class Connection(CommonConnection, ConnectionHandlers):
         if len(result_array) != 0:
             self._stun_servers = self._hosts = [i for i in result_array]
 
+    def _start_bootstrap(self):
+        """
+        Send the requests needed before we can send our first presence. Only
+        requests that need the answer of another one wait for it
+        """
+        if self._bootstrap:
+            self._bootstrap.cancel()
+        hostname = gajim.config.get_per('accounts', self.name, 'hostname')
+        b = Bootstrap(self.name, on_finished=self._on_bootstrap_finished)
+        b.add_step('disco', lambda: self.discoverInfo(hostname,
+            id_prefix='Gajim_'))
+        b.add_step('metacontacts', self.get_metacontacts)
+        b.add_step('delimiter', self.get_roster_delimiter)
+        b.add_step('annotations', self.get_annotations, wait=False)
+        # privacy and blocking lists support is known with disco info
+        b.add_step('privacy', self._continue_connection_request_privacy,
+            requires=('disco',))
+        # roster items are parsed with metacontacts and group delimiter
+        b.add_step('roster', self.request_roster,
+            requires=('metacontacts', 'delimiter'))
+        b.add_step('presence', self._start_first_presence,
+            requires=('roster', 'privacy'))
+        # our vCard may make us send a new presence and bookmarks may join
+        # rooms, so they wait for the first presence
+        b.add_step('own_data', self._request_own_data, requires=('presence',),
+            wait=False)
+        self._bootstrap = b
+        b.start()
+
+    def _bootstrap_done(self, step):
+        if self._bootstrap:
+            self._bootstrap.done(step)
+
+    def _on_bootstrap_finished(self, bootstrap):
+        self.bootstrap_timings = bootstrap.get_timings()
+        if self._bootstrap is bootstrap:
+            self._bootstrap = None
+
+    def _request_own_data(self):
+        if self.vcard_supported:
+            # ask our VCard
+            self.request_vcard(None)
+
+        # Get bookmarks from private namespace
+        self.get_bookmarks()
+
     def _request_privacy(self):
         if not gajim.account_is_connected(self.name) or not self.connection:
             return
@@ -1990,14 +2161,13 @@ class Connection(CommonConnection, ConnectionHandlers):
                 iq.setID(id2_)
                 self.awaiting_answers[id2_] = (BLOCKING_ARRIVED, )
                 self.connection.send(iq)
-            # Ask metacontacts before roster
-            self.get_metacontacts()
+            self._bootstrap_done('privacy')
 
     def _nec_agent_info_error_received(self, obj):
         if obj.conn.name != self.name:
             return
         if obj.id_[:6] == 'Gajim_':
-            self._continue_connection_request_privacy()
+            self._bootstrap_done('disco')
 
     def _nec_agent_info_received(self, obj):
         if obj.conn.name != self.name:
@@ -2091,7 +2261,7 @@ class Connection(CommonConnection, ConnectionHandlers):
                     self.available_transports[transport_type].append(obj.fjid)
                 else:
                     self.available_transports[transport_type] = [obj.fjid]
-            self._continue_connection_request_privacy()
+            self._bootstrap_done('disco')
 
     def send_custom_status(self, show, msg, jid):
         if not show in gajim.SHOW_LIST:
@@ -32,6 +32,7 @@ import os
 import base64
 import operator
 import hashlib
+from collections import OrderedDict
 
 from time import (altzone, daylight, gmtime, localtime, strftime,
         time as time_time, timezone, tzname)
@@ -57,6 +58,7 @@ from common.message_archiving import ConnectionArchive313
 from common.connection_handlers_events import *
 
 from common import ged
+from common import gpg_worker
 from common import nec
 from common.nec import NetworkEvent
 
@@ -75,6 +77,11 @@ DELIMITER_ARRIVED = 'delimiter_arrived'
 PRIVACY_ARRIVED = 'privacy_arrived'
 BLOCKING_ARRIVED = 'blocking_arrived'
 PEP_CONFIG = 'pep_config'
+# number of received message hashes remembered to ignore duplicates (about 24
+# hours if you receive a message every 5 seconds)
+MESSAGE_HASHES_SIZE = 20000
+# seconds between two writes of the new received message hashes
+MESSAGE_HASHES_FLUSH_INTERVAL = 10
 HAS_IDLE = True
 try:
 #       import idle
@@ -526,26 +533,25 @@ class ConnectionVcard:
             else:
                 if iq_obj.getErrorCode() not in ('403', '406', '404'):
                     self.private_storage_supported = False
-            self.get_roster_delimiter()
             del self.awaiting_answers[id_]
+            self._bootstrap_done('metacontacts')
         elif self.awaiting_answers[id_][0] == DELIMITER_ARRIVED:
             del self.awaiting_answers[id_]
             if not self.connection:
                 return
             if iq_obj.getType() == 'result':
                 query = iq_obj.getTag('query')
-                if not query:
-                    return
-                delimiter = query.getTagData('roster')
-                if delimiter:
-                    self.nested_group_delimiter = delimiter
-                else:
-                    self.set_roster_delimiter('::')
+                if query:
+                    delimiter = query.getTagData('roster')
+                    if delimiter:
+                        self.nested_group_delimiter = delimiter
+                    else:
+                        self.set_roster_delimiter('::')
             else:
                 self.private_storage_supported = False
 
             # We can now continue connection by requesting the roster
-            self.request_roster()
+            self._bootstrap_done('delimiter')
         elif self.awaiting_answers[id_][0] == ROSTER_ARRIVED:
             if iq_obj.getType() == 'result':
                 if not iq_obj.getTag('query'):
@@ -569,8 +575,7 @@ class ConnectionVcard:
             del self.awaiting_answers[id_]
             if iq_obj.getType() != 'error':
                 self.get_privacy_list('block')
-                # Ask metacontacts before roster
-                self.get_metacontacts()
+                self._bootstrap_done('privacy')
             else:
                 # That should never happen, but as it's blocking in the
                 # connection process, we don't take the risk
@@ -860,6 +865,73 @@ class ConnectionPEP(object):
         self._pubsub_connection.send_pb_retract('', nbxmpp.NS_LOCATION, '0')
 
 # basic connection handlers used here and in zeroconf
+class ReceivedMessageHashes:
+    """
+    Hashes of the last received messages, used to ignore duplicates
+
+    Once load() has been called, hashes are also stored in the cache
+    database, so that messages received again after a restart (from MAM or
+    carbons) are ignored too. They are written together every
+    MESSAGE_HASHES_FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self, maxlen=MESSAGE_HASHES_SIZE):
+        self.maxlen = maxlen
+        self._hashes = OrderedDict()
+        self._account = None
+        # hashes not written to the database yet
+        self._unsaved = []
+        self._flush_timeout_id = None
+
+    def load(self, account):
+        if self._account == account:
+            return
+        self._account = account
+        for hash_ in gajim.logger.get_received_message_hashes(account,
+        self.maxlen):
+            self._hashes[hash_] = None
+        while len(self._hashes) > self.maxlen:
+            self._hashes.popitem(last=False)
+
+    def __contains__(self, hash_):
+        return hash_ in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, hash_):
+        if hash_ in self._hashes:
+            return
+        self._hashes[hash_] = None
+        if len(self._hashes) > self.maxlen:
+            self._hashes.popitem(last=False)
+        if self._account:
+            self._unsaved.append(hash_)
+            if not self._flush_timeout_id:
+                self._flush_timeout_id = GLib.timeout_add_seconds(
+                    MESSAGE_HASHES_FLUSH_INTERVAL, self.flush)
+
+    def clear(self):
+        """
+        Forget all hashes and stop storing them in the database
+        """
+        self.flush()
+        self._hashes.clear()
+        self._account = None
+
+    def flush(self):
+        """
+        Write the new hashes to the database
+        """
+        if self._flush_timeout_id:
+            GLib.source_remove(self._flush_timeout_id)
+            self._flush_timeout_id = None
+        if self._unsaved:
+            gajim.logger.add_received_message_hashes(self._account,
+                self._unsaved)
+            self._unsaved = []
+        return False
+
 class ConnectionHandlersBase:
     def __init__(self):
         # List of IDs we are waiting answers for {id: (type_of_request, data), }
@@ -879,10 +951,14 @@ class ConnectionHandlersBase:
         # IDs of sent messages (https://trac.gajim.org/ticket/8222)
         self.sent_message_ids = []
 
-        self.received_message_hashes = []
+        self.received_message_hashes = ReceivedMessageHashes()
 
-        # We decrypt GPG messages one after the other. Keep queue in mem
+        # GPG messages are decrypted in parallel but delivered in the order
+        # they arrived. Keep queue in mem: [[obj, event class, decrypted]]
         self.gpg_messages_to_decrypt = []
+        # {(status, signature): [(jid, resource)]} of signed presences being
+        # verified
+        self.gpg_presences_to_verify = {}
 
         gajim.ged.register_event_handler('iq-error-received', ged.CORE,
             self._nec_iq_error_received)
@@ -896,6 +972,8 @@ class ConnectionHandlersBase:
             self._nec_mam_message_received)
         gajim.ged.register_event_handler('decrypted-message-received', ged.CORE,
             self._nec_decrypted_message_received)
+        gajim.ged.register_event_handler('gpg-presence-verified', ged.CORE,
+            self._nec_gpg_presence_verified)
 
     def cleanup(self):
         gajim.ged.remove_event_handler('iq-error-received', ged.CORE,
@@ -910,6 +988,9 @@ class ConnectionHandlersBase:
             self._nec_mam_message_received)
         gajim.ged.remove_event_handler('decrypted-message-received', ged.CORE,
             self._nec_decrypted_message_received)
+        gajim.ged.remove_event_handler('gpg-presence-verified', ged.CORE,
+            self._nec_gpg_presence_verified)
+        self.received_message_hashes.flush()
 
     def _nec_iq_error_received(self, obj):
         if obj.conn.name != self.name:
@@ -955,7 +1036,9 @@ class ConnectionHandlersBase:
                 else:
                     self.vcard_shas[obj.jid] = ''
             if obj.avatar_sha != self.vcard_shas[obj.jid]:
-                # avatar has been updated
+                # avatar has been updated, don't show the old one while we
+                # get the new one
+                gajim.interface.forget_avatar(obj.jid)
                 self.request_vcard(obj.jid)
 
         if obj.contact:
@@ -1086,13 +1169,65 @@ class ConnectionHandlersBase:
             if sess.enable_encryption:
                 sess.terminate_e2e()
 
+    def verify_gpg_presence(self, jid, resource, status, signature):
+        """
+        Verify the signature of a presence in a GPG worker thread.
+        GPGPresenceVerifiedEvent is pushed with the result
+        """
+        key = (status, signature)
+        waiting = self.gpg_presences_to_verify.setdefault(key, [])
+        waiting.append((jid, resource))
+        if len(waiting) == 1:
+            gpg_worker.get_pool().submit(self.gpg.verify,
+                [status, signature, jid], self._on_gpg_presence_verified,
+                [key])
+
+    def _on_gpg_presence_verified(self, keyID, key):
+        waiting = self.gpg_presences_to_verify.pop(key, [])
+        if self.connected < 2:
+            return
+        for jid, resource in waiting:
+            gajim.nec.push_incoming_event(GPGPresenceVerifiedEvent(None,
+                conn=self, jid=jid, resource=resource, status=key[0],
+                keyID=keyID or ''))
+
+    def _nec_gpg_presence_verified(self, obj):
+        if obj.conn.name != self.name:
+            return
+        contact = gajim.contacts.get_contact(self.name, obj.jid, obj.resource)
+        if not contact or contact.status != obj.status:
+            # A newer presence arrived in the meantime
+            return True
+        keyID = helpers.prepare_and_validate_gpg_keyID(self.name, obj.jid,
+            obj.keyID)
+        attached_keys = gajim.config.get_per('accounts', self.name,
+            'attached_gpg_keys').split()
+        if obj.jid in attached_keys or contact.keyID == keyID:
+            # Do not override assigned key, nothing to redraw
+            return True
+        contact.keyID = keyID
+
     def decrypt_thread(self, encmsg, keyID, obj):
         decmsg = self.gpg.decrypt(encmsg, keyID)
         decmsg = self.connection.Dispatcher.replace_non_character(decmsg)
         # \x00 chars are not allowed in C (so in GTK)
         obj.msgtxt = decmsg.replace('\x00', '')
         obj.encrypted = 'xep27'
-        self.gpg_messages_to_decrypt.remove([encmsg, keyID, obj])
+
+    def _decrypt_gpg_message(self, encmsg, keyID, obj, event_class):
+        entry = [obj, event_class, False]
+        self.gpg_messages_to_decrypt.append(entry)
+        gpg_worker.get_pool().submit(self.decrypt_thread, [encmsg, keyID, obj],
+            self._on_gpg_message_decrypted, [entry])
+
+    def _on_gpg_message_decrypted(self, output, entry):
+        entry[2] = True
+        # Push the messages that are decrypted and not waiting for an older one
+        while self.gpg_messages_to_decrypt and \
+        self.gpg_messages_to_decrypt[0][2]:
+            obj, event_class, decrypted = self.gpg_messages_to_decrypt.pop(0)
+            gajim.nec.push_incoming_event(event_class(None, conn=self,
+                msg_obj=obj))
 
     def _nec_message_received(self, obj):
         if obj.conn.name != self.name:
@@ -1111,10 +1246,8 @@ class ConnectionHandlersBase:
 
             keyID = gajim.config.get_per('accounts', self.name, 'keyid')
             if keyID:
-                self.gpg_messages_to_decrypt.append([encmsg, keyID, obj])
-                if len(self.gpg_messages_to_decrypt) == 1:
-                    gajim.thread_interface(self.decrypt_thread, [encmsg, keyID,
-                        obj], self._on_message_decrypted, [obj])
+                self._decrypt_gpg_message(encmsg, keyID, obj,
+                    DecryptedMessageReceivedEvent)
                 return
         gajim.nec.push_incoming_event(DecryptedMessageReceivedEvent(None,
             conn=self, msg_obj=obj))
@@ -1127,38 +1260,12 @@ class ConnectionHandlersBase:
 
             keyID = gajim.config.get_per('accounts', self.name, 'keyid')
             if keyID:
-                self.gpg_messages_to_decrypt.append([encmsg, keyID, obj])
-                if len(self.gpg_messages_to_decrypt) == 1:
-                    gajim.thread_interface(self.decrypt_thread, [encmsg, keyID,
-                        obj], self._on_mam_message_decrypted, [obj])
+                self._decrypt_gpg_message(encmsg, keyID, obj,
+                    MamDecryptedMessageReceivedEvent)
                 return
         gajim.nec.push_incoming_event(MamDecryptedMessageReceivedEvent(None,
             conn=self, msg_obj=obj))
 
-    def _on_message_decrypted(self, output, obj):
-        if len(self.gpg_messages_to_decrypt):
-            encmsg, keyID, obj2 = self.gpg_messages_to_decrypt[0]
-            if type(obj2) == MessageReceivedEvent:
-                cb = self._on_message_decrypted
-            else:
-                cb = self._on_mam_message_decrypted
-            gajim.thread_interface(self.decrypt_thread, [encmsg, keyID, obj2],
-                cb, [obj2])
-        gajim.nec.push_incoming_event(DecryptedMessageReceivedEvent(None,
-            conn=self, msg_obj=obj))
-
-    def _on_mam_message_decrypted(self, output, obj):
-        if len(self.gpg_messages_to_decrypt):
-            encmsg, keyID, obj2 = self.gpg_messages_to_decrypt[0]
-            if type(obj2) == MessageReceivedEvent:
-                cb = self._on_message_decrypted
-            else:
-                cb = self._on_mam_message_decrypted
-            gajim.thread_interface(self.decrypt_thread, [encmsg, keyID, obj2],
-                cb, [obj2])
-        gajim.nec.push_incoming_event(MamDecryptedMessageReceivedEvent(None,
-            conn=self, msg_obj=obj))
-
     def _nec_decrypted_message_received(self, obj):
         if obj.conn.name != self.name:
             return
@@ -2100,21 +2207,11 @@ ConnectionHandlersBase, ConnectionJingle, ConnectionIBBytestream):
             return
         our_jid = gajim.get_jid_from_account(self.name)
         if self.connected > 1 and self.continue_connect_info:
-            msg = self.continue_connect_info[1]
-            sign_msg = self.continue_connect_info[2]
-            signed = ''
-            send_first_presence = True
-            if sign_msg:
-                signed = self.get_signed_presence(msg,
-                    self._send_first_presence)
-                if signed is None:
-                    gajim.nec.push_incoming_event(GPGPasswordRequiredEvent(None,
-                        conn=self, callback=self._send_first_presence))
-                    # _send_first_presence will be called when user enter
-                    # passphrase
-                    send_first_presence = False
-            if send_first_presence:
-                self._send_first_presence(signed)
+            if self._bootstrap and self._bootstrap.is_waiting_for('roster'):
+                # first presence is sent once privacy lists are known too
+                self._bootstrap_done('roster')
+            else:
+                self._start_first_presence()
 
         if obj.received_from_server:
             for jid in obj.roster:
@@ -2137,6 +2234,30 @@ ConnectionHandlersBase, ConnectionJingle, ConnectionIBBytestream):
                 sub=info['subscription'], ask=info['ask'],
                 groups=info['groups']))
 
+    def _start_first_presence(self):
+        if not self.continue_connect_info:
+            return
+        msg = self.continue_connect_info[1]
+        sign_msg = self.continue_connect_info[2]
+        signed = ''
+        if sign_msg:
+            signed = self.get_signed_presence(msg, self._send_first_presence)
+            if signed is None:
+                gajim.nec.push_incoming_event(GPGPasswordRequiredEvent(None,
+                    conn=self, callback=self._send_first_presence))
+                # _send_first_presence will be called when user enter
+                # passphrase
+                return
+        self._send_first_presence(signed)
+
+    def _first_presence_sent(self):
+        if self._bootstrap and self._bootstrap.is_waiting_for('presence'):
+            self._bootstrap_done('presence')
+        else:
+            self._request_own_data()
+            # Get annotations from private namespace
+            self.get_annotations()
+
     def _send_first_presence(self, signed=''):
         show = self.continue_connect_info[0]
         msg = self.continue_connect_info[1]
@@ -2173,22 +2294,16 @@ ConnectionHandlersBase, ConnectionJingle, ConnectionIBBytestream):
             self.priority = priority
         gajim.nec.push_incoming_event(OurShowEvent(None, conn=self,
             show=show))
-        if self.vcard_supported:
-            # ask our VCard
-            self.request_vcard(None)
-
-        # Get bookmarks from private namespace
-        self.get_bookmarks()
-
-        # Get annotations from private namespace
-        self.get_annotations()
+        self._first_presence_sent()
 
         # Inform GUI we just signed in
         gajim.nec.push_incoming_event(SignedInEvent(None, conn=self))
         self.send_awaiting_pep()
         self.continue_connect_info = None
-        # hashes of already received messages
-        self.received_message_hashes = []
+        if gajim.config.get('remember_received_message_hashes'):
+            self.received_message_hashes.load(self.name)
+        else:
+            self.received_message_hashes.clear()
 
     def request_gmail_notifications(self):
         if not self.connection or self.connected < 2:
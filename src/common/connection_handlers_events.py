@@ -554,6 +554,7 @@ class PrivateStorageBookmarksReceivedEvent(nec.NetworkIncomingEvent,
 BookmarksHelper):
     name = 'private-storage-bookmarks-received'
     base_network_events = ['private-storage-received']
+    skippable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -567,6 +568,7 @@ class BookmarksReceivedEvent(nec.NetworkIncomingEvent):
     name = 'bookmarks-received'
     base_network_events = ['private-storage-bookmarks-received',
         'pubsub-bookmarks-received']
+    skippable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -576,6 +578,7 @@ class BookmarksReceivedEvent(nec.NetworkIncomingEvent):
 class PrivateStorageRosternotesReceivedEvent(nec.NetworkIncomingEvent):
     name = 'private-storage-rosternotes-received'
     base_network_events = ['private-storage-received']
+    skippable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -597,6 +600,7 @@ class PrivateStorageRosternotesReceivedEvent(nec.NetworkIncomingEvent):
 class RosternotesReceivedEvent(nec.NetworkIncomingEvent):
     name = 'rosternotes-received'
     base_network_events = ['private-storage-rosternotes-received']
+    skippable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -626,6 +630,7 @@ class PubsubReceivedEvent(nec.NetworkIncomingEvent):
 class PubsubBookmarksReceivedEvent(nec.NetworkIncomingEvent, BookmarksHelper):
     name = 'pubsub-bookmarks-received'
     base_network_events = ['pubsub-received']
+    skippable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -715,6 +720,7 @@ class StreamReceivedEvent(nec.NetworkIncomingEvent):
 class StreamConflictReceivedEvent(nec.NetworkIncomingEvent):
     name = 'stream-conflict-received'
     base_network_events = ['stream-received']
+    skippable = True
 
     def generate(self):
         if self.base_event.stanza.getTag('conflict'):
@@ -724,6 +730,7 @@ class StreamConflictReceivedEvent(nec.NetworkIncomingEvent):
 class StreamOtherHostReceivedEvent(nec.NetworkIncomingEvent):
     name = 'stream-other-host-received'
     base_network_events = ['stream-received']
+    skippable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -769,11 +776,19 @@ PresenceHelperEvent):
 
     def _generate_keyID(self, sig_tag):
         self.keyID = ''
-        if sig_tag and self.conn.USE_GPG and self.ptype != 'error':
-            # error presences contain our own signature
+        # error presences contain our own signature, the key of groupchat
+        # occupants is not used
+        if sig_tag and self.conn.USE_GPG and self.ptype != 'error' and \
+        not self.is_gc:
             # verify
             sig_msg = sig_tag.getData()
-            self.keyID = self.conn.gpg.verify(self.status, sig_msg)
+            self.keyID = self.conn.gpg.get_verified(self.status, sig_msg)
+            if self.keyID is None:
+                # Not seen yet, gpg is run in a worker thread and the contact
+                # is updated by GPGPresenceVerifiedEvent
+                self.conn.verify_gpg_presence(self.jid, self.resource,
+                    self.status, sig_msg)
+                self.keyID = ''
             self.keyID = helpers.prepare_and_validate_gpg_keyID(self.conn.name,
                                                                 self.jid,
                                                                 self.keyID)
@@ -885,6 +900,10 @@ PresenceHelperEvent):
             elif self.jid in jid_list or self.jid == our_jid:
                 return True
 
+class GPGPresenceVerifiedEvent(nec.NetworkIncomingEvent):
+    name = 'gpg-presence-verified'
+    base_network_events = []
+
 class ZeroconfPresenceReceivedEvent(nec.NetworkIncomingEvent):
     name = 'presence-received'
     base_network_events = []
@@ -1046,6 +1065,7 @@ class MamMessageReceivedEvent(nec.NetworkIncomingEvent, HelperEvent):
 
     def init(self):
         self.additional_data = {}
+        self.archive_id = None
     
     def generate(self):
         if not self.stanza:
@@ -1093,6 +1113,7 @@ class MamDecryptedMessageReceivedEvent(nec.NetworkIncomingEvent, HelperEvent):
         self.with_ = self.msg_obj.with_
         self.direction = self.msg_obj.direction
         self.tim = self.msg_obj.tim
+        self.archive_id = self.msg_obj.archive_id
         res = self.msg_obj.resource
         self.msgtxt = self.msg_obj.msgtxt
         is_pm = gajim.logger.jid_is_room_jid(self.with_)
@@ -1111,12 +1132,12 @@ class MamDecryptedMessageReceivedEvent(nec.NetworkIncomingEvent, HelperEvent):
                 if server not in self.conn.mam_awaiting_disco_result:
                     self.conn.mam_awaiting_disco_result[server] = [
                         [self.with_, self.direction, self.tim, self.msgtxt,
-                        res]]
+                        res, self.additional_data, self.archive_id]]
                     self.conn.discoverInfo(server)
                 else:
                     self.conn.mam_awaiting_disco_result[server].append(
                         [self.with_, self.direction, self.tim, self.msgtxt,
-                        res])
+                        res, self.additional_data, self.archive_id])
                 return
         return True
 
@@ -1207,7 +1228,8 @@ class MessageReceivedEvent(nec.NetworkIncomingEvent, HelperEvent):
         if result:
             forwarded = result.getTag('forwarded', namespace=nbxmpp.NS_FORWARD)
             gajim.nec.push_incoming_event(MamMessageReceivedEvent(None,
-                conn=self.conn, stanza=forwarded))
+                conn=self.conn, stanza=forwarded,
+                archive_id=result.getAttr('id')))
             return
 
         self.enc_tag = self.stanza.getTag('x', namespace=nbxmpp.NS_ENCRYPTED)
@@ -1490,20 +1512,13 @@ class DecryptedMessageReceivedEvent(nec.NetworkIncomingEvent, HelperEvent):
 
         # ignore message duplicates
         if self.msgtxt and self.id_ and self.jid:
-            self.msghash = hashlib.sha256(("%s|%s|%s" % (
-                hashlib.sha256(self.msgtxt.encode('utf-8')).hexdigest(),
-                hashlib.sha256(self.id_.encode('utf-8')).hexdigest(),
-                hashlib.sha256(self.jid.encode('utf-8')).hexdigest())).encode(
-                'utf-8')).digest()
+            self.msghash = hashlib.sha256('\0'.join((self.msgtxt, self.id_,
+                self.jid)).encode('utf-8')).digest()
             if self.msghash in self.conn.received_message_hashes:
-                log.info("Ignoring duplicated message from '%s' with id '%s'" % (self.jid, self.id_))
+                log.info("Ignoring duplicated message from '%s' with id '%s'",
+                    self.jid, self.id_)
                 return False
-            else:
-                log.debug("subhashes: msgtxt, id_, jid = ('%s', '%s', '%s')" % (hashlib.sha256(self.msgtxt.encode('utf-8')).hexdigest(), hashlib.sha256(self.id_.encode('utf-8')).hexdigest(), hashlib.sha256(self.jid.encode('utf-8')).hexdigest()))
-                self.conn.received_message_hashes.append(self.msghash)
-                # only record the last 20000 hashes (should be about 1MB [32 bytes per hash]
-                # and about 24 hours if you receive a message every 5 seconds)
-                self.conn.received_message_hashes = self.conn.received_message_hashes[-20000:]
+            self.conn.received_message_hashes.add(self.msghash)
         return True
 
 class ChatstateReceivedEvent(nec.NetworkIncomingEvent):
@@ -1734,6 +1749,7 @@ class ArchivingReceivedEvent(nec.NetworkIncomingEvent):
 class ArchivingErrorReceivedEvent(nec.NetworkIncomingEvent):
     name = 'archiving-error-received'
     base_network_events = ['archiving-received']
+    skippable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -1747,6 +1763,7 @@ class ArchivingErrorReceivedEvent(nec.NetworkIncomingEvent):
 class ArchivingPreferencesChangedReceivedEvent(nec.NetworkIncomingEvent):
     name = 'archiving-preferences-changed-received'
     base_network_events = ['archiving-received']
+    skippable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -1800,6 +1817,7 @@ class ArchivingPreferencesChangedReceivedEvent(nec.NetworkIncomingEvent):
 class Archiving313PreferencesChangedReceivedEvent(nec.NetworkIncomingEvent):
     name = 'archiving-313-preferences-changed-received'
     base_network_events = ['archiving-received']
+    skippable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -1826,6 +1844,17 @@ class Archiving313PreferencesChangedReceivedEvent(nec.NetworkIncomingEvent):
             return
         return True
 
+class MamCatchupProgressEvent(nec.NetworkIncomingEvent):
+    name = 'mam-catchup-progress'
+    base_network_events = []
+
+    def generate(self):
+        if self.elapsed > 0:
+            self.rate = self.nb_messages / self.elapsed
+        else:
+            self.rate = 0
+        return True
+
 class AccountCreatedEvent(nec.NetworkIncomingEvent):
     name = 'account-created'
     base_network_events = []
@@ -1938,6 +1967,7 @@ class CapsPresenceReceivedEvent(nec.NetworkIncomingEvent, HelperEvent,
 PresenceHelperEvent):
     name = 'caps-presence-received'
     base_network_events = ['raw-pres-received']
+    skippable = True
 
     def _extract_caps_from_presence(self):
         caps_tag = self.stanza.getTag('c', namespace=nbxmpp.NS_CAPS)
@@ -1967,6 +1997,7 @@ class CapsDiscoReceivedEvent(nec.NetworkIncomingEvent):
 class CapsReceivedEvent(nec.NetworkIncomingEvent):
     name = 'caps-received'
     base_network_events = ['caps-presence-received', 'caps-disco-received']
+    skippable = True
 
     def generate(self):
         self.conn = self.base_event.conn
@@ -0,0 +1,137 @@
+##      common/connection_racer.py
+##
+## This file is part of Gajim.
+##
+## Gajim is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published
+## by the Free Software Foundation; version 3 only.
+##
+## Gajim is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Gajim.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Try several ways to reach a server at once and keep the first one that works
+
+Connection attempts are started one after the other, separated by a short
+delay, without waiting for the previous one to fail or time out. When an
+attempt fails, the next one is started immediately. The first attempt to
+succeed wins, all others are cancelled.
+"""
+
+import logging
+log = logging.getLogger('gajim.c.connection_racer')
+
+from gi.repository import GLib
+
+# milliseconds to wait before starting the next attempt while the previous
+# ones are still running. Success means the XMPP stream (and TLS) is up, which
+# takes several round trips, so this is longer than the usual TCP delay.
+CONNECTION_RACE_DELAY = 1000
+
+
+class ConnectionRacer:
+    """
+    Race connection attempts to a list of candidates
+
+    start_attempt(candidate, on_success, on_failure) must start connecting
+    and return an object that is given to cancel_attempt() if the attempt
+    has to be aborted. on_won(candidate, *args) is called with the arguments
+    given to on_success by the winning attempt, on_lost(*args) with the
+    arguments of the last on_failure when all candidates failed.
+    """
+
+    def __init__(self, candidates, start_attempt, cancel_attempt, on_won,
+    on_lost, delay=CONNECTION_RACE_DELAY):
+        self.pending = list(candidates)
+        self.start_attempt = start_attempt
+        self.cancel_attempt = cancel_attempt
+        self.on_won = on_won
+        self.on_lost = on_lost
+        self.delay = delay
+        # dict {attempt id: [candidate, handle]}
+        self.attempts = {}
+        self.winner = None
+        self.finished = False
+        self._next_id = 0
+        self._timeout_id = None
+
+    def start(self):
+        self._start_next()
+
+    def cancel(self):
+        """
+        Abort all running attempts, no callback is called afterwards
+        """
+        self.finished = True
+        self._remove_timeout()
+        self._cancel_attempts()
+        self.pending = []
+
+    def _remove_timeout(self):
+        if self._timeout_id is not None:
+            GLib.source_remove(self._timeout_id)
+            self._timeout_id = None
+
+    def _cancel_attempts(self, keep=None):
+        attempts = self.attempts
+        self.attempts = {}
+        for id_, (candidate, handle) in attempts.items():
+            if id_ == keep or handle is None:
+                continue
+            log.debug('Cancelling connection attempt to %s', candidate)
+            self.cancel_attempt(handle)
+
+    def _start_next(self):
+        self._remove_timeout()
+        if self.finished or not self.pending:
+            return
+        candidate = self.pending.pop(0)
+        id_ = self._next_id
+        self._next_id += 1
+        # register the attempt before starting it: on_failure may be called
+        # before start_attempt returns
+        self.attempts[id_] = [candidate, None]
+        log.debug('Starting connection attempt to %s', candidate)
+        handle = self.start_attempt(candidate,
+            lambda *args: self._on_success(id_, *args),
+            lambda *args: self._on_failure(id_, *args))
+        if id_ in self.attempts:
+            self.attempts[id_][1] = handle
+        if self.pending and not self.finished and self._timeout_id is None:
+            self._timeout_id = GLib.timeout_add(self.delay, self._on_delay)
+
+    def _on_delay(self):
+        self._timeout_id = None
+        self._start_next()
+        return False
+
+    def _on_success(self, id_, *args):
+        if self.finished or id_ not in self.attempts:
+            # attempt was cancelled
+            return
+        candidate = self.attempts[id_][0]
+        log.info('Connection attempt to %s won', candidate)
+        self.winner = candidate
+        self.finished = True
+        self._remove_timeout()
+        # pending is kept so the caller can see what was not tried
+        self._cancel_attempts(keep=id_)
+        return self.on_won(candidate, *args)
+
+    def _on_failure(self, id_, *args):
+        if self.finished or id_ not in self.attempts:
+            return
+        log.debug('Connection attempt to %s failed', self.attempts[id_][0])
+        del self.attempts[id_]
+        if self.pending:
+            # don't wait for the delay, a failure frees the slot
+            self._start_next()
+        elif not self.attempts:
+            self.finished = True
+            self.on_lost(*args)
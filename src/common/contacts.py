@@ -393,6 +393,40 @@ class LegacyContactsAPI:
                     nbr_total += 1
         return nbr_online, nbr_total
 
+    def get_nb_online_total_contacts_by_group(self, accounts=None):
+        """
+        Return {group: [nb online, nb total]} for all groups, counted like
+        get_nb_online_total_contacts(accounts, [group]) but going through the
+        contacts only once
+        """
+        if not accounts:
+            accounts = self.get_accounts()
+        transports_group = _('Transports')
+        counters = {}
+        for account in accounts:
+            our_jid = common.gajim.get_jid_from_account(account)
+            for jid in self.get_jid_list(account):
+                if jid == our_jid:
+                    continue
+                is_transport = common.gajim.jid_is_transport(jid)
+                if self.has_brother(account, jid, accounts) and not \
+                self.is_big_brother(account, jid, accounts):
+                    # count metacontacts only once
+                    continue
+                contact = self._accounts[account].contacts._contacts[jid][0]
+                if _('Not in roster') in contact.groups:
+                    continue
+                online = contact.show not in ('offline', 'error')
+                for group in set(contact.get_shown_groups()):
+                    if is_transport and group != transports_group:
+                        # transports are only counted in their group
+                        continue
+                    counter = counters.setdefault(group, [0, 0])
+                    if online:
+                        counter[0] += 1
+                    counter[1] += 1
+        return counters
+
     def __getattr__(self, attr_name):
         # Only called if self has no attr_name
         if hasattr(self._metacontact_manager, attr_name):
@@ -545,41 +579,54 @@ class GC_Contacts():
     def __init__(self):
         # list of contacts that are in gc {room_jid: {nick: C}}}
         self._rooms = {}
+        # number of contacts per role {room_jid: {role: nb}}. Role changes
+        # are done by removing and adding the contact again.
+        self._roles = {}
 
     def add_gc_contact(self, gc_contact):
         if gc_contact.room_jid not in self._rooms:
             self._rooms[gc_contact.room_jid] = {gc_contact.name: gc_contact}
+            self._roles[gc_contact.room_jid] = {}
         else:
+            old_contact = self._rooms[gc_contact.room_jid].get(gc_contact.name)
+            if old_contact:
+                self._count_role(old_contact, -1)
             self._rooms[gc_contact.room_jid][gc_contact.name] = gc_contact
+        self._count_role(gc_contact, 1)
+
+    def _count_role(self, gc_contact, delta):
+        roles = self._roles[gc_contact.room_jid]
+        roles[gc_contact.role] = roles.get(gc_contact.role, 0) + delta
 
     def remove_gc_contact(self, gc_contact):
         if gc_contact.room_jid not in self._rooms:
             return
         if gc_contact.name not in self._rooms[gc_contact.room_jid]:
             return
+        self._count_role(self._rooms[gc_contact.room_jid][gc_contact.name], -1)
         del self._rooms[gc_contact.room_jid][gc_contact.name]
         # It was the last nick in room ?
         if not len(self._rooms[gc_contact.room_jid]):
             del self._rooms[gc_contact.room_jid]
+            del self._roles[gc_contact.room_jid]
 
     def remove_room(self, room_jid):
         if room_jid in self._rooms:
             del self._rooms[room_jid]
+            del self._roles[room_jid]
 
     def get_gc_list(self):
         return self._rooms.keys()
 
     def get_nick_list(self, room_jid):
-        gc_list = self.get_gc_list()
-        if not room_jid in gc_list:
+        if not room_jid in self._rooms:
             return []
         return list(self._rooms[room_jid].keys())
 
     def get_gc_contact(self, room_jid, nick):
-        nick_list = self.get_nick_list(room_jid)
-        if not nick in nick_list:
+        if room_jid not in self._rooms:
             return None
-        return self._rooms[room_jid][nick]
+        return self._rooms[room_jid].get(nick)
 
     def is_gc_contact(self, jid):
         """
@@ -603,12 +650,7 @@ class GC_Contacts():
         """
         if room_jid not in self._rooms:
             return 0, 0
-        nb_role = nb_total = 0
-        for nick in self._rooms[room_jid]:
-            if self._rooms[room_jid][nick].role == role:
-                nb_role += 1
-            nb_total += 1
-        return nb_role, nb_total
+        return self._roles[room_jid].get(role, 0), len(self._rooms[room_jid])
 
 
 class MetacontactManager():
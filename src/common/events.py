@@ -25,6 +25,8 @@
 ##
 
 import time
+import heapq
+import itertools
 
 class Event:
     """
@@ -183,6 +185,76 @@ class Events:
         self._events = {} # list of events {acct: {jid1: [E1, E2]}, }
         self._event_added_listeners = []
         self._event_removed_listeners = []
+        # Number of events, [all, shown in systray, shown in roster], indexed
+        # by (account, jid, type_). None in the key means any.
+        self._counters = {}
+        # Events sorted by time. Removed events are only dropped when they
+        # reach the top, so entries must be checked with _is_queued().
+        self._heap = []
+        self._systray_heap = []
+        self._heap_counter = itertools.count()
+
+    def _counter_keys(self, event):
+        account, jid, type_ = event.account, event.jid, event.type_
+        return ((account, jid, type_), (account, jid, None),
+            (account, None, type_), (account, None, None),
+            (None, jid, type_), (None, jid, None),
+            (None, None, type_), (None, None, None))
+
+    def _count_event(self, event, delta):
+        for key in self._counter_keys(event):
+            counts = self._counters.setdefault(key, [0, 0, 0])
+            counts[0] += delta
+            if event.show_in_systray:
+                counts[1] += delta
+            if event.show_in_roster:
+                counts[2] += delta
+            if not counts[0]:
+                del self._counters[key]
+
+    def _push_event(self, event):
+        entry = (event.time_, next(self._heap_counter), event)
+        heapq.heappush(self._heap, entry)
+        if event.show_in_systray:
+            heapq.heappush(self._systray_heap, entry)
+
+    def _is_queued(self, event):
+        return event in self._events.get(event.account, {}).get(event.jid, [])
+
+    def _rebuild_index(self):
+        """
+        Recompute counters and heaps from scratch
+        """
+        self._counters = {}
+        self._heap = []
+        self._systray_heap = []
+        for account in self._events:
+            for jid in self._events[account]:
+                for event in self._events[account][jid]:
+                    event.account = account
+                    event.jid = jid
+                    self._count_event(event, 1)
+                    self._push_event(event)
+
+    def _get_first_from_heap(self, heap):
+        while heap:
+            event = heap[0][2]
+            if self._is_queued(event):
+                return event
+            heapq.heappop(heap)
+        return None
+
+    def _unindex_events(self, events_list):
+        for event in events_list:
+            self._count_event(event, -1)
+        # Don't let removed events pile up in the heaps
+        nb = self._counters.get((None, None, None), (0,))[0]
+        if len(self._heap) > 2 * nb + 100:
+            self._heap = [e for e in self._heap if self._is_queued(e[2])]
+            heapq.heapify(self._heap)
+            self._systray_heap = [e for e in self._systray_heap if \
+                self._is_queued(e[2])]
+            heapq.heapify(self._systray_heap)
 
     def event_added_subscribe(self, listener):
         """
@@ -224,6 +296,7 @@ class Events:
         if old_name in self._events:
             self._events[new_name] = self._events[old_name]
             del self._events[old_name]
+            self._rebuild_index()
 
     def add_account(self, account):
         self._events[account] = {}
@@ -233,6 +306,7 @@ class Events:
 
     def remove_account(self, account):
         del self._events[account]
+        self._rebuild_index()
 
     def add_event(self, account, jid, event):
         # No such account before ?
@@ -245,6 +319,8 @@ class Events:
             self._events[account][jid].append(event)
         event.jid = jid
         event.account = account
+        self._count_event(event, 1)
+        self._push_event(event)
         self.fire_event_added(event)
 
     def remove_events(self, account, jid, event=None, types=None):
@@ -264,6 +340,7 @@ class Events:
                     del self._events[account][jid]
                 else:
                     self._events[account][jid].remove(event)
+                self._unindex_events([event])
                 self.fire_event_removed([event])
                 return
             else:
@@ -282,17 +359,24 @@ class Events:
                 self._events[account][jid] = new_list
             else:
                 del self._events[account][jid]
+            self._unindex_events(removed_list)
             self.fire_event_removed(removed_list)
             return
         # no event nor type given, remove them all
-        self.fire_event_removed(self._events[account][jid])
+        removed_list = self._events[account][jid]
         del self._events[account][jid]
+        self._unindex_events(removed_list)
+        self.fire_event_removed(removed_list)
 
     def change_jid(self, account, old_jid, new_jid):
         if account not in self._events:
             return
         if old_jid not in self._events[account]:
             return
+        for event in self._events[account][old_jid]:
+            self._count_event(event, -1)
+            event.jid = new_jid
+            self._count_event(event, 1)
         if new_jid in self._events[account]:
             self._events[account][new_jid] += self._events[account][old_jid]
         else:
@@ -337,7 +421,10 @@ class Events:
         Return the first event of type type_ if given
         """
         if not account:
-            return self._get_first_event_with_attribute(self._events)
+            event = self._get_first_from_heap(self._heap)
+            if event is None:
+                return None, None, None
+            return event.account, event.jid, event
         events_list = self.get_events(account, jid, type_)
         # be sure it's bigger than latest event
         first_event_time = time.time() + 1
@@ -352,40 +439,28 @@ class Events:
         """
         Return the number of pending events
         """
-        if types is None:
-            types = []
+        index = {None: 0, 'systray': 1, 'roster': 2}[attribute]
+        if not types:
+            return self._counters.get((account, jid, None), (0, 0, 0))[index]
         nb = 0
-        if account:
-            accounts = [account]
-        else:
-            accounts = self._events.keys()
-        for acct in accounts:
-            if acct not in self._events:
-                continue
-            if jid:
-                jids = [jid]
-            else:
-                jids = self._events[acct].keys()
-            for j in jids:
-                if j not in self._events[acct]:
-                    continue
-                for event in self._events[acct][j]:
-                    if types and event.type_ not in types:
-                        continue
-                    if not attribute or \
-                    attribute == 'systray' and event.show_in_systray or \
-                    attribute == 'roster' and event.show_in_roster:
-                        nb += 1
+        for type_ in set(types):
+            nb += self._counters.get((account, jid, type_), (0, 0, 0))[index]
         return nb
 
     def _get_some_events(self, attribute):
         """
         Attribute in systray, roster
         """
+        index = {'systray': 1, 'roster': 2}[attribute]
         events = {}
         for account in self._events:
+            if not self._counters.get((account, None, None), (0, 0, 0))[index]:
+                continue
             events[account] = {}
             for jid in self._events[account]:
+                if not self._counters.get((account, jid, None),
+                (0, 0, 0))[index]:
+                    continue
                 events[account][jid] = []
                 for event in self._events[account][jid]:
                     if attribute == 'systray' and event.show_in_systray or \
@@ -397,27 +472,6 @@ class Events:
                 del events[account]
         return events
 
-    def _get_first_event_with_attribute(self, events):
-        """
-        Get the first event
-
-        events is in the form {account1: {jid1: [ev1, ev2], },. }
-        """
-        # be sure it's bigger than latest event
-        first_event_time = time.time() + 1
-        first_account = None
-        first_jid = None
-        first_event = None
-        for account in events:
-            for jid in events[account]:
-                for event in events[account][jid]:
-                    if event.time_ < first_event_time:
-                        first_event_time = event.time_
-                        first_account = account
-                        first_jid = jid
-                        first_event = event
-        return first_account, first_jid, first_event
-
     def get_nb_systray_events(self, types=None):
         """
         Return the number of events displayed in roster
@@ -434,8 +488,13 @@ class Events:
         return self._get_some_events('systray')
 
     def get_first_systray_event(self):
-        events = self.get_systray_events()
-        return self._get_first_event_with_attribute(events)
+        while True:
+            event = self._get_first_from_heap(self._systray_heap)
+            if event is None:
+                return None, None, None
+            if event.show_in_systray:
+                return event.account, event.jid, event
+            heapq.heappop(self._systray_heap)
 
     def get_nb_roster_events(self, account=None, jid=None, types=None):
         """
@@ -17,6 +17,12 @@ Exception: this class should not be instatiated
 True
 """
 
+import hashlib
+
+# hashlib names of the XEP-0300 hash algorithms
+HASH_ALGORITHMS = {'md5': 'md5', 'sha-1': 'sha1', 'sha-256': 'sha256',
+    'sha-512': 'sha512'}
+
 class FilesProp:
     _files_props = {}
 
@@ -90,6 +96,37 @@ class FilesProp:
             del files_props[a, s]
 
 
+class FileHasher(object):
+    """
+    Hash the data of a file while it is received, so its hash is known as soon
+    as the last byte is written. If the algorithm the sender uses is not known
+    yet, the data is hashed with all supported algorithms.
+    """
+
+    def __init__(self, algo=None):
+        if algo:
+            algos = [algo] if algo in HASH_ALGORITHMS else []
+        else:
+            algos = HASH_ALGORITHMS.keys()
+        self.hashes = dict((algo, hashlib.new(HASH_ALGORITHMS[algo])) for \
+            algo in algos)
+        # number of bytes hashed
+        self.length = 0
+
+    def update(self, data):
+        for hash_ in self.hashes.values():
+            hash_.update(data)
+        self.length += len(data)
+
+    def get_hash(self, algo):
+        """
+        Return the hex digest of the data, None if it was not hashed with algo
+        """
+        if algo not in self.hashes:
+            return None
+        return self.hashes[algo].hexdigest()
+
+
 class FileProp(object):
 
     def __init__(self, account, sid):
@@ -120,6 +157,8 @@ class FileProp(object):
         # Elapsed time of the file transfer
         self.elapsed_time = 0
         self.last_time = None
+        # time of the last progress report of an In-Band Bytestream
+        self.last_progress_time = 0
         self.received_len = None
         # full file path
         self.file_name = None
@@ -140,6 +179,9 @@ class FileProp(object):
         self.syn_id = None
         self.seq = None
         self.hash_ = None
+        # FileHasher of the received data, None if it does not cover the whole
+        # file (resumed transfer)
+        self.hasher = None
         self.fd = None
         self.startexmpp = None
         # Type of the session, if it is 'jingle' or 'si'
@@ -161,6 +203,15 @@ class FileProp(object):
 
     sid = property(getsid, setsid)
 
+    def get_received_hash(self):
+        """
+        Return the hash of the received file computed while it was received,
+        None if the file has to be read again to get it
+        """
+        if self.hasher is None or self.hasher.length != self.size:
+            return None
+        return self.hasher.get_hash(self.algo)
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
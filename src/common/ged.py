@@ -26,11 +26,17 @@ Global Events Dispatcher module.
 '''
 
 import traceback
+import time
+import bisect
+from collections import deque
 
 from nbxmpp import NodeProcessed
 import logging
 log = logging.getLogger('gajim.c.ged')
 
+# Number of latest durations kept per handler to compute percentiles
+PROFILE_SAMPLES = 1000
+
 PRECORE = 10
 CORE = 20
 POSTCORE = 30
@@ -55,40 +61,178 @@ OUT_PRECORE = 90
 OUT_CORE = 100
 OUT_POSTCORE = 110
 
+class HandlerStats(object):
+    """
+    Call count and durations of an event or of an event handler
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=PROFILE_SAMPLES)
+
+    def add(self, duration):
+        self.calls += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.samples.append(duration)
+
+    def percentile(self, percent):
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        index = min(len(samples) - 1, int(len(samples) * percent / 100))
+        return samples[index]
+
+    def as_dict(self):
+        return {'calls': self.calls, 'total': self.total, 'max': self.max,
+            'p50': self.percentile(50), 'p95': self.percentile(95),
+            'p99': self.percentile(99)}
+
+def handler_name(handler):
+    name = getattr(handler, '__qualname__', None) or \
+        getattr(handler, '__name__', None) or repr(handler)
+    module = getattr(handler, '__module__', None)
+    if module:
+        return '%s.%s' % (module, name)
+    return name
+
 class GlobalEventsDispatcher(object):
 
     def __init__(self):
         self.handlers = {}
+        # Priorities of self.handlers[event_name], kept in the same order so
+        # that new handlers can be inserted with bisect
+        self._priorities = {}
+        # Handlers to call for each event, rebuilt when handlers change so
+        # that raise_event only has to walk a tuple
+        self._dispatch = {}
+        # Incremented each time handlers change, so that users can cache
+        # information about which events are handled
+        self.version = 0
+        self.profiling = False
+        self.event_stats = {}
+        self.handler_stats = {}
 
     def register_event_handler(self, event_name, priority, handler):
         if event_name in self.handlers:
-            handlers_list = self.handlers[event_name]
-            i = 0
-            for i, h in enumerate(handlers_list):
-                if priority < h[0]:
-                    break
-            else:
-                # no event with smaller prio found, put it at the end
-                i += 1
-
-            handlers_list.insert(i, (priority, handler))
+            priorities = self._priorities[event_name]
+            # handlers with the same priority are called in registration order
+            i = bisect.bisect_right(priorities, priority)
+            priorities.insert(i, priority)
+            self.handlers[event_name].insert(i, (priority, handler))
         else:
             self.handlers[event_name] = [(priority, handler)]
+            self._priorities[event_name] = [priority]
+        self._compile(event_name)
 
     def remove_event_handler(self, event_name, priority, handler):
         if event_name in self.handlers:
             try:
-                self.handlers[event_name].remove((priority, handler))
+                i = self.handlers[event_name].index((priority, handler))
             except ValueError as error:
                 log.warning('''Function (%s) with priority "%s" never registered
                 as handler of event "%s". Couldn\'t remove. Error: %s'''
                                   %(handler, priority, event_name, error))
+                return
+            del self.handlers[event_name][i]
+            del self._priorities[event_name][i]
+            self._compile(event_name)
+
+    def _compile(self, event_name):
+        self.version += 1
+        handlers = tuple(h for p, h in self.handlers[event_name])
+        if handlers:
+            self._dispatch[event_name] = handlers
+        else:
+            self._dispatch.pop(event_name, None)
+
+    def has_handlers(self, event_name):
+        return event_name in self._dispatch
+
+    def set_profiling(self, enabled):
+        """
+        Enable or disable recording of per event and per handler timings
+        """
+        self.profiling = enabled
+
+    def reset_profiling(self):
+        self.event_stats = {}
+        self.handler_stats = {}
+
+    def get_profiling_stats(self):
+        """
+        Return recorded timings as {'events': {event_name: stats},
+        'handlers': {(event_name, handler_name): stats}}, durations are in
+        seconds
+        """
+        return {
+            'events': dict((name, stats.as_dict()) for name, stats in \
+                self.event_stats.items()),
+            'handlers': dict((key, stats.as_dict()) for key, stats in \
+                self.handler_stats.items())}
+
+    def format_profiling_stats(self, limit=30):
+        """
+        Return recorded timings as text, slowest (by cumulative time) first
+        """
+        lines = []
+        if not self.profiling:
+            lines.append('Event profiling is disabled')
+        def format_stats(name, stats):
+            return '%8d %10.3f %8.3f %8.3f %8.3f  %s' % (stats.calls,
+                stats.total * 1000, stats.percentile(50) * 1000,
+                stats.percentile(95) * 1000, stats.max * 1000, name)
+        header = '%8s %10s %8s %8s %8s  %s' % ('calls', 'total ms', 'p50 ms',
+            'p95 ms', 'max ms', '%s')
+        lines.append(header % 'event')
+        events = sorted(self.event_stats.items(), key=lambda i: -i[1].total)
+        for name, stats in events[:limit]:
+            lines.append(format_stats(name, stats))
+        lines.append('')
+        lines.append(header % 'handler')
+        handlers = sorted(self.handler_stats.items(),
+            key=lambda i: -i[1].total)
+        for (event_name, name), stats in handlers[:limit]:
+            lines.append(format_stats('%s: %s' % (event_name, name), stats))
+        return '\n'.join(lines)
+
+    def _record(self, event_name, handler, duration):
+        key = (event_name, handler_name(handler))
+        if key not in self.handler_stats:
+            self.handler_stats[key] = HandlerStats()
+        self.handler_stats[key].add(duration)
 
     def raise_event(self, event_name, *args, **kwargs):
-        log.debug('%s Args: %s'%(event_name, str(args)))
-        if event_name in self.handlers:
-            node_processed = False
-            for priority, handler in self.handlers[event_name]:
+        log.debug('%s Args: %s', event_name, args)
+        handlers = self._dispatch.get(event_name)
+        if not handlers:
+            return
+        if self.profiling:
+            return self._raise_event_profiled(event_name, handlers, args,
+                kwargs)
+        node_processed = False
+        for handler in handlers:
+            try:
+                if handler(*args, **kwargs):
+                    return True
+            except NodeProcessed:
+                node_processed = True
+            except Exception:
+                log.error('Error while running an even handler: %s' % \
+                    handler)
+                traceback.print_exc()
+        if node_processed:
+            raise NodeProcessed
+
+    def _raise_event_profiled(self, event_name, handlers, args, kwargs):
+        node_processed = False
+        event_start = time.perf_counter()
+        try:
+            for handler in handlers:
+                start = time.perf_counter()
                 try:
                     if handler(*args, **kwargs):
                         return True
@@ -98,5 +242,12 @@ class GlobalEventsDispatcher(object):
                     log.error('Error while running an even handler: %s' % \
                         handler)
                     traceback.print_exc()
-            if node_processed:
-                raise NodeProcessed
+                finally:
+                    self._record(event_name, handler,
+                        time.perf_counter() - start)
+        finally:
+            if event_name not in self.event_stats:
+                self.event_stats[event_name] = HandlerStats()
+            self.event_stats[event_name].add(time.perf_counter() - event_start)
+        if node_processed:
+            raise NodeProcessed
@@ -24,12 +24,20 @@
 
 from common.gajim import HAVE_GPG, GPG_BINARY
 import os
+import threading
+from collections import OrderedDict
 import logging
 
 if HAVE_GPG:
     import gnupg
     gnupg.logger = logging.getLogger('gajim.c.gnupg')
 
+    # Text name for hash algorithms from RFC 4880 - section 9.4
+    HASH_ALGORITHMS = ['SHA512', 'SHA384', 'SHA256', 'SHA224', 'SHA1',
+        'RIPEMD160']
+    # number of verified signatures to remember
+    VERIFY_CACHE_SIZE = 1000
+
     class GnuPG(gnupg.GPG):
         def __init__(self, use_agent=False):
             gnupg.GPG.__init__(self, gpgbinary=GPG_BINARY)
@@ -38,6 +46,12 @@ if HAVE_GPG:
             self.passphrase = None
             self.use_agent = use_agent
             self.always_trust = [] # list of keyID to always trust
+            # verify() is called from several threads
+            self._lock = threading.Lock()
+            # {(text, signature): keyID} of valid signatures, oldest first
+            self.verified = OrderedDict()
+            # {signer: hash algorithm} of the last valid signature
+            self.hash_algorithms = {}
 
         def _setup_my_options(self):
             self.options.armor = 1
@@ -93,12 +107,34 @@ if HAVE_GPG:
                 return 'KEYEXPIRED'
             return 'BAD_PASSPHRASE'
 
-        def verify(self, str_, sign):
+        def get_verified(self, str_, sign):
+            """
+            Return the keyID of a signature verified before, None if it was not
+            """
+            with self._lock:
+                keyID = self.verified.get((str_, sign))
+                if keyID is not None:
+                    self.verified.move_to_end((str_, sign))
+                return keyID
+
+        def verify(self, str_, sign, signer=None):
+            """
+            Return the keyID of a valid signature, '' otherwise. signer (the
+            JID that sent it) is used to try first the hash algorithm its
+            last signature was made with
+            """
             if str_ is None:
                 return ''
-            # Hash algorithm is not transfered in the signed presence stanza so try
-            # all algorithms. Text name for hash algorithms from RFC 4880 - section 9.4
-            hash_algorithms = ['SHA512', 'SHA384', 'SHA256', 'SHA224', 'SHA1', 'RIPEMD160']
+            keyID = self.get_verified(str_, sign)
+            if keyID is not None:
+                return keyID
+            # Hash algorithm is not transfered in the signed presence stanza so
+            # try all algorithms, starting with the one that worked last time
+            hash_algorithms = HASH_ALGORITHMS
+            last_algo = self.hash_algorithms.get(signer)
+            if last_algo:
+                hash_algorithms = [last_algo] + [algo for algo in \
+                    HASH_ALGORITHMS if algo != last_algo]
             for algo in hash_algorithms:
                 data = os.linesep.join(
                     ['-----BEGIN PGP SIGNED MESSAGE-----',
@@ -109,7 +145,17 @@ if HAVE_GPG:
                     )
                 result = super(GnuPG, self).verify(data)
                 if result.valid:
+                    with self._lock:
+                        self.verified[(str_, sign)] = result.key_id
+                        self.verified.move_to_end((str_, sign))
+                        if len(self.verified) > VERIFY_CACHE_SIZE:
+                            self.verified.popitem(last=False)
+                        if signer:
+                            self.hash_algorithms[signer] = algo
                     return result.key_id
+                if result.status == 'no public key':
+                    # no other algorithm can validate it either
+                    break
 
             return ''
 
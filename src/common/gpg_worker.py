@@ -0,0 +1,83 @@
+##      common/gpg_worker.py
+##
+## This file is part of Gajim.
+##
+## Gajim is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published
+## by the Free Software Foundation; version 3 only.
+##
+## Gajim is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Gajim.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Run GPG operations in background threads
+
+Every GPG operation spawns the gpg binary and waits for it, which must not
+happen in the main loop. Jobs are run by a small pool of threads shared by all
+accounts, so many signed presences at login don't start hundreds of gpg
+processes at once.
+"""
+
+import queue
+import threading
+import logging
+log = logging.getLogger('gajim.c.gpg_worker')
+
+from gi.repository import GLib
+
+# number of gpg processes that may run at the same time
+GPG_WORKERS = 4
+
+
+class GPGWorkerPool:
+    def __init__(self, size=GPG_WORKERS):
+        self.size = size
+        self.jobs = queue.Queue()
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, func, func_args=(), callback=None, callback_args=()):
+        """
+        Call func(*func_args) in a worker thread, then callback(output,
+        *callback_args) in the main loop. The callback is called with None if
+        func raised an exception
+        """
+        self._start_workers()
+        self.jobs.put((func, func_args, callback, callback_args))
+
+    def _start_workers(self):
+        with self._lock:
+            # threads are started with the first jobs and then kept
+            if len(self.threads) >= self.size:
+                return
+            thread = threading.Thread(target=self._work,
+                name='gpg-worker-%d' % len(self.threads))
+            thread.daemon = True
+            self.threads.append(thread)
+            thread.start()
+
+    def _work(self):
+        while True:
+            func, func_args, callback, callback_args = self.jobs.get()
+            try:
+                output = func(*func_args)
+            except Exception:
+                log.exception('GPG job %s failed', func)
+                output = None
+            if callback:
+                GLib.idle_add(callback, output, *callback_args)
+
+
+_pool = None
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = GPGWorkerPool()
+    return _pool
@@ -162,7 +162,8 @@ class ConnectionJingle(object):
         if contact.supports(nbxmpp.NS_JINGLE_BYTESTREAM):
             transport = JingleTransportSocks5()
         elif contact.supports(nbxmpp.NS_JINGLE_IBB):
-            transport = JingleTransportIBB()
+            transport = JingleTransportIBB(block_sz=str(gajim.config.get_per(
+                'accounts', self.name, 'ibb_block_size')))
         c = JingleFileTransfer(jingle, transport=transport,
                                file_props=file_props,
                                use_security=use_security)
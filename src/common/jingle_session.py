@@ -383,7 +383,8 @@ class JingleSession:
         self.__dispatch_error(error_name, text, error.getAttr('type'))
 
     def transport_replace(self):
-        transport = JingleTransportIBB()
+        transport = JingleTransportIBB(block_sz=str(gajim.config.get_per(
+            'accounts', self.connection.name, 'ibb_block_size')))
         # For debug only, delete this and replace for a function
         # that will identify contents by its sid
         for creator, name in self.contents:
@@ -22,6 +22,7 @@ import socket
 from enum import IntEnum
 import nbxmpp
 from common import gajim
+from common.protocol.bytestream import IBB_BLOCK_SIZE
 
 log = logging.getLogger('gajim.c.jingle_transport')
 
@@ -341,12 +342,20 @@ class JingleTransportIBB(JingleTransport):
         if block_sz:
             self.block_sz = block_sz
         else:
-            self.block_sz = '4096'
+            self.block_sz = str(IBB_BLOCK_SIZE)
 
         self.connection = None
         self.sid = None
         if node and node.getAttr('sid'):
             self.sid = node.getAttr('sid')
+        if node and node.getAttr('block-size'):
+            # use the smallest block size both sides accept
+            try:
+                block_sz = int(node.getAttr('block-size'))
+            except ValueError:
+                block_sz = 0
+            if 0 < block_sz < int(self.block_sz):
+                self.block_sz = str(block_sz)
 
 
     def make_transport(self):
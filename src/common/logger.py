@@ -29,12 +29,18 @@ This module allows to access the on-disk database of logs
 """
 
 import os
+import re
 import sys
 import time
 import datetime
 import json
+import queue
+import threading
+import collections
+from contextlib import contextmanager
 from gzip import GzipFile
 from io import BytesIO
+from urllib.request import pathname2url
 from gi.repository import GLib
 from enum import IntEnum
 
@@ -48,6 +54,11 @@ LOG_DB_PATH = gajim.gajimpaths['LOG_DB']
 LOG_DB_FOLDER, LOG_DB_FILE = os.path.split(LOG_DB_PATH)
 CACHE_DB_PATH = gajim.gajimpaths['CACHE_DB']
 
+# seconds between two checkpoints of the write-ahead log
+WAL_CHECKPOINT_INTERVAL = 300
+# seconds during which caps last_seen updates are grouped
+CAPS_TIME_FLUSH_INTERVAL = 60
+
 import logging
 log = logging.getLogger('gajim.c.logger')
 
@@ -96,11 +107,315 @@ class SubscriptionConstant(IntEnum):
     FROM = 2
     BOTH = 3
 
+def build_fts_query(text):
+    """
+    Convert the text typed by the user into a FTS5 MATCH expression
+
+    Parts between double quotes are searched as phrases, other words are
+    searched as prefixes so that 'gaj' still finds 'gajim'. Return None if
+    there is nothing to search.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        if phrase.strip():
+            terms.append('"%s"' % phrase.replace('"', '""'))
+        elif word:
+            terms.append('"%s"*' % word.replace('"', '""'))
+    if not terms:
+        return None
+    return ' '.join(terms)
+
+def get_jids_generation(cur):
+    """
+    Return the jids generation of the database, see bump_jids_generation()
+    """
+    try:
+        cur.execute('PRAGMA user_version')
+        return cur.fetchone()[0]
+    except sqlite.DatabaseError:
+        return None
+
+def bump_jids_generation(cur):
+    """
+    Tell running instances that rows of the jids table were removed, so that
+    they reload the jid ids they keep in memory. Must be called in the
+    transaction that removes them.
+    """
+    generation = get_jids_generation(cur) or 0
+    cur.execute('PRAGMA user_version = %d' % (generation + 1))
+
+class LogWriter(threading.Thread):
+    """
+    Write log lines to the database from a dedicated thread
+
+    Statements queued from the main thread are written with their own
+    connection. Everything queued during one tick is committed in a single
+    transaction and consecutive identical statements are grouped in one
+    executemany() call. The queue is bounded but queue_statements() never
+    blocks the main loop: when the disk cannot keep up, statements wait in an
+    overflow list and are moved to the queue from a timeout as room is made.
+    """
+    # markers that can be put in the queue instead of a statement
+    _FLUSH = object()
+    _CHECKPOINT = object()
+    _STOP = object()
+
+    def __init__(self, error_cb, conflict_cb, jids_cb, jids_generation,
+    tick=0.2, max_pending=5000):
+        threading.Thread.__init__(self, name='LogWriter')
+        self.daemon = True
+        self.error_cb = error_cb
+        self.conflict_cb = conflict_cb
+        self.jids_cb = jids_cb
+        self.jids_generation = jids_generation
+        self.tick = tick
+        self._queue = queue.Queue(max_pending)
+        # statements that did not fit in the queue, oldest first
+        self._overflow = collections.deque()
+        self._overflow_timeout_id = None
+
+    def queue_statements(self, statements):
+        """
+        Queue a list of (sql, values) that will be committed together
+        """
+        if not self._overflow:
+            try:
+                self._queue.put_nowait(statements)
+                return
+            except queue.Full:
+                log.debug('Log writer is late, keeping statements aside')
+        self._overflow.append(statements)
+        if not self._overflow_timeout_id:
+            self._overflow_timeout_id = GLib.timeout_add(
+                int(self.tick * 1000), self._queue_overflow)
+
+    def _queue_overflow(self):
+        while self._overflow:
+            try:
+                self._queue.put_nowait(self._overflow[0])
+            except queue.Full:
+                return True
+            self._overflow.popleft()
+        self._overflow_timeout_id = None
+        return False
+
+    def _put_overflow(self):
+        """
+        Move all statements kept aside to the queue, waiting for room
+        """
+        if self._overflow_timeout_id:
+            GLib.source_remove(self._overflow_timeout_id)
+            self._overflow_timeout_id = None
+        while self._overflow:
+            self._queue.put(self._overflow.popleft())
+
+    def pending(self):
+        """
+        Return the number of statements that are not yet written
+        """
+        return self._queue.qsize() + len(self._overflow)
+
+    def flush(self):
+        """
+        Block until all statements queued so far are committed
+        """
+        if not self.is_alive():
+            return
+        self._put_overflow()
+        self._queue.put(self._FLUSH)
+        self._queue.join()
+
+    def checkpoint(self):
+        """
+        Ask the thread to copy the write-ahead log back into the database
+        """
+        if self.is_alive():
+            self._queue.put(self._CHECKPOINT)
+
+    def stop(self):
+        """
+        Write pending statements, checkpoint and terminate the thread
+        """
+        if not self.is_alive():
+            return
+        self._put_overflow()
+        self._queue.put(self._STOP)
+        self.join()
+
+    def _connect(self):
+        back = os.getcwd()
+        os.chdir(LOG_DB_FOLDER)
+        con = sqlite.connect(LOG_DB_FILE, timeout=20.0,
+            isolation_level='IMMEDIATE')
+        os.chdir(back)
+        try:
+            con.execute('PRAGMA synchronous = OFF')
+        except sqlite.Error as e:
+            log.debug('Failed to set synchronous in log writer: %s' % str(e))
+        return con
+
+    def run(self):
+        con = self._connect()
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.tick
+            # Collect everything that arrives during this tick, unless we are
+            # asked to write right now
+            while batch[-1] is not self._FLUSH and batch[-1] is not self._STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            running = batch[-1] is not self._STOP
+            groups = [item for item in batch if isinstance(item, list)]
+            self._write_batch(con, groups)
+            if not running:
+                self._checkpoint(con, 'TRUNCATE')
+            elif self._CHECKPOINT in batch:
+                self._checkpoint(con, 'PASSIVE')
+            for item in batch:
+                self._queue.task_done()
+        con.close()
+
+    def _checkpoint(self, con, mode):
+        try:
+            con.execute('PRAGMA wal_checkpoint(%s)' % mode).fetchall()
+        except sqlite.Error as e:
+            log.debug('Failed to checkpoint logs database: %s' % str(e))
+
+    def _write_batch(self, con, groups):
+        statements = [statement for group in groups for statement in group]
+        if not statements:
+            return
+        try:
+            self._execute(con, statements)
+            self._check_jids_generation(con)
+            con.commit()
+        except sqlite.IntegrityError as e:
+            # Most likely a log line id also used by another instance. Don't
+            # lose the whole batch because of it, write it again one group of
+            # statements at a time to skip only the failing ones.
+            con.rollback()
+            log.warning('Failed to write logs batch, retrying: %s' % str(e))
+            self._write_groups(con, groups)
+        except sqlite.OperationalError as e:
+            con.rollback()
+            self._report_error(exceptions.PysqliteOperationalError(str(e)))
+        except sqlite.DatabaseError:
+            con.rollback()
+            self._report_error(exceptions.DatabaseMalformed())
+
+    def _write_groups(self, con, groups):
+        for group in groups:
+            try:
+                self._execute(con, group)
+                con.commit()
+            except sqlite.IntegrityError as e:
+                con.rollback()
+                log.error('Failed to write %s %s: %s' % (group[0][0],
+                    group[0][1], str(e)))
+            except sqlite.OperationalError as e:
+                con.rollback()
+                self._report_error(exceptions.PysqliteOperationalError(str(e)))
+                return
+            except sqlite.DatabaseError:
+                con.rollback()
+                self._report_error(exceptions.DatabaseMalformed())
+                return
+        # Give the main thread the ids used by the other instance so that the
+        # next lines don't conflict again
+        try:
+            max_id = con.execute('SELECT MAX(log_line_id) FROM logs').fetchone()
+        except sqlite.DatabaseError:
+            return
+        if max_id[0]:
+            GLib.idle_add(self.conflict_cb, max_id[0])
+
+    def _check_jids_generation(self, con):
+        """
+        Tell the main thread when jids were removed by another process. This
+        only reads the header of the database, already read by the write.
+        """
+        generation = get_jids_generation(con.cursor())
+        if generation != self.jids_generation:
+            self.jids_generation = generation
+            GLib.idle_add(self.jids_cb, generation)
+
+    def _execute(self, con, statements):
+        """
+        Execute statements, consecutive identical ones in one executemany()
+        """
+        cur = con.cursor()
+        i = 0
+        while i < len(statements):
+            sql = statements[i][0]
+            j = i
+            while j < len(statements) and statements[j][0] == sql:
+                j += 1
+            cur.executemany(sql, [values for sql_, values in statements[i:j]])
+            i = j
+
+    def _report_error(self, error):
+        log.error('Failed to write logs: %s' % error)
+        GLib.idle_add(self.error_cb, error)
+
+class ReadConnectionPool:
+    """
+    Read-only connections to the logs database
+
+    With the database in WAL mode, reading through these connections never
+    waits for the writer and never makes it wait.
+    """
+    def __init__(self, size=3):
+        self.size = size
+        self._free = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        uri = 'file:%s?mode=ro' % pathname2url(LOG_DB_PATH)
+        return sqlite.connect(uri, uri=True, timeout=20.0,
+            check_same_thread=False)
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return self._connect()
+
+    def release(self, con):
+        with self._lock:
+            if len(self._free) < self.size:
+                self._free.append(con)
+                return
+        con.close()
+
+    def close(self):
+        with self._lock:
+            for con in self._free:
+                con.close()
+            self._free = []
+
 class Logger:
     def __init__(self):
-        self.jids_already_in = [] # holds jids that we already have in DB
+        # holds jids that we already have in DB: {jid: (jid_id, type)}
+        self.jids_already_in = {}
+        # jids generation of the database when jids_already_in was loaded,
+        # see bump_jids_generation()
+        self.jids_generation = None
         self.con = None
+        self.fts_available = False
         self.commit_timout_id = None
+        self.writer = None
+        self.checkpoint_timeout_id = None
+        self.read_pool = ReadConnectionPool()
+        # pending caps last_seen updates: {(hash_method, hash): time}
+        self.caps_times = {}
+        self.caps_time_timeout_id = None
+        self.next_log_line_id = 1
 
         if not os.path.exists(LOG_DB_PATH):
             # this can happen only the first time (the time we create the db)
@@ -116,6 +431,7 @@ class Logger:
             ged.POSTCORE, self._nec_gc_message_received)
 
     def close_db(self):
+        self.read_pool.close()
         if self.con:
             self.con.close()
         self.con = None
@@ -138,6 +454,37 @@ class Logger:
         os.chdir(back)
         self.cur = self.con.cursor()
         self.set_synchronous(False)
+        self.set_wal_mode()
+
+    def set_wal_mode(self):
+        """
+        Use a write-ahead log so that readers and the writer don't lock each
+        other. The mode is persistent, stored in the database file.
+        """
+        try:
+            self.cur.execute('PRAGMA journal_mode = WAL')
+            mode = self.cur.fetchone()[0]
+            if mode.lower() != 'wal':
+                log.debug('Cannot use WAL mode, journal mode is %s' % mode)
+        except sqlite.Error as e:
+            log.debug('Failed to set WAL mode: %s' % str(e))
+
+    @contextmanager
+    def read_cursor(self):
+        """
+        Yield a cursor on a read-only connection of the pool, or on the main
+        connection if the database cannot be opened read-only
+        """
+        try:
+            con = self.read_pool.acquire()
+        except sqlite.OperationalError as e:
+            log.debug('Failed to open read-only connection: %s' % str(e))
+            yield self.cur
+            return
+        try:
+            yield con.cursor()
+        finally:
+            self.read_pool.release(con)
 
     def attach_cache_database(self):
         try:
@@ -156,8 +503,135 @@ class Logger:
             log.debug("Failed to set_synchronous(%s): %s" % (sync, str(e)))
 
     def init_vars(self):
+        # lines queued for the previous database must be written before we
+        # look for the next free log line id
+        self.stop_writer()
         self.open_db()
         self.get_jids_already_in_db()
+        self.fts_available = self._logs_fts_exists()
+        self._init_next_log_line_id()
+        self.start_writer()
+
+    def _init_next_log_line_id(self):
+        """
+        Log line ids are given by us and not by sqlite so that write() can
+        return them before the line is really written by the writer thread
+        """
+        try:
+            self.cur.execute('SELECT MAX(log_line_id) FROM logs')
+            max_id = self.cur.fetchone()[0] or 0
+            self.cur.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'logs'")
+            row = self.cur.fetchone()
+        except sqlite.DatabaseError:
+            raise exceptions.DatabaseMalformed
+        if row and row[0] > max_id:
+            max_id = row[0]
+        self.next_log_line_id = max_id + 1
+
+    def start_writer(self):
+        self.writer = LogWriter(self._on_writer_error,
+            self._on_writer_conflict, self._on_jids_generation_changed,
+            self.jids_generation)
+        self.writer.start()
+        self.checkpoint_timeout_id = GLib.timeout_add_seconds(
+            WAL_CHECKPOINT_INTERVAL, self._checkpoint)
+
+    def stop_writer(self):
+        """
+        Write pending log lines and stop the writer thread
+        """
+        if self.checkpoint_timeout_id:
+            GLib.source_remove(self.checkpoint_timeout_id)
+            self.checkpoint_timeout_id = None
+        if self.caps_time_timeout_id:
+            GLib.source_remove(self.caps_time_timeout_id)
+            self._flush_caps_times()
+        if self.commit_timout_id:
+            GLib.source_remove(self.commit_timout_id)
+            self._really_commit()
+        if self.writer:
+            self.writer.stop()
+        self.writer = None
+
+    def _checkpoint(self):
+        if self.writer:
+            self.writer.checkpoint()
+        return True
+
+    def flush(self):
+        """
+        Block until every log line written so far is in the database
+
+        Reads don't wait for the writer, this is only needed when they must see
+        the lines that were just written
+        """
+        if self.commit_timout_id:
+            # Our own pending transaction would block the writer thread
+            GLib.source_remove(self.commit_timout_id)
+            self._really_commit()
+        if self.writer:
+            self.writer.flush()
+
+    def _queue_write(self, sql, values=()):
+        self._queue_writes([(sql, values)])
+
+    def _queue_writes(self, statements):
+        """
+        Queue (sql, values) statements that will be written in the same
+        transaction
+        """
+        if self.writer:
+            self.writer.queue_statements(statements)
+        else:
+            for sql, values in statements:
+                self.cur.execute(sql, values)
+            self._timeout_commit()
+
+    def _on_writer_error(self, error):
+        if isinstance(error, exceptions.DatabaseMalformed):
+            pritext = _('Database Error')
+            sectext = _('The database file (%s) cannot be read. Try to '
+                'repair it (see http://trac.gajim.org/wiki/DatabaseBackup) '
+                'or remove it (all history will be lost).') % LOG_DB_PATH
+        else:
+            pritext = _('Disk Write Error')
+            sectext = str(error)
+        gajim.ged.raise_event('DB_ERROR', None, (pritext, sectext))
+        return False
+
+    def _on_writer_conflict(self, max_id):
+        """
+        Log line ids up to max_id are used by someone else, don't give them
+        """
+        if max_id >= self.next_log_line_id:
+            log.debug('Log line ids used by another instance, next id is %d' % \
+                (max_id + 1))
+            self.next_log_line_id = max_id + 1
+        return False
+
+    def _on_jids_generation_changed(self, generation):
+        """
+        The history manager removed jids, reload the ones we keep in memory
+        """
+        if generation != self.jids_generation:
+            log.debug('jids table changed by another process, reloading it')
+            try:
+                self.get_jids_already_in_db()
+            except exceptions.DatabaseMalformed:
+                log.error('Failed to reload jids')
+        return False
+
+    def _logs_fts_exists(self):
+        """
+        Return True if the full-text index over logs has been created
+        """
+        try:
+            self.cur.execute('''SELECT name FROM sqlite_master
+                WHERE type = 'table' AND name = 'logs_fts';''')
+            return self.cur.fetchone() is not None
+        except sqlite.DatabaseError:
+            return False
 
     def _really_commit(self):
         try:
@@ -181,22 +655,21 @@ class Logger:
 
     def get_jids_already_in_db(self):
         try:
-            self.cur.execute('SELECT jid FROM jids')
-            # list of tupples: [('aaa@bbb',), ('cc@dd',)]
+            self.cur.execute('SELECT jid, jid_id, type FROM jids')
+            # list of tupples: [('aaa@bbb', 1, 0), ('cc@dd', 2, 1)]
             rows = self.cur.fetchall()
         except sqlite.DatabaseError:
             raise exceptions.DatabaseMalformed
-        self.jids_already_in = []
-        for row in rows:
-            # row[0] is first item of row (the only result here, the jid)
-            if row[0] == '':
+        self.jids_already_in = {}
+        self.jids_generation = get_jids_generation(self.cur)
+        for jid, jid_id, type_ in rows:
+            if jid == '':
                 # malformed jid, ignore line
-                pass
-            else:
-                self.jids_already_in.append(row[0])
+                continue
+            self.jids_already_in[jid] = (jid_id, type_)
 
     def get_jids_in_db(self):
-        return self.jids_already_in
+        return list(self.jids_already_in.keys())
 
     def jid_is_from_pm(self, jid):
         """
@@ -218,14 +691,10 @@ class Logger:
         """
         Return True if it's a room jid, False if it's not, None if we don't know
         """
-        self.cur.execute('SELECT type FROM jids WHERE jid=?', (jid,))
-        row = self.cur.fetchone()
+        row = self.jids_already_in.get(jid)
         if row is None:
             return None
-        else:
-            if row[0] == JIDConstant.ROOM_TYPE:
-                return True
-            return False
+        return row[1] == JIDConstant.ROOM_TYPE
 
     def get_jid_id(self, jid, typestr=None):
         """
@@ -240,11 +709,9 @@ class Logger:
             jid_is_from_pm = self.jid_is_from_pm(jid)
             if not jid_is_from_pm: # it's normal jid with resource
                 jid = jid.split('/', 1)[0] # remove the resource
-        if jid in self.jids_already_in: # we already have jids in DB
-            self.cur.execute('SELECT jid_id FROM jids WHERE jid=?', [jid])
-            row = self.cur.fetchone()
-            if row:
-                return row[0]
+        row = self.jids_already_in.get(jid)
+        if row is not None: # we already have jids in DB
+            return row[0]
         # oh! a new jid :), we add it now
         if typestr == 'ROOM':
             typ = JIDConstant.ROOM_TYPE
@@ -257,11 +724,14 @@ class Logger:
         except sqlite.IntegrityError:
             # Jid already in DB, maybe added by another instance. re-read DB
             self.get_jids_already_in_db()
-            return self.get_jid_id(jid, typestr)
+            if jid not in self.jids_already_in:
+                raise exceptions.PysqliteOperationalError(
+                    'Cannot add %s to jids table' % jid)
+            return self.jids_already_in[jid][0]
         except sqlite.OperationalError as e:
             raise exceptions.PysqliteOperationalError(str(e))
         jid_id = self.cur.lastrowid
-        self.jids_already_in.append(jid)
+        self.jids_already_in[jid] = (jid_id, typ)
         return jid_id
 
     def convert_human_values_to_db_api_values(self, kind, show):
@@ -403,34 +873,47 @@ class Logger:
             return 'both'
 
     def commit_to_db(self, values, write_unread=False):
-        sql = '''INSERT INTO logs (jid_id, contact_name, time, kind, show,
-                message, subject, additional_data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
-        try:
-            self.cur.execute(sql, values)
-        except sqlite.OperationalError as e:
-            raise exceptions.PysqliteOperationalError(str(e))
-        except sqlite.DatabaseError:
-            raise exceptions.DatabaseMalformed
-        message_id = None
+        """
+        Queue a log line for writing and return its id if it was stored as
+        unread
+        """
+        message_id, statements = self._get_log_statements(values,
+            write_unread)
+        self._queue_writes(statements)
         if write_unread:
-            try:
-                self.con.commit()
-                message_id = self.cur.lastrowid
-            except sqlite.OperationalError as e:
-                print(str(e), file=sys.stderr)
+            return message_id
+
+    def _get_log_statements(self, values, write_unread=False,
+    ignore_duplicate=False):
+        """
+        Give an id to a log line and return it with the statements storing it
+
+        If ignore_duplicate is True, a line with the same stanza_id as an
+        existing one is silently dropped, together with its unread entry.
+        """
+        message_id = self.next_log_line_id
+        self.next_log_line_id += 1
+        if ignore_duplicate:
+            sql = 'INSERT OR IGNORE'
         else:
-            self._timeout_commit()
-        if message_id:
-            self.insert_unread_events(message_id, values[0])
-        return message_id
+            sql = 'INSERT'
+        sql += ''' INTO logs (log_line_id, jid_id, contact_name, time, kind,
+                show, message, subject, additional_data, stanza_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+        statements = [(sql, (message_id,) + tuple(values))]
+        if write_unread:
+            statements.append(('''INSERT INTO unread_messages
+                (message_id, jid_id, shown) SELECT log_line_id, jid_id, 0
+                FROM logs WHERE log_line_id = ?''', (message_id,)))
+        return message_id, statements
 
     def insert_unread_events(self, message_id, jid_id):
         """
         Add unread message with id: message_id
         """
-        sql = 'INSERT INTO unread_messages VALUES (%d, %d, 0)' % (message_id,
-                jid_id)
-        self.simple_commit(sql)
+        self._queue_write(
+            'INSERT INTO unread_messages (message_id, jid_id, shown) '
+            'VALUES (?, ?, 0)', (message_id, jid_id))
 
     def set_read_messages(self, message_ids):
         """
@@ -438,7 +921,7 @@ class Logger:
         """
         ids = ','.join([str(i) for i in message_ids])
         sql = 'DELETE FROM unread_messages WHERE message_id IN (%s)' % ids
-        self.simple_commit(sql)
+        self._queue_write(sql)
 
     def set_shown_unread_msgs(self, msg_log_id):
         """
@@ -446,19 +929,20 @@ class Logger:
         """
         sql = 'UPDATE unread_messages SET shown = 1 where message_id = %s' % \
                 msg_log_id
-        self.simple_commit(sql)
+        self._queue_write(sql)
 
     def reset_shown_unread_messages(self):
         """
         Set shown field to False in unread_messages table
         """
         sql = 'UPDATE unread_messages SET shown = 0'
-        self.simple_commit(sql)
+        self._queue_write(sql)
 
     def get_unread_msgs(self):
         """
         Get all unread messages
         """
+        self.flush()
         all_messages = []
         try:
             self.cur.execute(
@@ -490,7 +974,7 @@ class Logger:
             all_messages.append(results[0])
         return all_messages
 
-    def write(self, kind, jid, message=None, show=None, tim=None, subject=None, additional_data=None):
+    def write(self, kind, jid, message=None, show=None, tim=None, subject=None, additional_data=None, stanza_id=None):
         """
         Write a row (status, gcstatus, message etc) to logs database
 
@@ -503,10 +987,23 @@ class Logger:
                 jids.jid text column will hold JID if TC-related, room_jid if GC-related,
                 ROOM_JID/nick if pm-related.
         """
+        row = self._get_log_values(kind, jid, message, show, tim, subject,
+            additional_data, stanza_id)
+        if row is None:
+            return
+        values, write_unread = row
+        return self.commit_to_db(values, write_unread)
 
+    def _get_log_values(self, kind, jid, message, show, tim, subject,
+    additional_data, stanza_id):
+        """
+        Return the values of the logs row described by the arguments of
+        write() and whether it must be saved as unread, or None if it must not
+        be logged
+        """
         if additional_data is None:
             additional_data = {}
-        if self.jids_already_in == []: # only happens if we just created the db
+        if not self.jids_already_in: # only happens if we just created the db
             self.open_db()
 
         contact_name_col = None # holds nickname for kinds gcstatus, gc_msg
@@ -574,8 +1071,8 @@ class Logger:
             return
 
         values = (jid_id, contact_name_col, time_col, kind_col, show_col,
-                message_col, subject_col, additional_data_col)
-        return self.commit_to_db(values, write_unread)
+                message_col, subject_col, additional_data_col, stanza_id)
+        return values, write_unread
 
     def get_last_conversation_lines(self, jid, restore_how_many_rows,
                     pending_how_many, timeout, account):
@@ -586,6 +1083,9 @@ class Logger:
         containg time, kind, message, sibject list with empty tupple if nothing
         found to meet our demands
         """
+        if pending_how_many:
+            # the pending messages must be written to be skipped by OFFSET
+            self.flush()
         try:
             self.get_jid_id(jid)
         except exceptions.PysqliteOperationalError:
@@ -597,22 +1097,23 @@ class Logger:
         timed_out = now - (timeout * 60) # before that they are too old
         # so if we ask last 5 lines and we have 2 pending we get
         # 3 - 8 (we avoid the last 2 lines but we still return 5 asked)
-        try:
-            self.cur.execute('''
-                SELECT time, kind, message, subject, additional_data FROM logs
-                WHERE (%s) AND kind IN (%d, %d, %d, %d, %d) AND time > %d
-                ORDER BY time DESC LIMIT %d OFFSET %d
-                ''' % (where_sql, KindConstant.SINGLE_MSG_RECV,
-                KindConstant.CHAT_MSG_RECV, KindConstant.SINGLE_MSG_SENT,
-                KindConstant.CHAT_MSG_SENT, KindConstant.ERROR, timed_out,
-                restore_how_many_rows, pending_how_many), jid_tuple)
-
-            results = self.cur.fetchall()
-            for entry in results:
-                entry = list(entry)
-                entry[4] = json.loads(entry[4])
-        except sqlite.DatabaseError:
-            raise exceptions.DatabaseMalformed
+        with self.read_cursor() as cur:
+            try:
+                cur.execute('''
+                    SELECT time, kind, message, subject, additional_data FROM logs
+                    WHERE (%s) AND kind IN (%d, %d, %d, %d, %d) AND time > %d
+                    ORDER BY time DESC LIMIT %d OFFSET %d
+                    ''' % (where_sql, KindConstant.SINGLE_MSG_RECV,
+                    KindConstant.CHAT_MSG_RECV, KindConstant.SINGLE_MSG_SENT,
+                    KindConstant.CHAT_MSG_SENT, KindConstant.ERROR, timed_out,
+                    restore_how_many_rows, pending_how_many), jid_tuple)
+
+                results = cur.fetchall()
+                for entry in results:
+                    entry = list(entry)
+                    entry[4] = json.loads(entry[4])
+            except sqlite.DatabaseError:
+                raise exceptions.DatabaseMalformed
         results.reverse()
         return results
 
@@ -644,26 +1145,29 @@ class Logger:
         seconds_in_a_day = 86400 # 60 * 60 * 24
         last_second_of_day = start_of_day + seconds_in_a_day - 1
 
-        self.cur.execute('''
-            SELECT contact_name, time, kind, show, message, subject, additional_data FROM logs
-            WHERE (%s)
-            AND time BETWEEN %d AND %d
-            ORDER BY time
-            ''' % (where_sql, start_of_day, last_second_of_day), jid_tuple)
+        with self.read_cursor() as cur:
+            cur.execute('''
+                SELECT contact_name, time, kind, show, message, subject, additional_data FROM logs
+                WHERE (%s)
+                AND time BETWEEN %d AND %d
+                ORDER BY time
+                ''' % (where_sql, start_of_day, last_second_of_day), jid_tuple)
 
-        results = self.cur.fetchall()
+            results = cur.fetchall()
         for entry in results:
             entry = list(entry)
             entry[6] = json.loads(entry[6])
         return results
 
     def get_search_results_for_query(self, jid, query, account, year=False,
-        month=False, day=False):
+        month=False, day=False, ranked=False):
         """
-        Returns contact_name, time, kind, show, message
+        Returns contact_name, time, kind, show, message, subject
 
         For each row in a list of tupples, returns list with empty tupple if we
-        found nothing to meet our demands
+        found nothing to meet our demands. Text between double quotes is
+        searched as a phrase. If ranked is True, best matches come first
+        instead of oldest ones.
         """
         try:
             self.get_jid_id(jid)
@@ -671,35 +1175,44 @@ class Logger:
             # Error trying to create a new jid_id. This means there is no log
             return []
 
-        if False: # query.startswith('SELECT '): # it's SQL query (FIXME)
-            try:
-                self.cur.execute(query)
-            except sqlite.OperationalError as e:
-                results = [('', '', '', '', str(e))]
-                return results
+        where_sql, jid_tuple = self._build_contact_where(account, jid)
+        time_sql = ''
+        if year:
+            start_of_day = self.get_unix_time_from_date(year, month, day)
+            seconds_in_a_day = 86400 # 60 * 60 * 24
+            last_second_of_day = start_of_day + seconds_in_a_day - 1
+            time_sql = 'AND time BETWEEN %d AND %d' % (start_of_day,
+                last_second_of_day)
+
+        fts_query = build_fts_query(query)
+        with self.read_cursor() as cur:
+            if self.fts_available and fts_query:
+                if ranked:
+                    order_sql = 'logs_fts.rank'
+                else:
+                    order_sql = 'logs.time'
+                try:
+                    cur.execute('''
+                        SELECT contact_name, time, kind, show, logs.message,
+                        logs.subject FROM logs_fts
+                        JOIN logs ON logs.log_line_id = logs_fts.rowid
+                        WHERE logs_fts MATCH ? AND (%s) %s
+                        ORDER BY %s
+                        ''' % (where_sql, time_sql, order_sql),
+                        (fts_query,) + jid_tuple)
+                    return cur.fetchall()
+                except sqlite.OperationalError as e:
+                    # index missing or corrupted, fall back to a full scan
+                    log.debug('Full-text search failed: %s' % str(e))
 
-        else: # user just typed something, we search in message column
-            where_sql, jid_tuple = self._build_contact_where(account, jid)
             like_sql = '%' + query.replace("'", "''") + '%'
-            if year:
-                start_of_day = self.get_unix_time_from_date(year, month, day)
-                seconds_in_a_day = 86400 # 60 * 60 * 24
-                last_second_of_day = start_of_day + seconds_in_a_day - 1
-                self.cur.execute('''
+            cur.execute('''
                 SELECT contact_name, time, kind, show, message, subject FROM logs
-                WHERE (%s) AND message LIKE '%s'
-                AND time BETWEEN %d AND %d
+                WHERE (%s) AND message LIKE '%s' %s
                 ORDER BY time
-                ''' % (where_sql, like_sql, start_of_day, last_second_of_day),
-                    jid_tuple)
-            else:
-                self.cur.execute('''
-                SELECT contact_name, time, kind, show, message, subject FROM logs
-                WHERE (%s) AND message LIKE '%s'
-                ORDER BY time
-                ''' % (where_sql, like_sql), jid_tuple)
+                ''' % (where_sql, like_sql, time_sql), jid_tuple)
 
-        results = self.cur.fetchall()
+            results = cur.fetchall()
         return results
 
     def get_days_with_logs(self, jid, year, month, max_day, account):
@@ -723,15 +1236,16 @@ class Logger:
         # (by dividing, they are integers)
         # and take only one of the same values (distinct)
         # Now we have timestamps of time 0:00 of every day with logs
-        self.cur.execute('''
-            SELECT DISTINCT time/(86400)*86400 FROM logs
-            WHERE (%s)
-            AND time BETWEEN %d AND %d
-            AND kind NOT IN (%d, %d)
-            ORDER BY time
-            ''' % (where_sql, start_of_month, last_second_of_month,
-            KindConstant.STATUS, KindConstant.GCSTATUS), jid_tuple)
-        result = self.cur.fetchall()
+        with self.read_cursor() as cur:
+            cur.execute('''
+                SELECT DISTINCT time/(86400)*86400 FROM logs
+                WHERE (%s)
+                AND time BETWEEN %d AND %d
+                AND kind NOT IN (%d, %d)
+                ORDER BY time
+                ''' % (where_sql, start_of_month, last_second_of_month,
+                KindConstant.STATUS, KindConstant.GCSTATUS), jid_tuple)
+            result = cur.fetchall()
 
         # convert timestamps to day of month
         for line in result:
@@ -755,14 +1269,15 @@ class Logger:
                 return None
             where_sql = 'jid_id = ?'
             jid_tuple = (jid_id,)
-        self.cur.execute('''
-            SELECT MAX(time) FROM logs
-            WHERE (%s)
-            AND kind NOT IN (%d, %d)
-            ''' % (where_sql, KindConstant.STATUS, KindConstant.GCSTATUS),
-            jid_tuple)
+        with self.read_cursor() as cur:
+            cur.execute('''
+                SELECT MAX(time) FROM logs
+                WHERE (%s)
+                AND kind NOT IN (%d, %d)
+                ''' % (where_sql, KindConstant.STATUS, KindConstant.GCSTATUS),
+                jid_tuple)
 
-        results = self.cur.fetchone()
+            results = cur.fetchone()
         if results is not None:
             result = results[0]
         else:
@@ -892,39 +1407,64 @@ class Logger:
 
         # list of corrupted entries that will be removed
         to_be_removed = []
-        for hash_method, hash_, data in self.cur:
-            # for each row: unpack the data field
-            # (format: (category, type, name, category, type, name, ...
-            #   ..., 'FEAT', feature1, feature2, ...).join(' '))
-            # NOTE: if there's a need to do more gzip, put that to a function
+        for hash_method, hash_, data in self.cur.fetchall():
             try:
-                data = GzipFile(fileobj=BytesIO(data)).read().decode('utf-8').split('\0')
+                identities, features = self._decode_caps_data(data)
             except IOError:
                 # This data is corrupted. It probably contains non-ascii chars
                 to_be_removed.append((hash_method, hash_))
                 continue
-            i = 0
-            identities = list()
-            features = list()
-            while i < (len(data) - 3) and data[i] != 'FEAT':
-                category = data[i]
-                type_ = data[i + 1]
-                lang = data[i + 2]
-                name = data[i + 3]
-                identities.append({'category': category, 'type': type_,
-                        'xml:lang': lang, 'name': name})
-                i += 4
-            i+=1
-            while i < len(data):
-                features.append(data[i])
-                i += 1
-
             # yield the row
             yield hash_method, hash_, identities, features
         for hash_method, hash_ in to_be_removed:
-            sql = '''DELETE FROM caps_cache WHERE hash_method = "%s" AND
-                    hash = "%s"''' % (hash_method, hash_)
-            self.simple_commit(sql)
+            self._remove_caps_entry(hash_method, hash_)
+
+    def get_caps_data(self, hash_method, hash_):
+        """
+        Return (identities, features) stored for this hash, or None if it is
+        not in the database
+        """
+        try:
+            self.cur.execute('''SELECT data FROM caps_cache
+                WHERE hash_method = ? AND hash = ?''', (hash_method, hash_))
+            row = self.cur.fetchone()
+        except sqlite.OperationalError:
+            # no caps_cache table, cache database is not attached
+            return None
+        if not row:
+            return None
+        try:
+            return self._decode_caps_data(row[0])
+        except IOError:
+            self._remove_caps_entry(hash_method, hash_)
+            return None
+
+    def _decode_caps_data(self, data):
+        # unpack the data field
+        # (format: (category, type, name, category, type, name, ...
+        #   ..., 'FEAT', feature1, feature2, ...).join(' '))
+        data = GzipFile(fileobj=BytesIO(data)).read().decode('utf-8').split('\0')
+        i = 0
+        identities = list()
+        features = list()
+        while i < (len(data) - 3) and data[i] != 'FEAT':
+            category = data[i]
+            type_ = data[i + 1]
+            lang = data[i + 2]
+            name = data[i + 3]
+            identities.append({'category': category, 'type': type_,
+                    'xml:lang': lang, 'name': name})
+            i += 4
+        i+=1
+        while i < len(data):
+            features.append(data[i])
+            i += 1
+        return identities, features
+
+    def _remove_caps_entry(self, hash_method, hash_):
+        self.cur.execute('''DELETE FROM caps_cache WHERE hash_method = ? AND
+                hash = ?''', (hash_method, hash_))
+        self._timeout_commit()
 
     def add_caps_entry(self, hash_method, hash_, identities, features):
         data = []
@@ -951,10 +1491,86 @@ class Logger:
         self._timeout_commit()
 
     def update_caps_time(self, method, hash_):
-        sql = '''UPDATE caps_cache SET last_seen = %d
-                WHERE hash_method = "%s" and hash = "%s"''' % \
-                (int(time.time()), method, hash_)
-        self.simple_commit(sql)
+        """
+        Mark caps as seen now. Updates are written every
+        CAPS_TIME_FLUSH_INTERVAL seconds
+        """
+        self.caps_times[(method, hash_)] = int(time.time())
+        if not self.caps_time_timeout_id:
+            self.caps_time_timeout_id = GLib.timeout_add_seconds(
+                CAPS_TIME_FLUSH_INTERVAL, self._flush_caps_times)
+
+    def _flush_caps_times(self):
+        self.caps_time_timeout_id = None
+        values = [(t, method, hash_) for (method, hash_), t in \
+            self.caps_times.items()]
+        self.caps_times = {}
+        self.cur.executemany('''UPDATE caps_cache SET last_seen = ?
+            WHERE hash_method = ? AND hash = ?''', values)
+        self._timeout_commit()
+        return False
+
+    def get_resolver_cache(self):
+        """
+        Return stored DNS results as a list of (host, type, records, expires)
+        """
+        try:
+            self.cur.execute('SELECT host, type, data, expires FROM '
+                'resolver_cache')
+            rows = self.cur.fetchall()
+        except sqlite.OperationalError:
+            # no resolver_cache table, cache database is not attached
+            return []
+        result = []
+        for host, type_, data, expires in rows:
+            try:
+                result.append((host, type_, json.loads(data), expires))
+            except ValueError:
+                continue
+        return result
+
+    def set_resolver_cache(self, host, type_, records, expires):
+        try:
+            self.cur.execute('''
+                INSERT OR REPLACE INTO resolver_cache (host, type, data,
+                expires) VALUES (?, ?, ?, ?)
+                ''', (host, type_, json.dumps(records), expires))
+        except sqlite.OperationalError:
+            return
+        self._timeout_commit()
+
+    def get_received_message_hashes(self, account, limit):
+        """
+        Return the last limit message hashes stored for account, oldest first
+
+        Older ones are removed from the database.
+        """
+        try:
+            self.cur.execute('''
+                SELECT rowid, hash FROM received_message_hashes
+                WHERE account = ? ORDER BY rowid DESC LIMIT ?
+                ''', (account, limit))
+            rows = self.cur.fetchall()
+        except sqlite.OperationalError:
+            # no received_message_hashes table, cache database is not attached
+            return []
+        if len(rows) == limit:
+            self.cur.execute('''
+                DELETE FROM received_message_hashes
+                WHERE account = ? AND rowid < ?
+                ''', (account, rows[-1][0]))
+            self._timeout_commit()
+        return [bytes(hash_) for rowid, hash_ in reversed(rows)]
+
+    def add_received_message_hashes(self, account, hashes):
+        try:
+            self.cur.executemany('''
+                INSERT OR IGNORE INTO received_message_hashes (account, hash)
+                VALUES (?, ?)
+                ''', [(account, hash_) for hash_ in hashes])
+        except sqlite.OperationalError:
+            return
+        self._timeout_commit()
 
     def clean_caps_table(self):
         """
@@ -978,23 +1594,95 @@ class Logger:
         gajim.config.set_per('accounts', account_name, 'roster_version', '')
 
         account_jid = gajim.get_jid_from_account(account_name)
-        account_jid_id = self.get_jid_id(account_jid)
-
-        # Delete old roster
-        self.remove_roster(account_jid)
-
-        # Fill roster tables with the new roster
-        for jid in roster:
-            self.add_or_update_contact(account_jid, jid, roster[jid]['name'],
-                roster[jid]['subscription'], roster[jid]['ask'],
-                roster[jid]['groups'], commit=False)
-        self._timeout_commit()
+        self.replace_roster_entries(account_jid, roster)
 
         # At this point, we are sure the replacement works properly so we can
         # set the new roster_version value.
         gajim.config.set_per('accounts', account_name, 'roster_version',
             roster_version)
 
+    def replace_roster_entries(self, account_jid, roster):
+        """
+        Make the stored account_jid roster equal to roster, writing only the
+        entries that changed
+        """
+        account_jid_id = self.get_jid_id(account_jid)
+        jid_ids = self._get_jid_ids([jid for jid in roster if \
+            roster[jid]['subscription'] != 'remove'])
+
+        # {jid_id: (name, subscription, ask, groups)}
+        old_entries = self._get_roster_rows(account_jid_id)
+        new_entries = {}
+        for jid, jid_id in jid_ids.items():
+            item = roster[jid]
+            new_entries[jid_id] = (item['name'] or '',
+                self.convert_human_subscription_values_to_db_api_values(
+                item['subscription']), bool(item['ask']),
+                frozenset(item['groups']))
+
+        removed = [(account_jid_id, jid_id) for jid_id in old_entries if \
+            jid_id not in new_entries]
+        changed = [jid_id for jid_id, entry in new_entries.items() if \
+            old_entries.get(jid_id) != entry]
+        if not removed and not changed:
+            return
+
+        removed.extend((account_jid_id, jid_id) for jid_id in changed if \
+            jid_id in old_entries)
+        self.cur.executemany(
+            'DELETE FROM roster_group WHERE account_jid_id=? AND jid_id=?',
+            removed)
+        self.cur.executemany(
+            'DELETE FROM roster_entry WHERE account_jid_id=? AND jid_id=?',
+            removed)
+        self.cur.executemany(
+            'INSERT INTO roster_entry VALUES(?, ?, ?, ?, ?)',
+            ((account_jid_id, jid_id) + new_entries[jid_id][:3] for jid_id \
+            in changed))
+        self.cur.executemany('INSERT INTO roster_group VALUES(?, ?, ?)',
+            ((account_jid_id, jid_id, group) for jid_id in changed for group \
+            in new_entries[jid_id][3]))
+        self._timeout_commit()
+
+    def _get_jid_ids(self, jids):
+        """
+        Return {jid: jid_id} for these bare jids, adding the missing ones to
+        the jids table in one transaction
+        """
+        new_jids = [(jid, JIDConstant.NORMAL_TYPE) for jid in jids if jid not \
+            in self.jids_already_in]
+        if new_jids:
+            try:
+                self.cur.executemany(
+                    'INSERT OR IGNORE INTO jids (jid, type) VALUES (?, ?)',
+                    new_jids)
+                self.con.commit()
+            except sqlite.OperationalError as e:
+                raise exceptions.PysqliteOperationalError(str(e))
+            self.get_jids_already_in_db()
+        return {jid: self.jids_already_in[jid][0] for jid in jids}
+
+    def _get_roster_rows(self, account_jid_id):
+        """
+        Return {jid_id: (name, subscription, ask, groups)} as stored in DB
+        """
+        entries = {}
+        self.cur.execute('''
+                SELECT re.jid_id, re.name, re.subscription, re.ask,
+                rg.group_name
+                FROM roster_entry re LEFT JOIN roster_group rg
+                ON rg.account_jid_id=re.account_jid_id AND rg.jid_id=re.jid_id
+                WHERE re.account_jid_id=?''', (account_jid_id,))
+        groups = {}
+        for jid_id, name, subscription, ask, group_name in self.cur:
+            if jid_id not in entries:
+                entries[jid_id] = (name or '', subscription, bool(ask))
+                groups[jid_id] = set()
+            if group_name is not None:
+                groups[jid_id].add(group_name)
+        return {jid_id: entry + (frozenset(groups[jid_id]),) for jid_id, entry \
+            in entries.items()}
+
     def del_contact(self, account_jid, jid):
         """
         Remove jid from account_jid roster
@@ -1054,40 +1742,26 @@ class Logger:
         data = {}
         account_jid_id = self.get_jid_id(account_jid)
 
-        # First we fill data with roster_entry informations
+        # roster entries and their groups, one row per group
         self.cur.execute('''
-                SELECT j.jid, re.jid_id, re.name, re.subscription, re.ask
-                FROM roster_entry re, jids j
-                WHERE re.account_jid_id=? AND j.jid_id=re.jid_id''', (account_jid_id,))
-        for jid, jid_id, name, subscription, ask in self.cur:
-            jid = jid
-            name = name
-            data[jid] = {}
-            if name:
-                data[jid]['name'] = name
-            else:
-                data[jid]['name'] = None
-            data[jid]['subscription'] = \
-                    self.convert_db_api_values_to_human_subscription_values(
-                    subscription)
-            data[jid]['groups'] = []
-            data[jid]['resources'] = {}
-            if ask:
-                data[jid]['ask'] = 'subscribe'
-            else:
-                data[jid]['ask'] = None
-            data[jid]['id'] = jid_id
-
-        # Then we add group for roster entries
-        for jid in data:
-            self.cur.execute('''
-                    SELECT group_name FROM roster_group
-                    WHERE account_jid_id=? AND jid_id=?''',
-                    (account_jid_id, data[jid]['id']))
-            for (group_name,) in self.cur:
-                group_name = group_name
+                SELECT j.jid, re.name, re.subscription, re.ask, rg.group_name
+                FROM roster_entry re JOIN jids j ON j.jid_id=re.jid_id
+                LEFT JOIN roster_group rg
+                ON rg.account_jid_id=re.account_jid_id AND rg.jid_id=re.jid_id
+                WHERE re.account_jid_id=?''', (account_jid_id,))
+        for jid, name, subscription, ask, group_name in self.cur:
+            if jid not in data:
+                data[jid] = {
+                    'name': name or None,
+                    'subscription': \
+                        self.convert_db_api_values_to_human_subscription_values(
+                        subscription),
+                    'groups': [],
+                    'resources': {},
+                    'ask': 'subscribe' if ask else None,
+                }
+            if group_name is not None:
                 data[jid]['groups'].append(group_name)
-            del data[jid]['id']
 
         return data
 
@@ -1103,53 +1777,118 @@ class Logger:
                 (account_jid_id,))
         self._timeout_commit()
 
-    def save_if_not_exists(self, with_, direction, tim, msg='', nick=None, additional_data=None):
-        if additional_data is None:
-            additional_data = {}
-        if tim:
-            time_col = float(tim)
-        else:
-            time_col = float(time.time())
-        if not msg:
-            return
+    def _get_archived_message_kind(self, with_, direction, nick):
+        """
+        Return the kind and the jid to log a message from a server archive
+        with, or None if it must not be logged
+        """
         if self.jid_is_from_pm(with_) or nick:
             # It's a groupchat message
             if nick:
                 # It's a message from a groupchat occupent
-                type_ = 'gc_msg'
-                with_ = with_ + '/' + nick
-            else:
-                # It's a server message message, we don't log them
-                return
-        else:
-            if direction == 'from':
-                type_ = 'chat_msg_recv'
-            elif direction == 'to':
-                type_ = 'chat_msg_sent'
-        jid_id = self.get_jid_id(with_)
-        where_sql = 'jid_id = %s AND message=?' % jid_id
-        if type_ == 'gc_msg':
+                return 'gc_msg', with_ + '/' + nick
+            # It's a server message message, we don't log them
+            return None
+        if direction == 'from':
+            return 'chat_msg_recv', with_
+        if direction == 'to':
+            return 'chat_msg_sent', with_
+        return None
+
+    def _get_archived_message_jid_ids(self, kind, with_):
+        """
+        Return the jid_ids under which a copy of an archived message may
+        already be logged
+        """
+        jid_ids = [self.get_jid_id(with_)]
+        if kind == 'gc_msg':
             # We cannot differentiate gc message and pm messages, so look in
             # both logs
             with_2 = gajim.get_jid_without_resource(with_)
             if with_ != with_2:
-                jid_id2 = self.get_jid_id(with_2)
-                where_sql = 'jid_id in (%s, %s) AND message=?' % (jid_id,
-                    jid_id2)
-        start_time = time_col - 300 # 5 minutes arrount given time
-        end_time = time_col + 300 # 5 minutes arrount given time
-        self.cur.execute('''
-            SELECT log_line_id FROM logs
-            WHERE (%s)
-            AND time BETWEEN %d AND %d
-            ORDER BY time
-            ''' % (where_sql, start_time, end_time), (msg,))
-        results = self.cur.fetchall()
-        if results:
-            log.debug('Log already in DB, ignoring it')
+                jid_ids.append(self.get_jid_id(with_2))
+        return jid_ids
+
+    def save_if_not_exists(self, with_, direction, tim, msg='', nick=None, additional_data=None):
+        self.save_archived_messages([(with_, direction, tim, msg, nick,
+            additional_data, None)])
+
+    def save_archived_messages(self, messages):
+        """
+        Store a page of messages received from a server archive
+
+        messages is a list of (with_, direction, tim, msg, nick,
+        additional_data, archive_id) tuples. Messages we already have, with the
+        same archive id or with the same text 5 minutes around the same time,
+        are ignored. The remaining ones are written in one transaction.
+        """
+        rows = []
+        for with_, direction, tim, msg, nick, additional_data, archive_id in \
+        messages:
+            if not msg:
+                continue
+            res = self._get_archived_message_kind(with_, direction, nick)
+            if res is None:
+                continue
+            kind, with_ = res
+            if tim:
+                time_col = float(tim)
+            else:
+                time_col = float(time.time())
+            jid_ids = self._get_archived_message_jid_ids(kind, with_)
+            rows.append((kind, with_, time_col, msg, additional_data,
+                archive_id, jid_ids))
+        if not rows:
             return
-        log.debug('New log received from server archives, storing it')
-        self.write(type_, with_, message=msg, tim=tim, additional_data=additional_data)
+
+        # Fetch in one query what we already have around these messages, the
+        # messages just logged must be in it too
+        self.flush()
+        all_jid_ids = set()
+        for row in rows:
+            all_jid_ids.update(row[6])
+        start_time = min(row[2] for row in rows) - 300
+        end_time = max(row[2] for row in rows) + 300
+        known_archive_ids = set()
+        known_messages = {} # (jid_id, message): [time, ...]
+        with self.read_cursor() as cur:
+            cur.execute('''
+                SELECT jid_id, time, message, stanza_id FROM logs
+                WHERE jid_id IN (%s) AND time BETWEEN ? AND ?
+                ''' % ', '.join('?' * len(all_jid_ids)),
+                tuple(all_jid_ids) + (start_time, end_time))
+            for jid_id, time_, message, stanza_id in cur:
+                if stanza_id:
+                    known_archive_ids.add((jid_id, stanza_id))
+                known_messages.setdefault((jid_id, message), []).append(time_)
+
+        statements = []
+        nb_new = 0
+        for kind, with_, time_col, msg, additional_data, archive_id, jid_ids \
+        in rows:
+            if archive_id and (jid_ids[0], archive_id) in known_archive_ids:
+                log.debug('Log already in DB, ignoring it')
+                continue
+            if any(abs(time_ - time_col) <= 300 for jid_id in jid_ids
+            for time_ in known_messages.get((jid_id, msg), ())):
+                log.debug('Log already in DB, ignoring it')
+                continue
+            res = self._get_log_values(kind, with_, msg, None, time_col, None,
+                additional_data, archive_id)
+            if res is None:
+                continue
+            values, write_unread = res
+            statements.extend(self._get_log_statements(values, write_unread,
+                ignore_duplicate=True)[1])
+            nb_new += 1
+            # The same message can be twice in one page
+            if archive_id:
+                known_archive_ids.add((jid_ids[0], archive_id))
+            known_messages.setdefault((jid_ids[0], msg), []).append(time_col)
+        if statements:
+            log.debug('Storing %d new logs received from server archives' % \
+                nb_new)
+            self._queue_writes(statements)
 
     def _nec_gc_message_received(self, obj):
         tim_f = float(obj.timestamp)
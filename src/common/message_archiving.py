@@ -23,9 +23,10 @@ from common import gajim
 from common import ged
 from common import helpers
 from common.connection_handlers_events import ArchivingReceivedEvent
+from common.connection_handlers_events import MamCatchupProgressEvent
 
 from calendar import timegm
-from time import localtime
+from time import gmtime, localtime, strftime, time
 
 import logging
 log = logging.getLogger('gajim.c.message_archiving')
@@ -35,6 +36,48 @@ ARCHIVING_COLLECTION_ARRIVED = 'archiving_collection_arrived'
 ARCHIVING_MODIFICATIONS_ARRIVED = 'archiving_modifications_arrived'
 MAM_RESULTS_ARRIVED = 'mam_results_arrived'
 
+# Where to start when we never synchronized with the archive
+MAM_FIRST_SYNC_TIME = 1361677902 # 2013-02-24T03:51:42Z
+# Don't split the archive in time windows shorter than that (in seconds)
+MAM_MIN_WINDOW = 3600
+# How many times a page is asked again when the server replies with an error
+MAM_MAX_RETRIES = 2
+
+class MamWindow:
+    """
+    A time range of the server archive, fetched page after page
+
+    start and end are in seconds since EPOCH, None means unbounded. after is
+    the archive id of the last message we received in this window.
+    """
+    def __init__(self, start, end, after=None, complete=False):
+        self.start = start
+        self.end = end
+        self.after = after
+        self.complete = complete
+        self.in_flight = False
+        # errors received for this window, a window with more than
+        # MAM_MAX_RETRIES errors is left for the next catch-up
+        self.errors = 0
+
+    @property
+    def failed(self):
+        return self.errors > MAM_MAX_RETRIES
+
+    def __str__(self):
+        return '%s %s %s %d' % (self.start or '-', self.end or '-',
+            self.after or '-', self.complete)
+
+    @classmethod
+    def from_string(cls, string):
+        start, end, after, complete = string.split(' ')
+        return cls(int(start) if start != '-' else None,
+            int(end) if end != '-' else None,
+            after if after != '-' else None, complete == '1')
+
+def mam_time(timestamp):
+    return strftime('%Y-%m-%dT%H:%M:%SZ', gmtime(timestamp))
+
 class ConnectionArchive:
     def __init__(self):
         pass
@@ -45,6 +88,12 @@ class ConnectionArchive313(ConnectionArchive):
         ConnectionArchive.__init__(self)
         self.archiving_313_supported = False
         self.mam_awaiting_disco_result = {}
+        # messages of the current archive page, stored together when the page
+        # is complete
+        self.mam_page = []
+        self.mam_windows = []
+        self.mam_catchup_start = 0
+        self.mam_catchup_nb_messages = 0
         self.iq_answer = []
         gajim.ged.register_event_handler('raw-message-received', ged.CORE,
             self._nec_raw_message_313_received)
@@ -82,23 +131,25 @@ class ConnectionArchive313(ConnectionArchive):
 
     def _nec_agent_info(self, obj):
         if obj.jid in self.mam_awaiting_disco_result:
+            messages = []
             for identity in obj.identities:
                 if identity['category'] == 'conference':
                     # it's a groupchat
-                    for with_, direction, tim, msg_txt, res in \
-                    self.mam_awaiting_disco_result[obj.jid]:
+                    for with_, direction, tim, msg_txt, res, additional_data, \
+                    archive_id in self.mam_awaiting_disco_result[obj.jid]:
                         gajim.logger.get_jid_id(with_, 'ROOM')
-                        gajim.logger.save_if_not_exists(with_, direction, tim,
-                            msg=msg_txt, nick=res)
-                    del self.mam_awaiting_disco_result[obj.jid]
-                    return
-            # it's not a groupchat
-            for with_, direction, tim, msg_txt, res in \
-            self.mam_awaiting_disco_result[obj.jid]:
-                gajim.logger.get_jid_id(with_)
-                gajim.logger.save_if_not_exists(with_, direction, tim,
-                    msg=msg_txt)
+                        messages.append((with_, direction, tim, msg_txt, res,
+                            additional_data, archive_id))
+                    break
+            else:
+                # it's not a groupchat
+                for with_, direction, tim, msg_txt, res, additional_data, \
+                archive_id in self.mam_awaiting_disco_result[obj.jid]:
+                    gajim.logger.get_jid_id(with_)
+                    messages.append((with_, direction, tim, msg_txt, None,
+                        additional_data, archive_id))
             del self.mam_awaiting_disco_result[obj.jid]
+            gajim.logger.save_archived_messages(messages)
 
     def _nec_raw_message_313_received(self, obj):
         if obj.conn.name != self.name:
@@ -113,25 +164,170 @@ class ConnectionArchive313(ConnectionArchive):
             return
 
         if self.awaiting_answers[queryid_][0] == MAM_RESULTS_ARRIVED:
+            window = self.awaiting_answers[queryid_][1]
+            del self.awaiting_answers[queryid_]
+            self.store_mam_page()
+            last = None
             set_ = fin_.getTag('set', namespace=nbxmpp.NS_RSM)
             if set_:
                 last = set_.getTagData('last')
+            complete = fin_.getAttr('complete') == 'true' or not last
+            if window is None:
                 if last:
-                    gajim.config.set_per('accounts', self.name, 'last_mam_id', last)
-                    complete = fin_.getAttr('complete')
-                    if complete != 'true':
+                    gajim.config.set_per('accounts', self.name, 'last_mam_id',
+                        last)
+                    if not complete:
                         self.request_archive(after=last)
-
-            del self.awaiting_answers[queryid_]
+                return
+            self._on_mam_window_page_received(window, last, complete)
 
     def _nec_mam_decrypted_message_received(self, obj):
         if obj.conn.name != self.name:
             return
-        gajim.logger.save_if_not_exists(obj.with_, obj.direction, obj.tim,
-            msg=obj.msgtxt, nick=obj.nick, additional_data=obj.additional_data)
+        self.mam_catchup_nb_messages += 1
+        self.mam_page.append((obj.with_, obj.direction, obj.tim, obj.msgtxt,
+            obj.nick, obj.additional_data, obj.archive_id))
+        if not any(answer[0] == MAM_RESULTS_ARRIVED for answer in \
+        self.awaiting_answers.values()):
+            # No page in progress, message was decrypted after its page end
+            self.store_mam_page()
+
+    def store_mam_page(self):
+        """
+        Store in one go the messages received for the current archive page
+        """
+        if not self.mam_page:
+            return
+        page = self.mam_page
+        self.mam_page = []
+        gajim.logger.save_archived_messages(page)
+
+    def start_mam_catchup(self):
+        """
+        Fetch what we missed from the server archive
+
+        The missing time range is split into windows that are fetched
+        concurrently, at most mam_parallel_queries pages at a time. The state
+        of each window is saved after each page so that we can resume after a
+        disconnection.
+        """
+        self.mam_catchup_start = time()
+        self.mam_catchup_nb_messages = 0
+        state = gajim.config.get_per('accounts', self.name,
+            'mam_catchup_windows')
+        if state:
+            try:
+                self.mam_windows = [MamWindow.from_string(w) for w in \
+                    state.split('|')]
+            except ValueError:
+                log.warning('Invalid MAM catch-up state: %s', state)
+                self.mam_windows = []
+        else:
+            self.mam_windows = []
+        now = int(self.mam_catchup_start)
+        if self.mam_windows:
+            # also fetch what arrived since the interrupted catch-up
+            end = max(w.end or 0 for w in self.mam_windows)
+            if end < now:
+                self.mam_windows.insert(0, MamWindow(end, now))
+                self._save_mam_windows()
+        else:
+            start = gajim.config.get_per('accounts', self.name, 'mam_sync_time')
+            last_mam_id = gajim.config.get_per('accounts', self.name,
+                'last_mam_id')
+            if not start and last_mam_id:
+                # We don't know when this message was, continue after it
+                self.mam_windows = [MamWindow(None, now, after=last_mam_id)]
+            else:
+                self.mam_windows = self._split_mam_range(
+                    start or MAM_FIRST_SYNC_TIME, now)
+            self._save_mam_windows()
+        self._request_mam_pages()
+
+    def _split_mam_range(self, start, end):
+        """
+        Return windows covering [start, end], newest first
+        """
+        parallel = max(1, gajim.config.get_per('accounts', self.name,
+            'mam_parallel_queries'))
+        nb = max(1, min(parallel * 2, (end - start) // MAM_MIN_WINDOW))
+        step = (end - start) // nb + 1
+        windows = []
+        for i in range(nb):
+            windows.append(MamWindow(start + i * step,
+                min(start + (i + 1) * step, end)))
+        windows.reverse()
+        return windows
+
+    def _save_mam_windows(self):
+        gajim.config.set_per('accounts', self.name, 'mam_catchup_windows',
+            '|'.join(str(w) for w in self.mam_windows))
+
+    def _request_mam_pages(self):
+        parallel = max(1, gajim.config.get_per('accounts', self.name,
+            'mam_parallel_queries'))
+        page_size = gajim.config.get_per('accounts', self.name,
+            'mam_page_size')
+        in_flight = len([w for w in self.mam_windows if w.in_flight])
+        for window in self.mam_windows:
+            if in_flight >= parallel:
+                break
+            if window.complete or window.in_flight or window.failed:
+                continue
+            start = end = None
+            if window.start:
+                start = mam_time(window.start)
+            if window.end:
+                end = mam_time(window.end)
+            window.in_flight = True
+            in_flight += 1
+            self.request_archive(start=start, end=end, after=window.after,
+                max=page_size, window=window)
+
+    def _on_mam_window_page_received(self, window, last, complete):
+        window.in_flight = False
+        window.errors = 0
+        if last:
+            window.after = last
+        window.complete = complete
+        self._on_mam_window_changed()
+
+    def _on_mam_window_error(self, window):
+        window.in_flight = False
+        window.errors += 1
+        if window.failed:
+            log.warning('Giving up fetching MAM window %s for now', window)
+        self._on_mam_window_changed()
+
+    def _on_mam_window_changed(self):
+        finished = all(w.complete or w.failed for w in self.mam_windows)
+        if finished and all(w.complete for w in self.mam_windows):
+            # windows are sorted newest first
+            newest = self.mam_windows[0]
+            if newest.after:
+                gajim.config.set_per('accounts', self.name, 'last_mam_id',
+                    newest.after)
+            gajim.config.set_per('accounts', self.name, 'mam_sync_time',
+                max(w.end or 0 for w in self.mam_windows))
+            self.mam_windows = []
+        elif finished:
+            # keep the failed windows for the next catch-up
+            self.mam_windows = [w for w in self.mam_windows if not w.complete]
+        self._save_mam_windows()
+        nb_windows = len(self.mam_windows)
+        nb_complete = len([w for w in self.mam_windows if w.complete])
+        if finished:
+            self.mam_windows = []
+        else:
+            self._request_mam_pages()
+        gajim.nec.push_incoming_event(MamCatchupProgressEvent(None, conn=self,
+            nb_windows=nb_windows, nb_complete=nb_complete,
+            nb_messages=self.mam_catchup_nb_messages,
+            elapsed=time() - self.mam_catchup_start,
+            finished=finished))
 
     def request_archive(self, start=None, end=None, with_=None, after=None,
-    max=30):
+    max=30, window=None):
         iq_ = nbxmpp.Iq('set')
         query = iq_.addChild('query', namespace=nbxmpp.NS_MAM)
         x = query.addChild(node=nbxmpp.DataForm(typ='submit'))
@@ -150,8 +346,23 @@ class ConnectionArchive313(ConnectionArchive):
         query.setAttr('queryid', queryid_)
         id_ = self.connection.getAnID()
         iq_.setID(id_)
-        self.awaiting_answers[queryid_] = (MAM_RESULTS_ARRIVED, )
-        self.connection.send(iq_)
+        self.awaiting_answers[queryid_] = (MAM_RESULTS_ARRIVED, window)
+        self.connection.SendAndCallForResponse(iq_, self._on_mam_query_answer,
+            {'queryid': queryid_})
+
+    def _on_mam_query_answer(self, conn, result, queryid):
+        """
+        Called with the reply to a MAM query, pages themselves arrive in
+        messages. On error no fin message comes, so the query is given up
+        here
+        """
+        if result.getType() != 'error' or queryid not in self.awaiting_answers:
+            return
+        window = self.awaiting_answers.pop(queryid)[1]
+        log.warning('MAM query failed: %s', result.getError())
+        self.store_mam_page()
+        if window is not None:
+            self._on_mam_window_error(window)
 
     def request_archive_preferences(self):
         if not gajim.account_is_connected(self.name):
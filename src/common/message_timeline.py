@@ -0,0 +1,127 @@
+##      common/message_timeline.py
+##
+## This file is part of Gajim.
+##
+## Gajim is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published
+## by the Free Software Foundation; version 3 only.
+##
+## Gajim is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Gajim.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Ordered list of the lines printed in a conversation
+
+Lines are kept sorted by timestamp so the place of a delayed message is found
+with a binary search, and lines are indexed by stanza id and mark so the line
+to correct is found without walking the whole conversation. Several lines can
+have the same stanza id, e.g. when two group chat occupants use the same id.
+"""
+
+from bisect import bisect_left, bisect_right
+
+
+class MessageTimeline:
+    """
+    Lines are (timestamp, line start mark, stanza id) tuples. The marks are
+    opaque here, they are only hashed and compared by identity
+    """
+
+    def __init__(self):
+        # timestamps, sorted, kept in step with self.lines for bisect
+        self.times = []
+        self.lines = []
+        # dict {(stanza id, mark): timestamp} of the lines with a stanza id
+        self.stanza_ids = {}
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, index):
+        return self.lines[index]
+
+    def clear(self):
+        self.times = []
+        self.lines = []
+        self.stanza_ids = {}
+
+    def get_insert_point(self, timestamp):
+        """
+        Return (mark, index) of the line a message with this timestamp has to
+        be inserted before, or (None, None) if it goes at the end
+        """
+        index = bisect_right(self.times, timestamp)
+        if index == len(self.lines):
+            return None, None
+        return self.lines[index][1], index
+
+    def find(self, stanza_id, mark):
+        """
+        Return the index of the line with that stanza id starting at mark, or
+        None if there is no such line
+        """
+        try:
+            timestamp = self.stanza_ids[(stanza_id, mark)]
+        except KeyError:
+            return None
+        index = bisect_left(self.times, timestamp)
+        while index < len(self.lines) and self.times[index] == timestamp:
+            if self.lines[index][1] is mark:
+                return index
+            index += 1
+        return None
+
+    def get_next_mark(self, index):
+        """
+        Return the start mark of the line after index, None for the last line
+        """
+        if index + 1 < len(self.lines):
+            return self.lines[index + 1][1]
+        return None
+
+    def add(self, timestamp, mark, stanza_id, index=None):
+        """
+        Add a line at index, or at the end if index is None. index must be
+        the one returned by get_insert_point() for that timestamp
+        """
+        if index is None:
+            index = len(self.lines)
+            if self.lines and self.times[-1] > timestamp:
+                # keep the list sorted even if the caller didn't ask where
+                index = bisect_right(self.times, timestamp)
+        self.times.insert(index, timestamp)
+        self.lines.insert(index, (timestamp, mark, stanza_id))
+        if stanza_id:
+            self.stanza_ids[(stanza_id, mark)] = timestamp
+
+    def replace(self, index, mark, stanza_id):
+        """
+        Replace the line at index by a corrected one. The corrected line
+        stays where the original was, so it keeps the original timestamp
+        """
+        timestamp, old_mark, old_stanza_id = self.lines[index]
+        self.stanza_ids.pop((old_stanza_id, old_mark), None)
+        self.lines[index] = (timestamp, mark, stanza_id)
+        if stanza_id:
+            self.stanza_ids[(stanza_id, mark)] = timestamp
+
+    def prune(self, max_lines):
+        """
+        Remove the oldest lines so that at most max_lines are left and return
+        the removed lines
+        """
+        excess = len(self.lines) - max_lines
+        if max_lines <= 0 or excess <= 0:
+            return []
+        removed = self.lines[:excess]
+        del self.lines[:excess]
+        del self.times[:excess]
+        for timestamp, mark, stanza_id in removed:
+            self.stanza_ids.pop((stanza_id, mark), None)
+        return removed
@@ -43,6 +43,55 @@ class NetworkEventsController(object):
         Values: list of class objects that are subclasses
         of `NetworkOutgoingEvent`
         '''
+        self.skip_unhandled_events = True
+        '''
+        Don't generate skippable events when nothing handles them
+        '''
+        self._incoming_chains = {}
+        self._outgoing_chains = {}
+        '''
+        Keys: names of events
+        Values: tuple of classes to generate based on that event, without the
+        skippable ones that are not handled
+        '''
+        self._chains_ged_version = None
+
+    def _invalidate_chains(self):
+        self._incoming_chains = {}
+        self._outgoing_chains = {}
+
+    def _is_handled(self, event_name, generators, seen):
+        '''
+        Return True if a GED handler exists for event_name or for an event
+        generated on it
+        '''
+        if gajim.ged.has_handlers(event_name):
+            return True
+        seen.add(event_name)
+        for event_class in generators.get(event_name, []):
+            if not event_class.skippable:
+                return True
+            if event_class.name in seen:
+                continue
+            if self._is_handled(event_class.name, generators, seen):
+                return True
+        return False
+
+    def _get_chain(self, event_name, outgoing=False):
+        if self._chains_ged_version != gajim.ged.version:
+            self._invalidate_chains()
+            self._chains_ged_version = gajim.ged.version
+        if outgoing:
+            generators = self.outgoing_events_generators
+            chains = self._outgoing_chains
+        else:
+            generators = self.incoming_events_generators
+            chains = self._incoming_chains
+        if event_name not in chains:
+            chains[event_name] = tuple(c for c in generators.get(event_name,
+                []) if not c.skippable or self._is_handled(c.name, generators,
+                set()))
+        return chains[event_name]
 
     def register_incoming_event(self, event_class):
         for base_event_name in event_class.base_network_events:
@@ -50,12 +99,14 @@ class NetworkEventsController(object):
                 base_event_name, [])
             if not event_class in event_list:
                 event_list.append(event_class)
+        self._invalidate_chains()
 
     def unregister_incoming_event(self, event_class):
         for base_event_name in event_class.base_network_events:
             if base_event_name in self.incoming_events_generators:
                 self.incoming_events_generators[base_event_name].remove(
                     event_class)
+        self._invalidate_chains()
 
     def register_outgoing_event(self, event_class):
         for base_event_name in event_class.base_network_events:
@@ -63,12 +114,14 @@ class NetworkEventsController(object):
                 base_event_name, [])
             if not event_class in event_list:
                 event_list.append(event_class)
+        self._invalidate_chains()
 
     def unregister_outgoing_event(self, event_class):
         for base_event_name in event_class.base_network_events:
             if base_event_name in self.outgoing_events_generators:
                 self.outgoing_events_generators[base_event_name].remove(
                     event_class)
+        self._invalidate_chains()
 
     def push_incoming_event(self, event_object):
         if event_object.generate():
@@ -90,9 +143,12 @@ class NetworkEventsController(object):
         based on attribute in new network events object.
         '''
         base_event_name = event_object.name
-        if base_event_name in self.incoming_events_generators:
-            for new_event_class in self.incoming_events_generators[
-            base_event_name]:
+        if self.skip_unhandled_events:
+            generators = self._get_chain(base_event_name)
+        else:
+            generators = self.incoming_events_generators.get(base_event_name, [])
+        if generators:
+            for new_event_class in generators:
                 new_event_object = new_event_class(None,
                     base_event=event_object)
                 if new_event_object.generate():
@@ -111,9 +167,12 @@ class NetworkEventsController(object):
         based on attribute in new network events object.
         '''
         base_event_name = event_object.name
-        if base_event_name in self.outgoing_events_generators:
-            for new_event_class in self.outgoing_events_generators[
-            base_event_name]:
+        if self.skip_unhandled_events:
+            generators = self._get_chain(base_event_name, outgoing=True)
+        else:
+            generators = self.outgoing_events_generators.get(base_event_name, [])
+        if generators:
+            for new_event_class in generators:
                 new_event_object = new_event_class(None,
                     base_event=event_object)
                 if new_event_object.generate():
@@ -124,6 +183,12 @@ class NetworkEventsController(object):
 
 class NetworkEvent(object):
     name = ''
+    skippable = False
+    '''
+    If True, the event is not generated when no handler is registered for it
+    or for any event generated on it. Only set it when generate() has no side
+    effects.
+    '''
 
     def __init__(self, new_name, **kwargs):
         if new_name:
@@ -33,6 +33,7 @@ from time import time
 from common import gajim
 from common import helpers
 from common import caps_cache
+from common import check_paths
 
 import sqlite3 as sqlite
 from common import logger
@@ -40,6 +41,9 @@ from common import logger
 import logging
 log = logging.getLogger('gajim.c.optparser')
 
+# number of log lines indexed per transaction when building the full-text index
+FTS_BACKFILL_CHUNK = 10000
+
 class OptionsParser:
     def __init__(self, filename):
         self.__filename = os.path.realpath(filename)
@@ -234,6 +238,16 @@ class OptionsParser:
             self.update_config_to_016101()
         if old < [0, 16, 10, 2] and new >= [0, 16, 10, 2]:
             self.update_config_to_016102()
+        if old < [0, 16, 10, 3] and new >= [0, 16, 10, 3]:
+            self.update_config_to_016103()
+        if old < [0, 16, 10, 4] and new >= [0, 16, 10, 4]:
+            self.update_config_to_016104()
+        if old < [0, 16, 10, 5] and new >= [0, 16, 10, 5]:
+            self.update_config_to_016105()
+        if old < [0, 16, 10, 6] and new >= [0, 16, 10, 6]:
+            self.update_config_to_016106()
+        if old < [0, 16, 10, 7] and new >= [0, 16, 10, 7]:
+            self.update_config_to_016107()
 
         gajim.logger.init_vars()
         gajim.logger.attach_cache_database()
@@ -975,3 +989,135 @@ class OptionsParser:
         con.close()
 
         gajim.config.set('version', '0.16.10.2')
+
+    def update_config_to_016103(self):
+        back = os.getcwd()
+        os.chdir(logger.LOG_DB_FOLDER)
+        con = sqlite.connect(logger.LOG_DB_FILE)
+        os.chdir(back)
+        cur = con.cursor()
+        if check_paths.create_logs_fts(cur):
+            con.commit()
+            # Index existing logs in chunks so that each transaction stays
+            # small on databases with years of history
+            last_id = 0
+            try:
+                # start from scratch if a previous run was interrupted
+                cur.execute(
+                    "INSERT INTO logs_fts(logs_fts) VALUES ('delete-all')")
+                while True:
+                    cur.execute('''
+                        SELECT MAX(log_line_id) FROM (SELECT log_line_id
+                        FROM logs WHERE log_line_id > ?
+                        ORDER BY log_line_id LIMIT ?)
+                        ''', (last_id, FTS_BACKFILL_CHUNK))
+                    chunk_end = cur.fetchone()[0]
+                    if chunk_end is None:
+                        break
+                    cur.execute('''
+                        INSERT INTO logs_fts(rowid, message, subject)
+                        SELECT log_line_id, message, subject FROM logs
+                        WHERE log_line_id > ? AND log_line_id <= ?
+                        ''', (last_id, chunk_end))
+                    con.commit()
+                    last_id = chunk_end
+            except sqlite.OperationalError as e:
+                # A partial index would silently miss old messages
+                log.warning('Failed to index logs: %s' % str(e))
+                con.rollback()
+                try:
+                    check_paths.drop_logs_fts(cur)
+                    con.commit()
+                except sqlite.OperationalError as e:
+                    log.warning('Failed to remove full-text index: %s' % \
+                        str(e))
+        con.close()
+        gajim.config.set('version', '0.16.10.3')
+
+    def update_config_to_016104(self):
+        back = os.getcwd()
+        os.chdir(logger.LOG_DB_FOLDER)
+        con = sqlite.connect(logger.LOG_DB_FILE)
+        os.chdir(back)
+        cur = con.cursor()
+        try:
+            cur.execute("ALTER TABLE logs ADD COLUMN 'stanza_id' TEXT")
+            con.commit()
+        except sqlite.OperationalError:
+            # the column already exists
+            pass
+        create_index = '''CREATE UNIQUE INDEX IF NOT EXISTS
+            idx_logs_stanza_id ON logs (jid_id, stanza_id)'''
+        try:
+            try:
+                cur.execute(create_index)
+            except sqlite.IntegrityError:
+                # the same archived message was stored several times, keep
+                # the first one
+                cur.execute('''
+                    DELETE FROM logs WHERE stanza_id IS NOT NULL AND
+                    log_line_id NOT IN (SELECT MIN(log_line_id) FROM logs
+                    WHERE stanza_id IS NOT NULL GROUP BY jid_id, stanza_id)
+                    ''')
+                cur.execute(create_index)
+            con.commit()
+        except sqlite.OperationalError as e:
+            log.warning('Failed to create stanza id index: %s' % str(e))
+        con.close()
+        gajim.config.set('version', '0.16.10.4')
+
+    def update_config_to_016105(self):
+        con = sqlite.connect(logger.CACHE_DB_PATH)
+        cur = con.cursor()
+        try:
+            cur.executescript(
+                    '''
+                    CREATE INDEX IF NOT EXISTS
+                    idx_caps_cache ON caps_cache (hash_method, hash);
+                    '''
+            )
+            con.commit()
+        except sqlite.OperationalError:
+            pass
+        con.close()
+        gajim.config.set('version', '0.16.10.5')
+
+    def update_config_to_016106(self):
+        con = sqlite.connect(logger.CACHE_DB_PATH)
+        cur = con.cursor()
+        try:
+            cur.executescript(
+                    '''
+                    CREATE TABLE IF NOT EXISTS received_message_hashes (
+                            account TEXT,
+                            hash BLOB,
+                            PRIMARY KEY (account, hash)
+                    );
+                    '''
+            )
+            con.commit()
+        except sqlite.OperationalError:
+            pass
+        con.close()
+        gajim.config.set('version', '0.16.10.6')
+
+    def update_config_to_016107(self):
+        con = sqlite.connect(logger.CACHE_DB_PATH)
+        cur = con.cursor()
+        try:
+            cur.executescript(
+                    '''
+                    CREATE TABLE IF NOT EXISTS resolver_cache (
+                            host TEXT,
+                            type TEXT,
+                            data TEXT,
+                            expires INTEGER,
+                            PRIMARY KEY (host, type)
+                    );
+                    '''
+            )
+            con.commit()
+        except sqlite.OperationalError:
+            pass
+        con.close()
+        gajim.config.set('version', '0.16.10.7')
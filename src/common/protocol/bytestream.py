@@ -38,12 +38,28 @@ from common import gajim
 from common import helpers
 from common import ged
 from common import jingle_xtls
-from common.file_props import FilesProp
+from common.file_props import FilesProp, FileHasher
 from common.socks5 import Socks5SenderClient
 
 import logging
 log = logging.getLogger('gajim.c.p.bytestream')
 
+# block size asked for when opening an In-Band Bytestream, as recommended by
+# XEP-0047. Larger blocks can be enabled with the ibb_block_size account
+# option. They are halved while the other side or a server refuses them
+IBB_BLOCK_SIZE = 4096
+IBB_MIN_BLOCK_SIZE = 4096
+# block-size is an unsigned short (XEP-0047)
+IBB_MAX_BLOCK_SIZE = 65535
+# number of data stanzas sent before waiting for the first acknowledgement
+IBB_WINDOW_SIZE = 8
+# errors on a data stanza after which the file is sent again with smaller
+# blocks, other errors stop the transfer
+IBB_BLOCK_SIZE_ERRORS = ('resource-constraint', 'not-acceptable',
+    'policy-violation')
+# seconds between two progress updates of an In-Band Bytestream
+IBB_PROGRESS_INTERVAL = 0.5
+
 def is_transfer_paused(file_props):
     if file_props.stopped:
         return False
@@ -759,7 +775,8 @@ class ConnectionIBBytestream(ConnectionBytestream):
     def __init__(self):
         ConnectionBytestream.__init__(self)
         self._streams = {}
-        self.last_sent_ibb_id = None
+        # {iq id: file_props} of the data stanzas not acknowledged yet
+        self.ibb_in_flight = {}
 
     def IBBIqHandler(self, conn, stanza):
         """
@@ -795,6 +812,8 @@ class ConnectionIBBytestream(ConnectionBytestream):
             err = nbxmpp.ERR_BAD_REQUEST
         if not sid or not blocksize:
             err = nbxmpp.ERR_BAD_REQUEST
+        elif blocksize > IBB_MAX_BLOCK_SIZE:
+            err = nbxmpp.ERR_RESOURCE_CONSTRAINT
         elif not file_props:
             err = nbxmpp.ERR_UNEXPECTED_REQUEST
         if err:
@@ -808,6 +827,7 @@ class ConnectionIBBytestream(ConnectionBytestream):
             file_props.seq = 0
             file_props.received_len = 0
             file_props.last_time = time.time()
+            file_props.last_progress_time = 0
             file_props.error = 0
             file_props.paused = False
             file_props.connected = True
@@ -815,7 +835,11 @@ class ConnectionIBBytestream(ConnectionBytestream):
             file_props.disconnect_cb = None
             file_props.continue_cb = None
             file_props.syn_id = stanza.getID()
-            file_props.fp = open(file_props.file_name, 'w')
+            if getattr(file_props, 'fp', None):
+                # the sender starts again with smaller blocks
+                file_props.fp.close()
+            file_props.fp = open(file_props.file_name, 'wb')
+            file_props.hasher = FileHasher(file_props.algo)
         conn.send(rep)
 
     def CloseIBBStream(self, file_props):
@@ -835,32 +859,38 @@ class ConnectionIBBytestream(ConnectionBytestream):
             if session.weinitiate:
                 session.cancel_session()
 
-    def OpenStream(self, sid, to, fp, blocksize=4096):
+    def OpenStream(self, sid, to, fp, blocksize=None):
         """
         Start new stream. You should provide stream id 'sid', the endpoind jid
-        'to', the file object containing info for send 'fp'. Also the desired
-        blocksize can be specified.
-        Take into account that recommended stanza size is 4k and IBB uses
-        base64 encoding that increases size of data by 1/3.
+        'to', the file object opened in binary mode containing info for send
+        'fp'. Also the desired blocksize can be specified, the ibb_block_size
+        account option is used otherwise.
+        IBB uses base64 encoding that increases size of data by 1/3. If the
+        other side refuses the blocksize, the stream is opened again with half
+        of it, down to IBB_MIN_BLOCK_SIZE.
         """
         if not nbxmpp.JID(to).getResource():
             return
+        if not blocksize:
+            blocksize = gajim.config.get_per('accounts', self.name,
+                'ibb_block_size')
         file_props = FilesProp.getFilePropBySid(sid)
         file_props.direction = '|>' + to
-        file_props.block_size = blocksize
+        file_props.block_size = min(blocksize, IBB_MAX_BLOCK_SIZE)
         file_props.fp = fp
         file_props.seq = 0
         file_props.error = 0
         file_props.paused = False
         file_props.received_len = 0
         file_props.last_time = time.time()
+        file_props.last_progress_time = 0
         file_props.connected = True
         file_props.completed = False
         file_props.disconnect_cb = None
         file_props.continue_cb = None
         syn = nbxmpp.Protocol('iq', to, 'set', payload=[nbxmpp.Node(
             nbxmpp.NS_IBB + ' open', {'sid': file_props.transport_sid,
-            'block-size': blocksize, 'stanza': 'iq'})])
+            'block-size': file_props.block_size, 'stanza': 'iq'})])
         self.connection.send(syn)
         file_props.syn_id = syn.getID()
         return file_props
@@ -879,39 +909,83 @@ class ConnectionIBBytestream(ConnectionBytestream):
                 # We waitthat other part accept stream
                 continue
             if file_props.direction[0] == '>':
-                if file_props.paused:
+                if file_props.paused or file_props.completed:
                     continue
                 if not file_props.connected:
                     #TODO: Reply with out of order error
                     continue
-                chunk = file_props.fp.read(file_props.block_size)
-                if chunk:
-                    datanode = nbxmpp.Node(nbxmpp.NS_IBB + ' data', {
-                        'sid': file_props.transport_sid,
-                        'seq': file_props.seq}, base64.b64encode(chunk.encode(
-                        'utf-8')).decode('utf-8'))
-                    file_props.seq += 1
-                    file_props.started = True
-                    if file_props.seq == 65536:
-                        file_props.seq = 0
-                    self.last_sent_ibb_id = self.connection.send(
-                        nbxmpp.Protocol(name='iq', to=file_props.direction[1:],
-                        typ='set', payload=[datanode]))
-                    current_time = time.time()
-                    file_props.elapsed_time += current_time - file_props.last_time
-                    file_props.last_time = current_time
-                    file_props.received_len += len(chunk)
-                    gajim.socks5queue.progress_transfer_cb(self.name,
-                        file_props)
-                else:
-                    # notify the other side about stream closing
-                    # notify the local user about sucessfull send
-                    # delete the local stream
-                    self.connection.send(nbxmpp.Protocol('iq',
-                        file_props.direction[1:], 'set',
-                        payload=[nbxmpp.Node(nbxmpp.NS_IBB + ' close',
-                        {'sid': file_props.transport_sid})]))
-                    file_props.completed = True
+                self._send_ibb_blocks(file_props)
+
+    def _send_ibb_blocks(self, file_props):
+        """
+        Send blocks of the file until IBB_WINDOW_SIZE of them wait for their
+        acknowledgement, and close the stream once all blocks are acknowledged
+        """
+        in_flight = list(self.ibb_in_flight.values()).count(file_props)
+        while in_flight < IBB_WINDOW_SIZE:
+            chunk = file_props.fp.read(file_props.block_size)
+            if not chunk:
+                if in_flight:
+                    # wait for the acknowledgement of the last blocks
+                    return
+                # notify the other side about stream closing
+                # notify the local user about sucessfull send
+                # delete the local stream
+                self.connection.send(nbxmpp.Protocol('iq',
+                    file_props.direction[1:], 'set',
+                    payload=[nbxmpp.Node(nbxmpp.NS_IBB + ' close',
+                    {'sid': file_props.transport_sid})]))
+                file_props.fp.close()
+                file_props.completed = True
+                return
+            datanode = nbxmpp.Node(nbxmpp.NS_IBB + ' data', {
+                'sid': file_props.transport_sid,
+                'seq': file_props.seq},
+                base64.b64encode(chunk).decode('ascii'))
+            file_props.seq += 1
+            file_props.started = True
+            if file_props.seq == 65536:
+                file_props.seq = 0
+            iq_id = self.connection.send(nbxmpp.Protocol(name='iq',
+                to=file_props.direction[1:], typ='set', payload=[datanode]))
+            self.ibb_in_flight[iq_id] = file_props
+            in_flight += 1
+            current_time = time.time()
+            file_props.elapsed_time += current_time - file_props.last_time
+            file_props.last_time = current_time
+            file_props.received_len += len(chunk)
+            self._ibb_progress(file_props, current_time)
+
+    def _ibb_progress(self, file_props, current_time):
+        """
+        Report the progress of a stream at most every IBB_PROGRESS_INTERVAL
+        seconds, and when its last byte is transfered
+        """
+        if current_time - file_props.last_progress_time < \
+        IBB_PROGRESS_INTERVAL and file_props.received_len < file_props.size:
+            return
+        file_props.last_progress_time = current_time
+        gajim.socks5queue.progress_transfer_cb(self.name, file_props)
+
+    def _on_ibb_data_error(self, file_props, error):
+        """
+        A block was refused. If it may be too big, send the file again from
+        the start with smaller blocks, otherwise stop sending it
+        """
+        log.debug('Error on send sid->%s: %s' % (file_props.sid, error))
+        for iq_id in [iq_id for iq_id, fp in self.ibb_in_flight.items() if \
+        fp is file_props]:
+            del self.ibb_in_flight[iq_id]
+        if error in IBB_BLOCK_SIZE_ERRORS and \
+        file_props.block_size > IBB_MIN_BLOCK_SIZE:
+            file_props.fp.seek(0)
+            self.OpenStream(file_props.sid, file_props.direction[1:],
+                file_props.fp, max(file_props.block_size // 2,
+                IBB_MIN_BLOCK_SIZE))
+            return
+        file_props.error = -1
+        self.CloseIBBStream(file_props)
+        gajim.socks5queue.complete_transfer_cb(self.name, file_props)
 
     def IBBMessageHandler(self, conn, stanza):
         """
@@ -924,10 +998,10 @@ class ConnectionIBBytestream(ConnectionBytestream):
         log.debug('ReceiveHandler called sid->%s seq->%s' % (sid, seq))
         try:
             seq = int(seq)
-            data = base64.b64decode(data.encode('utf-8')).decode('utf-8')
+            data = base64.b64decode(data.encode('ascii'))
         except Exception:
             seq = ''
-            data = ''
+            data = b''
         err = None
         file_props = FilesProp.getFilePropByTransportSid(self.name, sid)
         if file_props is None:
@@ -943,11 +1017,12 @@ class ConnectionIBBytestream(ConnectionBytestream):
                 file_props.seq += 1
                 file_props.started = True
                 file_props.fp.write(data)
+                file_props.hasher.update(data)
                 current_time = time.time()
                 file_props.elapsed_time += current_time - file_props.last_time
                 file_props.last_time = current_time
                 file_props.received_len += len(data)
-                gajim.socks5queue.progress_transfer_cb(self.name, file_props)
+                self._ibb_progress(file_props, current_time)
                 if file_props.received_len >= file_props.size:
                     file_props.completed = True
         if err:
@@ -996,7 +1071,17 @@ class ConnectionIBBytestream(ConnectionBytestream):
                 continue
             if file_props.syn_id == syn_id:
                 if stanza.getType() == 'error':
-                    if file_props.direction[0] == '<':
+                    if file_props.direction[:2] == '|>' and \
+                    stanza.getError() == 'resource-constraint' and \
+                    file_props.block_size > IBB_MIN_BLOCK_SIZE:
+                        # try again with smaller blocks
+                        log.debug('Block size %s refused' % \
+                            file_props.block_size)
+                        self.OpenStream(file_props.sid,
+                            file_props.direction[2:], file_props.fp,
+                            max(file_props.block_size // 2,
+                            IBB_MIN_BLOCK_SIZE))
+                    elif file_props.direction[0] == '<':
                         conn.Event('IBB', 'ERROR ON RECEIVE', file_props)
                     else:
                         conn.Event('IBB', 'ERROR ON SEND', file_props)
@@ -1018,8 +1103,12 @@ class ConnectionIBBytestream(ConnectionBytestream):
                     reply.delChild('data')
                     conn.send(reply)
                     raise nbxmpp.NodeProcessed
-            elif syn_id == self.last_sent_ibb_id:
-                self.SendHandler()
+            elif syn_id in self.ibb_in_flight:
+                file_props = self.ibb_in_flight.pop(syn_id)
+                if stanza.getType() == 'error':
+                    self._on_ibb_data_error(file_props, stanza.getError())
+                else:
+                    self.SendHandler()
 
 class ConnectionSocks5BytestreamZeroconf(ConnectionSocks5Bytestream):
 
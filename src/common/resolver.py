@@ -18,6 +18,7 @@
 ##
 
 import sys
+import time
 import logging
 import functools
 log = logging.getLogger('gajim.c.resolver')
@@ -30,17 +31,40 @@ if __name__ == '__main__':
 
 from gi.repository import Gio, GLib
 
+# Gio doesn't give us the TTL of records, so results are kept this number of
+# seconds. After that they are still used, but resolved again.
+RESOLVER_CACHE_TTL = 3600
+# seconds after which a failed resolution is tried again
+RESOLVER_NEGATIVE_TTL = 300
 
-def get_resolver(idlequeue):
-    return GioResolver()
+
+def get_resolver(idlequeue, store=None):
+    return GioResolver(store)
 
 
 class CommonResolver():
-    def __init__(self):
-        # dict {"host+type" : list of records}
+    def __init__(self, store=None):
+        # dict {"host+type" : (expiration time, list of records)}
         self.resolved_hosts = {}
         # dict {"host+type" : list of callbacks}
         self.handlers = {}
+        # object with get_resolver_cache() and set_resolver_cache() methods,
+        # used to keep results across restarts
+        self.store = store
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0,
+            'failures': 0}
+        if store:
+            for host, type_, result_list, expires in store.get_resolver_cache():
+                self.resolved_hosts[host + type_] = (expires, result_list)
+
+    def get_stats(self):
+        """
+        Return the number of cache hits (also counted in stale_hits when
+        the result had expired), misses and failed resolutions
+        """
+        stats = dict(self.stats)
+        stats['cached'] = len(self.resolved_hosts)
+        return stats
 
     def resolve(self, host, on_ready, type_='srv'):
         host = host.lower()
@@ -48,14 +72,22 @@ class CommonResolver():
         assert(type_ in ['srv', 'txt'])
         if not host:
             # empty host, return empty list of srv records
-            on_ready([])
+            on_ready(host, [])
             return
         if host + type_ in self.resolved_hosts:
             # host is already resolved, return cached values
-            log.debug('%s already resolved: %s' % (host,
-                self.resolved_hosts[host + type_]))
-            on_ready(host, self.resolved_hosts[host + type_])
+            expires, result_list = self.resolved_hosts[host + type_]
+            log.debug('%s already resolved: %s' % (host, result_list))
+            self.stats['hits'] += 1
+            if expires < time.time():
+                # resolve it again for next time
+                self.stats['stale_hits'] += 1
+                if host + type_ not in self.handlers:
+                    self.handlers[host + type_] = []
+                    self.start_resolve(host, type_)
+            on_ready(host, result_list)
             return
+        self.stats['misses'] += 1
         if host + type_ in self.handlers:
             # host is about to be resolved by another connection,
             # attach our callback
@@ -67,12 +99,25 @@ class CommonResolver():
             self.handlers[host + type_] = [on_ready]
             self.start_resolve(host, type_)
 
-    def _on_ready(self, host, type_, result_list):
+    def _on_ready(self, host, type_, result_list, failed=False):
+        """
+        failed is True if the resolution could not be done (as opposed to the
+        host having no such record)
+        """
         # practically it is impossible to be the opposite, but who knows :)
         host = host.lower()
         log.debug('Resolving result for %s: %s' % (host, result_list))
-        if host + type_ not in self.resolved_hosts:
-            self.resolved_hosts[host + type_] = result_list
+        if failed:
+            self.stats['failures'] += 1
+            if host + type_ in self.resolved_hosts:
+                # keep using the results we already have
+                result_list = self.resolved_hosts[host + type_][1]
+            expires = int(time.time()) + RESOLVER_NEGATIVE_TTL
+        else:
+            expires = int(time.time()) + RESOLVER_CACHE_TTL
+        self.resolved_hosts[host + type_] = (expires, result_list)
+        if self.store and not failed:
+            self.store.set_resolver_cache(host, type_, result_list, expires)
         if host + type_ in self.handlers:
             for callback in self.handlers[host + type_]:
                 callback(host, result_list)
@@ -88,42 +133,47 @@ class GioResolver(CommonResolver):
     called in order to proceed the pending requests.
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, store=None):
+        super().__init__(store)
         self.gio_resolver = Gio.Resolver.get_default()
 
     def start_resolve(self, host, type_):
+        callback = functools.partial(self._on_ready_records, host, type_)
         if type_ == 'txt':
-            # TXT record resolution isn't used anywhere at the moment so
-            # implementing it here isn't urgent
-            raise NotImplemented("Gio resolver does not currently implement TXT records")
+            record_type = Gio.ResolverRecordType.TXT
         else:
-            callback = functools.partial(self._on_ready_srv, host)
-            type_ = Gio.ResolverRecordType.SRV
+            record_type = Gio.ResolverRecordType.SRV
 
-        resq = self.gio_resolver.lookup_records_async(host, type_, None, callback)
+        self.gio_resolver.lookup_records_async(host, record_type, None,
+            callback)
 
-    def _on_ready_srv(self, host, source_object, result):
+    def _on_ready_records(self, host, type_, source_object, result):
+        failed = False
         try:
             variant_results = source_object.lookup_records_finish(result)
         except GLib.Error as e:
             if e.domain == 'g-resolver-error-quark':
                 result_list = []
                 log.warning("Could not resolve host: %s", e.message)
+                failed = e.code != Gio.ResolverError.NOT_FOUND
             else:
                 raise
         else:
-            result_list = [
-                {
-                    'weight': weight,
-                    'prio': prio,
-                    'port': port,
-                    'host': host,
-                }
-                for prio, weight, port, host
-                in variant_results
-            ]
-        super()._on_ready(host, 'srv', result_list)
+            if type_ == 'txt':
+                result_list = [''.join(strings) for (strings,) in \
+                    variant_results]
+            else:
+                result_list = [
+                    {
+                        'weight': weight,
+                        'prio': prio,
+                        'port': port,
+                        'host': host,
+                    }
+                    for prio, weight, port, host
+                    in variant_results
+                ]
+        super()._on_ready(host, type_, result_list, failed=failed)
 
 
 # below lines is on how to use API and assist in testing
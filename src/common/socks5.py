@@ -34,7 +34,7 @@ from errno import EISCONN
 from errno import EINPROGRESS
 from errno import EAFNOSUPPORT
 from nbxmpp.idlequeue import IdleObject
-from common.file_props import FilesProp
+from common.file_props import FilesProp, FileHasher
 from common import gajim
 from common import jingle_xtls
 if jingle_xtls.PYOPENSSL_PRESENT:
@@ -605,6 +605,11 @@ class Socks5(object):
                 offset = self.file_props.offset
                 opt = 'ab'
             fd = open(self.file_props.file_name, opt)
+            if offset:
+                # the start of the file was received before
+                self.file_props.hasher = None
+            else:
+                self.file_props.hasher = FileHasher(self.file_props.algo)
             self.file_props.fd = fd
             self.file_props.elapsed_time = 0
             self.file_props.last_time = time.time()
@@ -720,6 +725,8 @@ class Socks5(object):
                 self.file_props.error = -6 # file system error
                 return 0
             fd.write(self.remaining_buff)
+            if self.file_props.hasher:
+                self.file_props.hasher.update(self.remaining_buff)
             lenn = len(self.remaining_buff)
             current_time = time.time()
             self.file_props.elapsed_time += current_time - \
@@ -762,6 +769,8 @@ class Socks5(object):
                 return 0
             try:
                 fd.write(buff)
+                if self.file_props.hasher:
+                    self.file_props.hasher.update(buff)
             except IOError:
                 self.rem_fd(fd)
                 self.disconnect()
@@ -39,7 +39,6 @@ import time
 import os
 import tooltips
 import dialogs
-import queue
 import urllib
 
 import gtkgui_helpers
@@ -48,6 +47,7 @@ from common import helpers
 from common import i18n
 from calendar import timegm
 from common.fuzzyclock import FuzzyClock
+from common.message_timeline import MessageTimeline
 
 from htmltextview import HtmlTextView
 from common.exceptions import GajimGeneralException
@@ -187,7 +187,8 @@ class ConversationTextview(GObject.GObject):
         GObject.GObject.__init__(self)
         self.used_in_history_window = used_in_history_window
         self.line = 0
-        self.message_list = []
+        # printed lines, sorted by timestamp
+        self.message_list = MessageTimeline()
         self.corrected_text_list = {}
         self.fc = FuzzyClock()
 
@@ -322,11 +323,6 @@ class ConversationTextview(GObject.GObject):
         tag = buffer_.create_tag('xep0184-received')
         tag.set_property('foreground', '#73d216')
 
-        # One mark at the begining then 2 marks between each lines
-        size = gajim.config.get('max_conversation_lines')
-        size = 2 * size - 1
-        self.marks_queue = queue.Queue(size)
-
         self.allow_focus_out_line = True
         # holds a mark at the end of --- line
         self.focus_out_end_mark = None
@@ -500,7 +496,7 @@ class ConversationTextview(GObject.GObject):
             return None
 
         end_mark, index = self.get_end_mark(correct_id, start_mark)
-        if not index:
+        if index is None:
             log.debug('Could not find line to correct')
             return None
 
@@ -733,9 +729,9 @@ class ConversationTextview(GObject.GObject):
         buffer_ = self.tv.get_buffer()
         start, end = buffer_.get_bounds()
         buffer_.delete(start, end)
-        size = gajim.config.get('max_conversation_lines')
-        size = 2 * size - 1
-        self.marks_queue = queue.Queue(size)
+        for line in self.message_list:
+            buffer_.delete_mark(line[1])
+        self.message_list.clear()
         self.focus_out_end_mark = None
         self.just_cleared = True
 
@@ -1234,42 +1230,55 @@ class ConversationTextview(GObject.GObject):
         self.just_cleared = False
 
     def get_end_mark(self, msg_stanza_id, start_mark):
-        for index, msg in enumerate(self.message_list):
-            if msg[2] == msg_stanza_id and msg[1] == start_mark:
-                try:
-                    end_mark = self.message_list[index + 1][1]
-                    end_mark_name = end_mark.get_name()
-                except IndexError:
-                    # We are at the last message
-                    end_mark = None
-                    end_mark_name = None
-
-                log.debug('start mark: %s, end mark: %s, '
-                          'replace message-list index: %s',
-                          start_mark.get_name(), end_mark_name, index)
-
-                return end_mark, index
-        log.debug('stanza-id not in message list')
-        return None, None
-
-    def get_insert_mark(self, timestamp):
-        # message_list = [(timestamp, line_start_mark, msg_stanza_id)]
-        # We check if this is a new Message
-        try:
-            if self.message_list[-1][0] <= timestamp:
-                return None, None
-        except IndexError:
-            # We have no Messages in the TextView
+        index = self.message_list.find(msg_stanza_id, start_mark)
+        if index is None:
+            log.debug('stanza-id not in message list')
             return None, None
 
-        # Not a new Message
-        # Search for insertion point
-        for index, msg in enumerate(self.message_list):
-            if msg[0] > timestamp:
-                return msg[1], index
+        # None if we are at the last message
+        end_mark = self.message_list.get_next_mark(index)
+        end_mark_name = end_mark.get_name() if end_mark else None
 
-        # Should not happen, but who knows
-        return None, None
+        log.debug('start mark: %s, end mark: %s, '
+                  'replace message-list index: %s',
+                  start_mark.get_name(), end_mark_name, index)
+
+        return end_mark, index
+
+    def get_insert_mark(self, timestamp):
+        # Returns (None, None) for a new Message, else the start mark and
+        # index of the line it has to be inserted before
+        return self.message_list.get_insert_point(timestamp)
+
+    def remove_old_lines(self):
+        """
+        Remove the oldest lines when there are more than
+        max_conversation_lines
+        """
+        if self.used_in_history_window:
+            return
+        removed = self.message_list.prune(
+            gajim.config.get('max_conversation_lines'))
+        if not removed:
+            return
+        buffer_ = self.tv.get_buffer()
+        # the new first line starts right after the last removed one
+        start_iter = buffer_.get_start_iter()
+        end_iter = buffer_.get_iter_at_mark(self.message_list[0][1])
+        # marks in the removed text would all end up at the start of the
+        # buffer, forget them
+        for id_, mark in list(self.xep0184_marks.items()):
+            if buffer_.get_iter_at_mark(mark).compare(end_iter) <= 0:
+                buffer_.delete_mark(mark)
+                del self.xep0184_marks[id_]
+                del self.xep0184_shown[id_]
+        if self.focus_out_end_mark is not None and buffer_.get_iter_at_mark(
+        self.focus_out_end_mark).compare(end_iter) <= 0:
+            buffer_.delete_mark(self.focus_out_end_mark)
+            self.focus_out_end_mark = None
+        buffer_.delete(start_iter, end_iter)
+        for line in removed:
+            buffer_.delete_mark(line[1])
 
     def print_conversation_line(self, text, jid, kind, name, tim,
     other_tags_for_name=None, other_tags_for_time=None, other_tags_for_text=None,
@@ -1400,15 +1409,13 @@ class ConversationTextview(GObject.GObject):
         new_mark = buffer_.create_mark(
             str(self.line), temp_iter, left_gravity=False)
 
-        if not index:
-            # New Message
-            self.message_list.append((tim, new_mark, msg_stanza_id))
-        elif corrected:
+        if corrected:
             # Replace the corrected message
-            self.message_list[index] = (tim, new_mark, msg_stanza_id)
+            self.message_list.replace(index, new_mark, msg_stanza_id)
         else:
-            # We insert the message at index
-            self.message_list.insert(index, (tim, new_mark, msg_stanza_id))
+            # New Message if index is None, else we insert it at index
+            self.message_list.add(tim, new_mark, msg_stanza_id, index)
+            self.remove_old_lines()
 
         if kind == 'incoming':
             self.last_received_message_id[name] = (msg_stanza_id, new_mark)
@@ -3415,6 +3415,18 @@ class XMLConsoleWindow:
     def on_enable_checkbutton_toggled(self, widget):
         self.enabled = widget.get_active()
 
+    def on_event_stats_button_clicked(self, widget):
+        buffer_ = self.stanzas_log_textview.get_buffer()
+        end_iter = buffer_.get_end_iter()
+        if not gajim.ged.profiling:
+            gajim.ged.set_profiling(True)
+            text = _('Event profiling enabled, click again to see statistics')
+        else:
+            text = gajim.ged.format_profiling_stats()
+        buffer_.insert(end_iter, '<!-- %s\n%s\n-->\n\n' % (time.strftime('%c'),
+            text))
+        GLib.idle_add(gtkgui_helpers.scroll_to_end, self.parent)
+
     def on_in_stanza_checkbutton_toggled(self, widget):
         active = widget.get_active()
         self.tagIn.set_property('invisible', active)
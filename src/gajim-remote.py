@@ -250,6 +250,13 @@ class GajimRemote:
                         _('Returns number of unread messages'),
                                 [ ]
                         ],
+                'event_stats': [
+                        _('Prints time spent in event handlers'),
+                                [
+                                        ('action', _('"enable" or "disable" '
+                                        'profiling, or "reset" statistics'), False)
+                                ]
+                        ],
                 'start_chat': [
                         _('Opens \'Start Chat\' dialog'),
                                 [
@@ -262,6 +262,12 @@ class GajimApplication(Gtk.Application):
         # Shutdown GUI and save config
         if hasattr(self.interface, 'roster') and self.interface.roster:
             self.interface.roster.prepare_quit()
+        # Write pending history to disk
+        from common import gajim
+        for conn in gajim.connections.values():
+            conn.received_message_hashes.flush()
+        if gajim.logger:
+            gajim.logger.stop_writer()
 
     def do_handle_local_options(self, options: GLib.VariantDict) -> int:
         if options.contains('profile'):
@@ -65,12 +65,22 @@ from common.connection_handlers_events import GcMessageOutgoingEvent
 import logging
 log = logging.getLogger('gajim.groupchat_control')
 
+# milliseconds during which new occupants are drawn together, while joining and
+# once in the room
+MUC_JOIN_FLUSH_TIMEOUT = 3000
+MUC_PRESENCE_FLUSH_INTERVAL = 50
+
 class Column(IntEnum):
     IMG = 0 # image to show state (online, new message etc)
     NICK = 1 # contact nickame or ROLE name
     TYPE = 2 # type of the row ('contact' or 'role')
     TEXT = 3 # text shown in the cellrenderer
     AVATAR = 4 # avatar of the contact
+    SORT_KEY = 5 # tuple rows are sorted by
+
+# occupants are sorted by show in this order if sort_by_show_in_muc is set
+SHOW_SORT_RANK = {'chat': 0, 'online': 1, 'away': 2, 'xa': 3, 'dnd': 4,
+    'invisible': 5, 'offline': 6, 'error': 7}
 
 empty_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 1, 1)
 empty_pixbuf.fill(0xffffff00)
@@ -445,11 +455,19 @@ class GroupchatControl(ChatControlBase):
         hpaned_position = gajim.config.get('gc-hpaned-position')
         self.hpaned.set_position(hpaned_position)
 
-        #status_image, shown_nick, type, nickname, avatar
-        self.columns = [Gtk.Image, str, str, str, GdkPixbuf.Pixbuf]
+        #status_image, shown_nick, type, nickname, avatar, sort_key
+        self.columns = [Gtk.Image, str, str, str, GdkPixbuf.Pixbuf, object]
         self.model = Gtk.TreeStore(*self.columns)
-        self.model.set_sort_func(Column.NICK, self.tree_compare_iters)
-        self.model.set_sort_column_id(Column.NICK, Gtk.SortType.ASCENDING)
+        self.model.set_sort_func(Column.SORT_KEY, self.tree_compare_iters)
+        self.model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
+        # Rows of the model, {nick: Gtk.TreeRowReference} and
+        # {role: Gtk.TreeRowReference}
+        self._contact_refs = {}
+        self._role_refs = {}
+        # Nicks of occupants that are in gajim.contacts but not yet in the
+        # model, see _queue_contact()
+        self._pending_contacts = set()
+        self._pending_contacts_timeout_id = None
 
         # columns
         column = Gtk.TreeViewColumn()
@@ -589,40 +607,21 @@ class GroupchatControl(ChatControlBase):
         """
         Compare two iters to sort them
         """
-        type1 = model[iter1][Column.TYPE]
-        type2 = model[iter2][Column.TYPE]
-        if not type1 or not type2:
-            return 0
-        nick1 = model[iter1][Column.NICK]
-        nick2 = model[iter2][Column.NICK]
-        if not nick1 or not nick2:
+        key1 = model.get_value(iter1, Column.SORT_KEY)
+        key2 = model.get_value(iter2, Column.SORT_KEY)
+        if key1 is None or key2 is None:
             return 0
-        if type1 == 'role':
-            return locale.strcoll(nick1, nick2)
-        if type1 == 'contact':
-            gc_contact1 = gajim.contacts.get_gc_contact(self.account,
-                    self.room_jid, nick1)
-            if not gc_contact1:
-                return 0
-        if type2 == 'contact':
-            gc_contact2 = gajim.contacts.get_gc_contact(self.account,
-                    self.room_jid, nick2)
-            if not gc_contact2:
-                return 0
-        if type1 == 'contact' and type2 == 'contact' and \
-        gajim.config.get('sort_by_show_in_muc'):
-            cshow = {'chat':0, 'online': 1, 'away': 2, 'xa': 3, 'dnd': 4,
-                'invisible': 5, 'offline': 6, 'error': 7}
-            show1 = cshow[gc_contact1.show]
-            show2 = cshow[gc_contact2.show]
-            if show1 < show2:
-                return -1
-            elif show1 > show2:
-                return 1
-        # We compare names
-        name1 = gc_contact1.get_shown_name()
-        name2 = gc_contact2.get_shown_name()
-        return locale.strcoll(name1.lower(), name2.lower())
+        return (key1 > key2) - (key1 < key2)
+
+    def _get_sort_key(self, gc_contact):
+        """
+        Return the key occupants are sorted by: show if sort_by_show_in_muc is
+        set, then name
+        """
+        show = 0
+        if gajim.config.get('sort_by_show_in_muc'):
+            show = SHOW_SORT_RANK.get(gc_contact.show, 8)
+        return (show, locale.strxfrm(gc_contact.get_shown_name().lower()))
 
     def on_msg_textview_populate_popup(self, textview, menu):
         """
@@ -1118,16 +1117,17 @@ class GroupchatControl(ChatControlBase):
             gajim.interface.roster.draw_contact(self.room_jid, self.account)
 
     def get_contact_iter(self, nick):
-        role_iter = self.model.get_iter_first()
-        while role_iter:
-            user_iter = self.model.iter_children(role_iter)
-            while user_iter:
-                if nick == self.model[user_iter][Column.NICK]:
-                    return user_iter
-                else:
-                    user_iter = self.model.iter_next(user_iter)
-            role_iter = self.model.iter_next(role_iter)
-        return None
+        return self._get_iter_from_ref(self._contact_refs.get(nick))
+
+    def _get_iter_from_ref(self, ref):
+        if not ref or not ref.valid():
+            return None
+        return self.model.get_iter(ref.get_path())
+
+    def _clear_model(self):
+        self.model.clear()
+        self._contact_refs = {}
+        self._role_refs = {}
 
     def print_old_conversation(self, text, contact='', tim=None, xhtml = None,
     displaymarking=None, msg_stanza_id=None):
@@ -1426,7 +1426,8 @@ class GroupchatControl(ChatControlBase):
         change_subject_button = self.xml.get_object('change_subject_button')
         change_subject_button.set_sensitive(False)
         self.list_treeview.set_model(None)
-        self.model.clear()
+        self._clear_model()
+        self._cancel_pending_contacts()
         nick_list = gajim.contacts.get_nick_list(self.account, self.room_jid)
         for nick in nick_list:
             # Update pm chat window
@@ -1469,7 +1470,7 @@ class GroupchatControl(ChatControlBase):
         return True
 
     def draw_roster(self):
-        self.model.clear()
+        self._clear_model()
         for nick in gajim.contacts.get_nick_list(self.account, self.room_jid):
             gc_contact = gajim.contacts.get_gc_contact(self.account,
                 self.room_jid, nick)
@@ -1504,6 +1505,10 @@ class GroupchatControl(ChatControlBase):
             return
         gc_contact = gajim.contacts.get_gc_contact(self.account, self.room_jid,
                 nick)
+        # setting the key moves the row, only do it when it changed
+        sort_key = self._get_sort_key(gc_contact)
+        if self.model.get_value(iter_, Column.SORT_KEY) != sort_key:
+            self.model[iter_][Column.SORT_KEY] = sort_key
         state_images = gajim.interface.jabber_state_images['16']
         if len(gajim.events.get_events(self.account, self.room_jid + '/' + \
         nick)):
@@ -1558,13 +1563,10 @@ class GroupchatControl(ChatControlBase):
         if not iter_:
             return
         fake_jid = self.room_jid + '/' + nick
-        pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(fake_jid)
-        if pixbuf in ('ask', None):
+        scaled_pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(fake_jid,
+            kind='roster')
+        if scaled_pixbuf in ('ask', None):
             scaled_pixbuf = empty_pixbuf
-        else:
-            scaled_pixbuf = gtkgui_helpers.get_scaled_pixbuf(pixbuf, 'roster')
-            if not scaled_pixbuf:
-                scaled_pixbuf = empty_pixbuf
         self.model[iter_][Column.AVATAR] = scaled_pixbuf
 
     def draw_role(self, role):
@@ -1588,6 +1590,11 @@ class GroupchatControl(ChatControlBase):
         if obj.ptype == 'error':
             return
 
+        if obj.nick == self.nick or (obj.status_code and \
+        '110' in obj.status_code):
+            # Our own presence comes after the ones of other occupants
+            self.flush_pending_contacts()
+
         role = obj.role
         if not role:
             role = 'visitor'
@@ -1791,16 +1798,24 @@ class GroupchatControl(ChatControlBase):
                     self.parent_win.redraw_tab(self)
         else:
             iter_ = self.get_contact_iter(obj.nick)
+            if not iter_ and obj.nick in self._pending_contacts:
+                # We need the row to update it
+                self.flush_pending_contacts()
+                iter_ = self.get_contact_iter(obj.nick)
             if not iter_:
                 if '210' in obj.status_code:
                     # Server changed our nick
                     self.nick = obj.nick
                     s = _('You are now known as %s') % nick
                     self.print_conversation(s, 'info', graphics=False)
-                iter_ = self.add_contact_to_roster(obj.nick, obj.show, role,
-                    affiliation, obj.status, obj.real_jid)
+                if obj.nick == self.nick:
+                    self.add_contact_to_roster(obj.nick, obj.show, role,
+                        affiliation, obj.status, obj.real_jid)
+                    self.draw_all_roles()
+                else:
+                    self._queue_contact(obj.nick, obj.show, role, affiliation,
+                        obj.status, obj.real_jid)
                 newly_created = True
-                self.draw_all_roles()
                 if obj.status_code and '201' in obj.status_code:
                     # We just created the room
                     gajim.connections[self.account].request_gc_config(
@@ -1822,6 +1837,8 @@ class GroupchatControl(ChatControlBase):
                     real_jid = obj.fjid
                 if obj.fjid in obj.conn.vcard_shas:
                     if obj.avatar_sha != obj.conn.vcard_shas[obj.fjid]:
+                        # don't show the old avatar while we get the new one
+                        gtkgui_helpers.forget_avatar(obj.fjid)
                         server = gajim.get_server_from_jid(self.room_jid)
                         if not server.startswith('irc'):
                             obj.conn.request_vcard(real_jid, obj.fjid)
@@ -1835,6 +1852,7 @@ class GroupchatControl(ChatControlBase):
                     if cached_sha != obj.avatar_sha:
                         # avatar has been updated
                         # sha in mem will be updated later
+                        gtkgui_helpers.forget_avatar(obj.fjid)
                         server = gajim.get_server_from_jid(self.room_jid)
                         if not server.startswith('irc'):
                             obj.conn.request_vcard(real_jid, obj.fjid)
@@ -1912,10 +1930,7 @@ class GroupchatControl(ChatControlBase):
                     st += ' (' + obj.status + ')'
                 self.print_conversation(st, graphics=False)
 
-    def add_contact_to_roster(self, nick, show, role, affiliation, status,
-    jid=''):
-        role_name = helpers.get_uf_role(role, plural=True)
-
+    def _split_jid(self, jid):
         resource = ''
         if jid:
             jids = jid.split('/', 1)
@@ -1924,17 +1939,13 @@ class GroupchatControl(ChatControlBase):
                 resource = jids[1]
         else:
             j = ''
+        return j, resource
 
-        name = nick
+    def add_contact_to_roster(self, nick, show, role, affiliation, status,
+    jid=''):
+        j, resource = self._split_jid(jid)
 
-        role_iter = self.get_role_iter(role)
-        if not role_iter:
-            role_iter = self.model.append(None,
-                [gajim.interface.jabber_state_images['16']['closed'], role,
-                'role', role_name,  None] + [None] * self.nb_ext_renderers)
-            self.draw_all_roles()
-        iter_ = self.model.append(role_iter, [None, nick, 'contact', name, None] + \
-                [None] * self.nb_ext_renderers)
+        self._pending_contacts.discard(nick)
         if not nick in gajim.contacts.get_nick_list(self.account,
         self.room_jid):
             gc_contact = gajim.contacts.create_gc_contact(
@@ -1942,6 +1953,35 @@ class GroupchatControl(ChatControlBase):
                 name=nick, show=show, status=status, role=role,
                 affiliation=affiliation, jid=j, resource=resource)
             gajim.contacts.add_gc_contact(self.account, gc_contact)
+        iter_ = self._add_contact_row(nick, role, j)
+        if nick == self.nick: # we became online
+            self.got_connected()
+        if self.list_treeview.get_model():
+            role_iter = self.model.iter_parent(iter_)
+            self.list_treeview.expand_row((self.model.get_path(role_iter)), False)
+        if self.is_continued:
+            self.draw_banner_text()
+        return iter_
+
+    def _add_contact_row(self, nick, role, jid, draw_roles=True):
+        role_iter = self.get_role_iter(role)
+        if not role_iter:
+            role_name = helpers.get_uf_role(role, plural=True)
+            role_iter = self.model.append(None,
+                [gajim.interface.jabber_state_images['16']['closed'], role,
+                'role', role_name,  None, (0, locale.strxfrm(role))] + \
+                [None] * self.nb_ext_renderers)
+            self._role_refs[role] = Gtk.TreeRowReference.new(self.model,
+                self.model.get_path(role_iter))
+            if draw_roles:
+                self.draw_all_roles()
+        gc_contact = gajim.contacts.get_gc_contact(self.account, self.room_jid,
+            nick)
+        iter_ = self.model.append(role_iter, [None, nick, 'contact', nick, None,
+            self._get_sort_key(gc_contact)] + [None] * self.nb_ext_renderers)
+        if not self.get_contact_iter(nick):
+            self._contact_refs[nick] = Gtk.TreeRowReference.new(self.model,
+                self.model.get_path(iter_))
         self.draw_contact(nick)
         self.draw_avatar(nick)
         # Do not ask avatar to irc rooms as irc transports reply with messages
@@ -1951,32 +1991,106 @@ class GroupchatControl(ChatControlBase):
             fake_jid = self.room_jid + '/' + nick
             pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(fake_jid)
             if pixbuf == 'ask':
-                if j and not self.is_anonymous:
-                    gajim.connections[self.account].request_vcard(j, fake_jid)
+                if jid and not self.is_anonymous:
+                    gajim.connections[self.account].request_vcard(jid, fake_jid)
                 else:
                     gajim.connections[self.account].request_vcard(fake_jid,
                         fake_jid)
-        if nick == self.nick: # we became online
-            self.got_connected()
-        if self.list_treeview.get_model():
-            self.list_treeview.expand_row((self.model.get_path(role_iter)), False)
+        return iter_
+
+    def _queue_contact(self, nick, show, role, affiliation, status, jid=''):
+        """
+        Add an occupant to gajim.contacts now and to the model later, together
+        with the other occupants that joined meanwhile
+
+        Rows are added when our own presence is received while joining, else
+        after MUC_PRESENCE_FLUSH_INTERVAL.
+        """
+        j, resource = self._split_jid(jid)
+        gc_contact = gajim.contacts.get_gc_contact(self.account, self.room_jid,
+            nick)
+        if gc_contact:
+            gajim.contacts.remove_gc_contact(self.account, gc_contact)
+        gc_contact = gajim.contacts.create_gc_contact(room_jid=self.room_jid,
+            account=self.account, name=nick, show=show, status=status,
+            role=role, affiliation=affiliation, jid=j, resource=resource)
+        gajim.contacts.add_gc_contact(self.account, gc_contact)
+        self._pending_contacts.add(nick)
+        if not self._pending_contacts_timeout_id:
+            if gajim.gc_connected[self.account].get(self.room_jid):
+                timeout = MUC_PRESENCE_FLUSH_INTERVAL
+            else:
+                timeout = MUC_JOIN_FLUSH_TIMEOUT
+            self._pending_contacts_timeout_id = GLib.timeout_add(timeout,
+                self._flush_pending_contacts)
+
+    def flush_pending_contacts(self):
+        """
+        Add to the model the occupants queued by _queue_contact()
+        """
+        if self._pending_contacts_timeout_id:
+            GLib.source_remove(self._pending_contacts_timeout_id)
+        self._flush_pending_contacts()
+
+    def _flush_pending_contacts(self):
+        self._pending_contacts_timeout_id = None
+        if not self._pending_contacts:
+            return False
+        nicks = self._pending_contacts
+        self._pending_contacts = set()
+        # While joining, rows are added to a detached model. Once joined, the
+        # model stays attached so that collapsed roles, selection and scroll
+        # are kept
+        joining = not gajim.gc_connected[self.account].get(self.room_jid)
+        model_detached = joining and self.list_treeview.get_model() is not None
+        if model_detached:
+            self.list_treeview.set_model(None)
+        # Sort once all rows are added
+        self.model.set_sort_column_id(Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID,
+            Gtk.SortType.ASCENDING)
+        new_roles = set()
+        for nick in nicks:
+            gc_contact = gajim.contacts.get_gc_contact(self.account,
+                self.room_jid, nick)
+            if not gc_contact:
+                continue
+            if not self.get_role_iter(gc_contact.role):
+                new_roles.add(gc_contact.role)
+            self._add_contact_row(nick, gc_contact.role, gc_contact.jid,
+                draw_roles=False)
+        self.model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
+        if model_detached:
+            self.list_treeview.set_model(self.model)
+            self.list_treeview.expand_all()
+        elif self.list_treeview.get_model():
+            for role in new_roles:
+                self.list_treeview.expand_row(self.model.get_path(
+                    self.get_role_iter(role)), False)
+        self.draw_all_roles()
         if self.is_continued:
             self.draw_banner_text()
-        return iter_
+        return False
+
+    def _cancel_pending_contacts(self):
+        if self._pending_contacts_timeout_id:
+            GLib.source_remove(self._pending_contacts_timeout_id)
+            self._pending_contacts_timeout_id = None
+        self._pending_contacts = set()
 
     def get_role_iter(self, role):
-        role_iter = self.model.get_iter_first()
-        while role_iter:
-            role_name = self.model[role_iter][Column.NICK]
-            if role == role_name:
-                return role_iter
-            role_iter = self.model.iter_next(role_iter)
-        return None
+        return self._get_iter_from_ref(self._role_refs.get(role))
 
     def remove_contact(self, nick):
         """
         Remove a user from the contacts_list
         """
+        if nick in self._pending_contacts:
+            self._pending_contacts.discard(nick)
+            gc_contact = gajim.contacts.get_gc_contact(self.account,
+                self.room_jid, nick)
+            if gc_contact:
+                gajim.contacts.remove_gc_contact(self.account, gc_contact)
+            return
         iter_ = self.get_contact_iter(nick)
         if not iter_:
             return
@@ -1985,8 +2099,10 @@ class GroupchatControl(ChatControlBase):
         if gc_contact:
             gajim.contacts.remove_gc_contact(self.account, gc_contact)
         parent_iter = self.model.iter_parent(iter_)
+        del self._contact_refs[nick]
         self.model.remove(iter_)
         if self.model.iter_n_children(parent_iter) == 0:
+            del self._role_refs[self.model[parent_iter][Column.NICK]]
             self.model.remove(parent_iter)
 
     def send_message(self, message, xhtml=None, process_commands=True):
@@ -2075,6 +2191,7 @@ class GroupchatControl(ChatControlBase):
 
         # Preventing autorejoin from being activated
         self.autorejoin = False
+        self._cancel_pending_contacts()
 
         gajim.ged.remove_event_handler('gc-presence-received', ged.GUI1,
             self._nec_gc_presence_received)
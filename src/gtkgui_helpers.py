@@ -36,6 +36,7 @@ from gi.repository import GLib
 from gi.repository import Pango
 import os
 import sys
+import base64
 try:
     from PIL import Image
 except:
@@ -70,8 +71,9 @@ def get_icon_path(icon_name, size=16):
     except GLib.GError as e:
         log.error("Unable to find icon %s: %s" % (icon_name, str(e)))
 
-import vcard
 import dialogs
+from avatar_store import AvatarStore
+from icon_cache import IconCache
 
 
 HAS_PYWIN32 = True
@@ -627,11 +629,28 @@ def get_scaled_pixbuf(pixbuf, kind):
 
     return get_scaled_pixbuf_by_size(pixbuf, width, height)
 
-def get_avatar_pixbuf_from_cache(fjid, use_local=True):
+def _scale_avatar(pixbuf, size):
+    return get_scaled_pixbuf_by_size(pixbuf, *size)
+
+# Decoded avatars, by jid for contacts and by fake jid for groupchat occupants
+avatar_store = AvatarStore(get_pixbuf_from_data, _scale_avatar)
+
+def forget_avatar(jid):
+    """
+    Drop the avatar of jid (or of a groupchat fake jid) from memory, it is
+    loaded again from disk next time it is asked for
+    """
+    avatar_store.forget(jid)
+
+def get_avatar_pixbuf_from_cache(fjid, use_local=True, kind=None, size=None):
     """
     Check if jid has cached avatar and if that avatar is valid image (can be
     shown)
 
+    If kind is given ("chat", "roster", "notification", "tooltip", "vcard")
+    the avatar is scaled to that size, None is returned if avatars of that kind
+    are disabled. Else it is scaled to size (width, height) if given.
+
     Returns None if there is no image in vcard/
     Returns 'ask' if cached vcard should not be used (user changed his vcard, so
     we have new sha) or if we don't have the vcard
@@ -642,11 +661,27 @@ def get_avatar_pixbuf_from_cache(fjid, use_local=True):
         # don't show avatar for the transport itself
         return None
 
+    if kind:
+        size = (gajim.config.get(kind + '_avatar_width'),
+            gajim.config.get(kind + '_avatar_height'))
+        if size[0] < 1 or size[1] < 1:
+            return None
+
     if any(jid in gajim.contacts.get_gc_list(acc) for acc in \
     gajim.contacts.get_accounts()):
         is_groupchat_contact = True
+        store_jid = jid + '/' + nick
     else:
         is_groupchat_contact = False
+        store_jid = jid
+
+    if use_local:
+        # Local avatars override the vCard one, so only avatars found with
+        # use_local are kept in memory
+        try:
+            return avatar_store.get_pixbuf(store_jid, size)
+        except KeyError:
+            pass
 
     puny_jid = helpers.sanitize_filename(jid)
     if is_groupchat_contact:
@@ -665,7 +700,8 @@ def get_avatar_pixbuf_from_cache(fjid, use_local=True):
                 avatar_file = open(local_avatar_path, 'rb')
                 avatar_data = avatar_file.read()
                 avatar_file.close()
-                return get_pixbuf_from_data(avatar_data)
+                avatar_store.set_avatar(store_jid, avatar_data)
+                return avatar_store.get_pixbuf(store_jid, size)
 
     if not os.path.isfile(path):
         return 'ask'
@@ -675,9 +711,25 @@ def get_avatar_pixbuf_from_cache(fjid, use_local=True):
     if not vcard_dict: # This can happen if cached vcard is too old
         return 'ask'
     if 'PHOTO' not in vcard_dict:
+        if use_local:
+            avatar_store.set_no_avatar(store_jid)
         return None
-    pixbuf = vcard.get_avatar_pixbuf_encoded_mime(vcard_dict['PHOTO'])[0]
-    return pixbuf
+    photo = vcard_dict['PHOTO']
+    avatar_data = None
+    if isinstance(photo, dict) and 'BINVAL' in photo:
+        try:
+            avatar_data = base64.b64decode(photo['BINVAL'].encode('utf-8'))
+        except Exception:
+            pass
+    if not avatar_data:
+        return None
+    if not use_local:
+        pixbuf = get_pixbuf_from_data(avatar_data)
+        if pixbuf and size:
+            pixbuf = _scale_avatar(pixbuf, size)
+        return pixbuf
+    avatar_store.set_avatar(store_jid, avatar_data)
+    return avatar_store.get_pixbuf(store_jid, size)
 
 def make_gtk_month_python_month(month):
     """
@@ -874,49 +926,89 @@ def load_iconset(path, pixbuf2=None, transport=False):
                     'offline', 'error', 'requested', 'event', 'not in roster')
     return _load_icon_list(list_, path, pixbuf2)
 
-def load_icon(icon_name):
+# Icons of the status, mood and activity iconsets
+icon_cache = IconCache()
+
+def _load_icon_file(path, icon_name):
     """
-    Load an icon from the iconset in 16x16
+    Return the pixbuf (or animation) of icon_name in path, None if there is no
+    such icon
     """
+    icon_file = icon_name.replace(' ', '_')
+    for extension in ('.gif', '.png'):
+        file_ = path + icon_file + extension
+        if os.path.exists(file_):
+            image = Gtk.Image.new_from_file(file_)
+            if image.get_storage_type() == Gtk.ImageType.ANIMATION:
+                return image.get_animation()
+            return image.get_pixbuf()
+    return None
+
+def _image_from_icon(icon):
+    image = Gtk.Image()
+    image.show()
+    if isinstance(icon, GdkPixbuf.PixbufAnimation):
+        image.set_from_animation(icon)
+    elif icon:
+        image.set_from_pixbuf(icon)
+    return image
+
+def _pixbuf_from_icon(icon):
+    if isinstance(icon, GdkPixbuf.PixbufAnimation):
+        return icon.get_static_image()
+    return icon
+
+def _get_icon(icon_name):
     iconset = gajim.config.get('iconset')
     path = os.path.join(helpers.get_iconset_path(iconset), '16x16', '')
-    icon_list = _load_icon_list([icon_name], path)
-    return icon_list[icon_name]
+    return icon_cache.get(iconset, 'status', icon_name, 16,
+        lambda: _load_icon_file(path, icon_name))
+
+def _get_mood_icon(icon_name):
+    iconset = gajim.config.get('mood_iconset')
+    path = os.path.join(helpers.get_mood_iconset_path(iconset), '')
+    return icon_cache.get(iconset, 'mood', icon_name, 16,
+        lambda: _load_icon_file(path, icon_name))
+
+def _get_activity_icon(category, activity=None):
+    iconset = gajim.config.get('activity_iconset')
+    if activity is None:
+        activity = 'category'
+    path = os.path.join(helpers.get_activity_iconset_path(iconset),
+            category, '')
+    return icon_cache.get(iconset, 'activity', (category, activity), 16,
+        lambda: _load_icon_file(path, activity))
+
+def load_icon(icon_name):
+    """
+    Load an icon from the iconset in 16x16
+    """
+    return _image_from_icon(_get_icon(icon_name))
 
 def load_mood_icon(icon_name):
     """
     Load an icon from the mood iconset in 16x16
     """
-    iconset = gajim.config.get('mood_iconset')
-    path = os.path.join(helpers.get_mood_iconset_path(iconset), '')
-    icon_list = _load_icon_list([icon_name], path)
-    return icon_list[icon_name]
+    return _image_from_icon(_get_mood_icon(icon_name))
 
 def load_activity_icon(category, activity = None):
     """
     Load an icon from the activity iconset in 16x16
     """
-    iconset = gajim.config.get('activity_iconset')
-    path = os.path.join(helpers.get_activity_iconset_path(iconset),
-            category, '')
-    if activity is None:
-        activity = 'category'
-    icon_list = _load_icon_list([activity], path)
-    return icon_list[activity]
+    return _image_from_icon(_get_activity_icon(category, activity))
 
 def get_pep_as_pixbuf(pep_class):
     if isinstance(pep_class, pep.UserMoodPEP):
         assert not pep_class._retracted
         received_mood = pep_class._pep_specific_data['mood']
         mood = received_mood if received_mood in pep.MOODS else 'unknown'
-        pixbuf = load_mood_icon(mood).get_pixbuf()
-        return pixbuf
+        return _pixbuf_from_icon(_get_mood_icon(mood))
     elif isinstance(pep_class, pep.UserTunePEP):
         icon = get_icon_pixmap('audio-x-generic', quiet=True)
         if not icon:
-            path = os.path.join(gajim.DATA_DIR, 'emoticons', 'static',
-                'music.png')
-            return GdkPixbuf.Pixbuf.new_from_file(path)
+            path = os.path.join(gajim.DATA_DIR, 'emoticons', 'static', '')
+            return icon_cache.get(None, 'emoticons', 'music', 16,
+                lambda: _load_icon_file(path, 'music'))
         return icon
     elif isinstance(pep_class, pep.UserActivityPEP):
         assert not pep_class._retracted
@@ -930,11 +1022,12 @@ def get_pep_as_pixbuf(pep_class):
         if has_known_activity:
             if has_known_subactivity:
                 subactivity = pep_['subactivity']
-                return load_activity_icon(activity, subactivity).get_pixbuf()
+                icon = _get_activity_icon(activity, subactivity)
             else:
-                return load_activity_icon(activity).get_pixbuf()
+                icon = _get_activity_icon(activity)
         else:
-            return load_activity_icon('unknown').get_pixbuf()
+            icon = _get_activity_icon('unknown')
+        return _pixbuf_from_icon(icon)
     elif isinstance(pep_class, pep.UserLocationPEP):
         icon = get_icon_pixmap('applications-internet', quiet=True)
         if not icon:
@@ -1000,6 +1093,8 @@ def make_jabber_state_images():
     """
     Initialize jabber_state_images dictionary
     """
+    # the iconset is (re)loaded from disk
+    icon_cache.invalidate('status')
     iconset = gajim.config.get('iconset')
     if iconset:
         if helpers.get_iconset_path(iconset):
@@ -391,6 +391,16 @@ class Interface:
         if ctrl and ctrl.session and len(obj.contact_list) > 1:
             ctrl.remove_session(ctrl.session)
 
+    def handle_event_gpg_presence_verified(self, obj):
+        # The signature of a presence was verified after the presence was
+        # shown, show the new key state
+        account = obj.conn.name
+        self.roster.draw_contact(obj.jid, account)
+        ctrl = (self.msg_win_mgr.get_control(obj.jid + '/' + obj.resource,
+            account) or self.msg_win_mgr.get_control(obj.jid, account))
+        if ctrl:
+            ctrl.update_ui()
+
     def handle_event_msgerror(self, obj):
         #'MSGERROR' (account, (jid, error_code, error_msg, msg, time[session]))
         account = obj.conn.name
@@ -567,6 +577,13 @@ class Interface:
             if obj.conn.name in self.show_vcard_when_connect:
                 self.show_vcard_when_connect.remove(obj.conn.name)
 
+    @staticmethod
+    def handle_event_vcard_avatar(obj):
+        # The avatar may have changed, drop the one we have in memory before
+        # windows redraw it
+        gtkgui_helpers.forget_avatar(obj.jid)
+        gtkgui_helpers.forget_avatar(obj.fjid)
+
     def handle_event_last_status_time(self, obj):
         # ('LAST_STATUS_TIME', account, (jid, resource, seconds, status))
         account = obj.conn.name
@@ -993,13 +1010,15 @@ class Interface:
             jid = file_props.sender
             self.popup_ft_result(account, jid, file_props)
             ft_win.set_status(file_props, 'ok')
-        h = Hashes()
-        try:
-            file_ = open(file_props.file_name, 'rb')
-        except:
-            return
-        hash_ = h.calculateHash(file_props.algo, file_)
-        file_.close()
+        hash_ = file_props.get_received_hash()
+        if hash_ is None:
+            h = Hashes()
+            try:
+                file_ = open(file_props.file_name, 'rb')
+            except:
+                return
+            hash_ = h.calculateHash(file_props.algo, file_)
+            file_.close()
         # If the hash we received and the hash of the file are the same,
         # then the file is not corrupt
         jid = file_props.sender
@@ -1031,10 +1050,14 @@ class Interface:
             gajim.socks5queue.remove_receiver(file_props.sid, True, True)
             # we compare hashes
             if file_props.session_type == 'jingle':
-                # Compare hashes in a new thread
-                self.hashThread = Thread(target=self.__compare_hashes,
-                    args=(account, file_props))
-                self.hashThread.start()
+                if file_props.get_received_hash() is not None:
+                    # The hash was computed while receiving
+                    self.__compare_hashes(account, file_props)
+                else:
+                    # Read the file and compare hashes in a new thread
+                    self.hashThread = Thread(target=self.__compare_hashes,
+                        args=(account, file_props))
+                    self.hashThread.start()
         else: # we send a file
             jid = file_props.receiver
             gajim.socks5queue.remove_sender(file_props.sid, True, True)
@@ -1179,11 +1202,7 @@ class Interface:
                 time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
         if obj.conn.archiving_313_supported and gajim.config.get_per('accounts',
         account, 'sync_logs_with_server'):
-            mam_id = gajim.config.get_per('accounts', account, 'last_mam_id')
-            if mam_id:
-                obj.conn.request_archive(after=mam_id)
-            else:
-                obj.conn.request_archive(start='2013-02-24T03:51:42Z')
+            obj.conn.start_mam_catchup()
 
         invisible_show = gajim.SHOW_LIST.index('invisible')
         # We cannot join rooms if we are invisible
@@ -1590,6 +1609,7 @@ class Interface:
             'gc-presence-received': [self.handle_event_gc_presence],
             'gc-message-received': [self.handle_event_gc_message],
             'gmail-notify': [self.handle_event_gmail_notify],
+            'gpg-presence-verified': [self.handle_event_gpg_presence_verified],
             'gpg-password-required': [self.handle_event_gpg_password_required],
             'gpg-trust-key': [self.handle_event_gpg_trust_key],
             'http-auth-received': [self.handle_event_http_auth],
@@ -1630,7 +1650,8 @@ class Interface:
                 self.handle_event_subscribed_presence],
             'unsubscribed-presence-received': [
                 self.handle_event_unsubscribed_presence],
-            'vcard-received': [self.handle_event_vcard],
+            'vcard-received': [(self.handle_event_vcard_avatar, ged.PREGUI),
+                self.handle_event_vcard],
             'zeroconf-name-conflict': [self.handle_event_zc_name_conflict],
         }
 
@@ -2527,6 +2548,10 @@ class Interface:
                 'preferences'), err_str)
             sys.exit()
 
+    @staticmethod
+    def forget_avatar(jid):
+        gtkgui_helpers.forget_avatar(jid)
+
     @staticmethod
     def save_avatar_files(jid, photo, puny_nick = None, local = False):
         """
@@ -2534,6 +2559,8 @@ class Interface:
         notifications. An avatar can be given as a pixmap directly or as an
         decoded image
         """
+        if local:
+            gtkgui_helpers.forget_avatar(jid)
         puny_jid = helpers.sanitize_filename(jid)
         path_to_file = os.path.join(gajim.AVATAR_PATH, puny_jid)
         if puny_nick:
@@ -2593,6 +2620,8 @@ class Interface:
         """
         Remove avatar files of a jid
         """
+        if local:
+            gtkgui_helpers.forget_avatar(jid)
         puny_jid = helpers.sanitize_filename(jid)
         path_to_file = os.path.join(gajim.AVATAR_PATH, puny_jid)
         if puny_nick:
@@ -2901,7 +2930,7 @@ class Interface:
 
         gajim.idlequeue = idlequeue.get_idlequeue()
         # resolve and keep current record of resolved hosts
-        gajim.resolver = resolver.get_resolver(gajim.idlequeue)
+        gajim.resolver = resolver.get_resolver(gajim.idlequeue, gajim.logger)
         gajim.socks5queue = socks5.SocksQueue(gajim.idlequeue,
             self.handle_event_file_rcv_completed,
             self.handle_event_file_progress,
@@ -74,6 +74,8 @@ del config_path
 from common import gajim
 import gtkgui_helpers
 from common.logger import LOG_DB_PATH, JIDConstant, KindConstant
+from common.logger import build_fts_query, bump_jids_generation
+from common.logger import ReadConnectionPool
 from common import helpers
 import dialogs
 
@@ -122,6 +124,12 @@ class HistoryManager:
         self.con = sqlite.connect(LOG_DB_PATH, timeout=20.0,
                 isolation_level='IMMEDIATE')
         self.cur = self.con.cursor()
+        # Gajim may be running and logging at the same time: browse and
+        # search through a read-only connection so that, with the database
+        # in WAL mode, we never wait for its writes nor block them
+        self.read_pool = ReadConnectionPool(size=1)
+        self.read_con = self.read_pool.acquire()
+        self.read_cur = self.read_con.cursor()
 
         self._init_jids_listview()
         self._init_logs_listview()
@@ -229,6 +237,7 @@ class HistoryManager:
             return
 
         def on_yes(clicked):
+            self.read_con.close()
             self.cur.execute('VACUUM')
             self.con.commit()
             Gtk.main_quit()
@@ -250,10 +259,10 @@ class HistoryManager:
 
     def _fill_jids_listview(self):
         # get those jids that have at least one entry in logs
-        self.cur.execute('SELECT jid, jid_id FROM jids WHERE jid_id IN ('
+        self.read_cur.execute('SELECT jid, jid_id FROM jids WHERE jid_id IN ('
                 'SELECT distinct logs.jid_id FROM logs) ORDER BY jid')
         # list of tupples: [('aaa@bbb',), ('cc@dd',)]
-        rows = self.cur.fetchall()
+        rows = self.read_cur.fetchall()
         for row in rows:
             self.jids_already_in.append(row[0])  # jid
             self.jids_liststore.append([row[0], str(row[1])])  # jid, jid_id
@@ -294,8 +303,8 @@ class HistoryManager:
             jid_is_from_pm = self._jid_is_from_pm(jid)
             if not jid_is_from_pm:  # it's normal jid with resource
                 jid = jid.split('/', 1)[0]  # remove the resource
-        self.cur.execute('SELECT jid_id FROM jids WHERE jid = ?', (jid,))
-        jid_id = self.cur.fetchone()[0]
+        self.read_cur.execute('SELECT jid_id FROM jids WHERE jid = ?', (jid,))
+        jid_id = self.read_cur.fetchone()[0]
         return str(jid_id)
 
     def _get_jid_from_jid_id(self, jid_id):
@@ -304,8 +313,8 @@ class HistoryManager:
 
         This method accepts jid_id and returns the jid for later sql-ing on logs
         """
-        self.cur.execute('SELECT jid FROM jids WHERE jid_id = ?', (jid_id,))
-        jid = self.cur.fetchone()[0]
+        self.read_cur.execute('SELECT jid FROM jids WHERE jid_id = ?', (jid_id,))
+        jid = self.read_cur.fetchone()[0]
         return jid
 
     def _jid_is_from_pm(self, jid):
@@ -319,9 +328,9 @@ class HistoryManager:
         """
         possible_room_jid = jid.split('/', 1)[0]
 
-        self.cur.execute('SELECT jid_id FROM jids WHERE jid = ? AND type = ?',
+        self.read_cur.execute('SELECT jid_id FROM jids WHERE jid = ? AND type = ?',
                 (possible_room_jid, JIDConstant.ROOM_TYPE))
-        row = self.cur.fetchone()
+        row = self.read_cur.fetchone()
         if row is None:
             return False
         else:
@@ -331,8 +340,8 @@ class HistoryManager:
         """
         Return True/False if given id is room type or not eg. if it is room
         """
-        self.cur.execute('SELECT type FROM jids WHERE jid = ?', (jid,))
-        row = self.cur.fetchone()
+        self.read_cur.execute('SELECT type FROM jids WHERE jid = ?', (jid,))
+        row = self.read_cur.fetchone()
         if row is None:
             raise
         elif row[0] == JIDConstant.ROOM_TYPE:
@@ -348,14 +357,14 @@ class HistoryManager:
         # no need to lower jid in this context as jid is already lowered
         # as we use those jids from db
         jid_id = self._get_jid_id(jid)
-        self.cur.execute('''
+        self.read_cur.execute('''
                 SELECT log_line_id, jid_id, time, kind, message, subject, contact_name, show
                 FROM logs
                 WHERE jid_id = ?
                 ORDER BY time
                 ''', (jid_id,))
 
-        results = self.cur.fetchall()
+        results = self.read_cur.fetchall()
 
         if self._jid_is_room_type(jid):  # is it room?
             self.nickname_col_for_logs.set_visible(True)
@@ -408,15 +417,33 @@ class HistoryManager:
         Ask db and fill listview with results that match text
         """
         self.search_results_liststore.clear()
-        like_sql = '%' + text + '%'
-        self.cur.execute('''
-                SELECT log_line_id, jid_id, time, message, subject, contact_name
-                FROM logs
-                WHERE message LIKE ? OR subject LIKE ?
-                ORDER BY time
-                ''', (like_sql, like_sql))
+        results = None
+        fts_query = build_fts_query(text)
+        if fts_query:
+            try:
+                self.read_cur.execute('''
+                        SELECT log_line_id, jid_id, time, logs.message,
+                        logs.subject, contact_name
+                        FROM logs_fts
+                        JOIN logs ON logs.log_line_id = logs_fts.rowid
+                        WHERE logs_fts MATCH ?
+                        ORDER BY time
+                        ''', (fts_query,))
+                results = self.read_cur.fetchall()
+            except sqlite.OperationalError:
+                # no full-text index in this database
+                pass
+        if results is None:
+            like_sql = '%' + text + '%'
+            self.read_cur.execute('''
+                    SELECT log_line_id, jid_id, time, message, subject,
+                    contact_name
+                    FROM logs
+                    WHERE message LIKE ? OR subject LIKE ?
+                    ORDER BY time
+                    ''', (like_sql, like_sql))
+            results = self.read_cur.fetchall()
 
-        results = self.cur.fetchall()
         for row in results:
             # exposed in UI (TreeViewColumns) are only
             # JID, time, message, subject, nickname
@@ -503,7 +530,7 @@ class HistoryManager:
             if path is None:
                 continue
             jid_id = liststore[path][1]
-            self.cur.execute('''
+            self.read_cur.execute('''
                     SELECT time, kind, message, contact_name FROM logs
                     WHERE jid_id = ?
                     ORDER BY time
@@ -511,7 +538,7 @@ class HistoryManager:
 
         # FIXME: we may have two contacts selected to export. fix that
         # AT THIS TIME FIRST EXECUTE IS LOST! WTH!!!!!
-        results = self.cur.fetchall()
+        results = self.read_cur.fetchall()
         #print results[0]
         file_ = open(path_to_file, 'w')
         for row in results:
@@ -567,6 +594,8 @@ class HistoryManager:
                                 WHERE jid_id = ?
                                 ''', (jid_id,))
 
+            # running Gajim instances must forget these jid ids
+            bump_jids_generation(self.cur)
             self.con.commit()
 
             self.AT_LEAST_ONE_DELETION_DONE = True
@@ -192,10 +192,10 @@ class HistoryWindow:
 
             info_acc = self._get_account_for_jid(info_jid)
 
-            if gajim.logger.jid_is_room_jid(completed) or\
-            gajim.logger.jid_is_from_pm(completed):
+            is_pm = gajim.logger.jid_is_from_pm(completed)
+            if is_pm or gajim.logger.jid_is_room_jid(completed):
                 pix = muc_active_pix
-                if gajim.logger.jid_is_from_pm(completed):
+                if is_pm:
                     # It's PM. Make it easier to find
                     room, nick = gajim.get_room_and_nick_from_fjid(completed)
                     info_completion = '%s from %s' % (nick, room)
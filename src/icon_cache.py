@@ -0,0 +1,74 @@
+##      icon_cache.py
+##
+## This file is part of Gajim.
+##
+## Gajim is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published
+## by the Free Software Foundation; version 3 only.
+##
+## Gajim is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Gajim.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+"""
+Keep the icons of iconsets in memory
+
+Icons are loaded from disk the first time they are asked for. When another
+iconset is chosen for a category (status, mood, activity, ...), the icons of
+the previous one are dropped.
+"""
+
+
+class IconCache:
+    def __init__(self):
+        # {(iconset, category, name, size): icon}, icon is None when the
+        # iconset has no such icon
+        self.icons = {}
+        # {category: iconset} used when the icons were loaded
+        self.iconsets = {}
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, iconset, category, name, size, load):
+        """
+        Return the icon, load() is called to load it from disk if it is not
+        in memory yet
+        """
+        if self.iconsets.get(category, iconset) != iconset:
+            self.invalidate(category)
+        self.iconsets[category] = iconset
+        key = (iconset, category, name, size)
+        try:
+            icon = self.icons[key]
+        except KeyError:
+            self.stats['misses'] += 1
+            icon = self.icons[key] = load()
+            return icon
+        self.stats['hits'] += 1
+        return icon
+
+    def invalidate(self, category=None):
+        """
+        Drop the icons of category, or all icons
+        """
+        self.stats['invalidations'] += 1
+        if category is None:
+            self.icons.clear()
+            self.iconsets.clear()
+            return
+        for key in [key for key in self.icons if key[1] == category]:
+            del self.icons[key]
+        self.iconsets.pop(category, None)
+
+    def get_stats(self):
+        """
+        Return the number of cache hits, misses (icons loaded from disk) and
+        invalidations
+        """
+        stats = dict(self.stats)
+        stats['cached'] = len(self.icons)
+        return stats
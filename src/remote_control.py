@@ -882,6 +882,20 @@ class SignalObject(dbus.service.Object):
     def get_unread_msgs_number(self):
         return DBUS_STRING(str(gajim.events.get_nb_events()))
 
+    @dbus.service.method(INTERFACE, in_signature='s', out_signature='s')
+    def event_stats(self, action):
+        """
+        Return time spent in event handlers. action can be 'enable',
+        'disable' or 'reset'
+        """
+        if action == 'enable':
+            gajim.ged.set_profiling(True)
+        elif action == 'disable':
+            gajim.ged.set_profiling(False)
+        elif action == 'reset':
+            gajim.ged.reset_profiling()
+        return DBUS_STRING(gajim.ged.format_profiling_stats())
+
     @dbus.service.method(INTERFACE, in_signature='s', out_signature='b')
     def start_chat(self, account):
         if not account:
@@ -81,6 +81,11 @@ class Column(IntEnum):
     LOCATION_PIXBUF = 8
     AVATAR_PIXBUF = 9  # avatar_pixbuf
     PADLOCK_PIXBUF = 10  # use for account row only
+    SORT_KEY = 11  # tuple rows are sorted by, see _get_sort_key()
+
+# contacts are sorted by show in this order if sort_by_show_in_roster is set
+SHOW_SORT_RANK = {'chat': 0, 'online': 1, 'away': 2, 'xa': 3, 'dnd': 4,
+    'invisible': 5, 'offline': 6, 'not in roster': 7, 'error': 8}
 
 empty_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 1, 1)
 empty_pixbuf.fill(0xffffff00)
@@ -248,7 +253,8 @@ class RosterWindow:
             it = self.model.append(None, [
                 gajim.interface.jabber_state_images['16'][show],
                 _('Merged accounts'), 'account', '', 'all', None, None, None,
-                None, None, None] + [None] * self.nb_ext_renderers)
+                None, None, None, self._get_sort_key('account', '', 'all')] + \
+                [None] * self.nb_ext_renderers)
             self._iters['MERGED']['account'] = it
         else:
             show = gajim.SHOW_LIST[gajim.connections[account].connected]
@@ -264,7 +270,8 @@ class RosterWindow:
             it = self.model.append(None, [
                 gajim.interface.jabber_state_images['16'][show],
                 GLib.markup_escape_text(account), 'account', our_jid,
-                account, None, None, None, None, None, tls_pixbuf] +
+                account, None, None, None, None, None, tls_pixbuf,
+                self._get_sort_key('account', our_jid, account)] +
                 [None] * self.nb_ext_renderers)
             self._iters[account]['account'] = it
 
@@ -324,7 +331,9 @@ class RosterWindow:
         iter_group = self.model.append(iter_parent,
             [gajim.interface.jabber_state_images['16']['closed'],
             GLib.markup_escape_text(group), 'group', group, account, None,
-            None, None, None, None, None] + [None] * self.nb_ext_renderers)
+            None, None, None, None, None,
+            self._get_sort_key('group', group, account)] + \
+            [None] * self.nb_ext_renderers)
         self.draw_group(group, account)
         self._iters[account_group]['groups'][group] = iter_group
         return iter_group
@@ -361,7 +370,8 @@ class RosterWindow:
             for child_iter in parent_iters:
                 it = self.model.append(child_iter, [None,
                     contact.get_shown_name(), 'contact', contact.jid, account,
-                    None, None, None, None, None, None] + \
+                    None, None, None, None, None, None,
+                    self._get_sort_key('contact', contact.jid, account)] + \
                     [None] * self.nb_ext_renderers)
                 added_iters.append(it)
                 if contact.jid in self._iters[account]['contacts']:
@@ -390,7 +400,8 @@ class RosterWindow:
                 # for more
                 i_ = self.model.append(child_iterG, [None,
                     contact.get_shown_name(), typestr, contact.jid, account,
-                    None, None, None, None, None, None] + \
+                    None, None, None, None, None, None,
+                    self._get_sort_key(typestr, contact.jid, account)] + \
                     [None] * self.nb_ext_renderers)
                 added_iters.append(i_)
                 if contact.jid in self._iters[account]['contacts']:
@@ -650,7 +661,9 @@ class RosterWindow:
         child_iterA = self._get_account_iter(account, self.model)
         self._iters[account]['contacts'][jid] = [self.model.append(child_iterA,
             [None, gajim.nicks[account], 'self_contact', jid, account, None,
-            None, None, None, None, None] + [None] * self.nb_ext_renderers)]
+            None, None, None, None, None,
+            self._get_sort_key('self_contact', jid, account)] + \
+            [None] * self.nb_ext_renderers)]
 
         self.draw_completely(jid, account)
         self.draw_account(account)
@@ -1104,8 +1117,45 @@ class RosterWindow:
         if account in self.accounts_to_draw:
             return
         self.accounts_to_draw.append(account)
-        if len(self.accounts_to_draw) == 1:
-            GLib.timeout_add(200, self._really_draw_accounts)
+        self._queue_redraw()
+
+    def _queue_redraw(self):
+        """
+        Redraw queued contacts, groups and accounts once the main loop is idle,
+        so that each row is drawn once for all the changes received meanwhile
+        """
+        if self.redraw_id is None:
+            self.redraw_id = GLib.idle_add(self._really_draw_queued,
+                priority=GLib.PRIORITY_DEFAULT_IDLE)
+
+    def _really_draw_queued(self):
+        self.redraw_id = None
+        contacts = self.contacts_to_draw
+        self.contacts_to_draw = {}
+        for jid, account in contacts:
+            self.draw_contact(jid, account)
+        # contacts are counted once for all groups drawn now
+        self.group_counters = {}
+        self._really_draw_groups()
+        self.group_counters = {}
+        self._really_draw_accounts()
+        return False
+
+    def queue_draw_contact(self, jid, account):
+        """
+        Like draw_contact(), but several calls for the same contact before the
+        next redraw draw it only once
+        """
+        self.contacts_to_draw[(jid, account)] = None
+        self._queue_redraw()
+
+    def _get_group_counters(self, accounts):
+        key = tuple(accounts)
+        if key not in self.group_counters:
+            self.group_counters[key] = \
+                gajim.contacts.get_nb_online_total_contacts_by_group(
+                accounts=accounts)
+        return self.group_counters[key]
 
     def _really_draw_group(self, group, account):
         child_iter = self._get_group_iter(group, account, model=self.model)
@@ -1121,8 +1171,8 @@ class RosterWindow:
         if helpers.group_is_blocked(account, group):
             text = '<span strikethrough="true">%s</span>' % text
         if gajim.config.get('show_contacts_number'):
-            nbr_on, nbr_total = gajim.contacts.get_nb_online_total_contacts(
-                    accounts = accounts, groups = [group])
+            nbr_on, nbr_total = self._get_group_counters(accounts).get(group,
+                (0, 0))
             text += ' (%s/%s)' % (repr(nbr_on), repr(nbr_total))
 
         self.model[child_iter][Column.NAME] = text
@@ -1140,8 +1190,7 @@ class RosterWindow:
         if ag in self.groups_to_draw:
             return
         self.groups_to_draw[ag] = {'group': group, 'account': account}
-        if len(self.groups_to_draw) == 1:
-            GLib.timeout_add(200, self._really_draw_groups)
+        self._queue_redraw()
 
     def draw_parent_contact(self, jid, account):
         child_iters = self._get_contact_iter(jid, account, model=self.model)
@@ -1176,6 +1225,13 @@ class RosterWindow:
         if not child_iters:
             return False
 
+        # setting the key moves the row, only do it when it changed
+        sort_key = self._get_sort_key(self.model[child_iters[0]][Column.TYPE],
+            jid, account, contact_instances)
+        for child_iter in child_iters:
+            if self.model.get_value(child_iter, Column.SORT_KEY) != sort_key:
+                self.model[child_iter][Column.SORT_KEY] = sort_key
+
         name = GLib.markup_escape_text(contact.get_shown_name())
 
         # gets number of unread gc marked messages
@@ -1359,11 +1415,10 @@ class RosterWindow:
         if not iters or not gajim.config.get('show_avatars_in_roster'):
             return
         jid = self.model[iters[0]][Column.JID]
-        pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(jid)
-        if pixbuf in (None, 'ask'):
+        scaled_pixbuf = gtkgui_helpers.get_avatar_pixbuf_from_cache(jid,
+            kind='roster')
+        if scaled_pixbuf in (None, 'ask'):
             scaled_pixbuf = empty_pixbuf
-        else:
-            scaled_pixbuf = gtkgui_helpers.get_scaled_pixbuf(pixbuf, 'roster')
         for child_iter in iters:
             self.model[child_iter][Column.AVATAR_PIXBUF] = scaled_pixbuf
         return False
@@ -1391,7 +1446,7 @@ class RosterWindow:
         if family:
             # There might be a new big brother
             self._recalibrate_metacontact_family(family, account)
-        self.draw_contact(jid, account)
+        self.queue_draw_contact(jid, account)
         self.draw_account(account)
 
         for group in contact.get_shown_groups():
@@ -1441,6 +1496,7 @@ class RosterWindow:
 
             jids = gajim.contacts.get_jid_list(account)
             for jid in jids:
+                self.contacts_to_draw.pop((jid, account), None)
                 self.draw_completely(jid, account)
 
             # Draw all known groups
@@ -1448,7 +1504,7 @@ class RosterWindow:
                 self.draw_group(group, account)
             self.draw_account(account)
 
-        self.model.set_sort_column_id(1, Gtk.SortType.ASCENDING)
+        self.model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
         self.tree.set_model(self.modelfilter)
         self.tree.thaw_child_notify()
         self.starting_filtering = False
@@ -1461,8 +1517,8 @@ class RosterWindow:
         self.modelfilter = None
         self.model = Gtk.TreeStore(*self.columns)
 
-        self.model.set_sort_func(1, self._compareIters)
-        self.model.set_sort_column_id(1, Gtk.SortType.ASCENDING)
+        self.model.set_sort_func(Column.SORT_KEY, self._compareIters)
+        self.model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
         self.modelfilter = self.model.filter_new()
         self.modelfilter.set_visible_func(self._visible_func)
         self.modelfilter.connect('row-has-child-toggled',
@@ -1725,110 +1781,48 @@ class RosterWindow:
         """
         Compare two iters to sort them
         """
-        name1 = model[iter1][Column.NAME]
-        name2 = model[iter2][Column.NAME]
-        if not name1 or not name2:
+        key1 = model.get_value(iter1, Column.SORT_KEY)
+        key2 = model.get_value(iter2, Column.SORT_KEY)
+        if key1 is None or key2 is None:
             return 0
-        name1 = name1
-        name2 = name2
-        type1 = model[iter1][Column.TYPE]
-        type2 = model[iter2][Column.TYPE]
-        if type1 == 'self_contact':
-            return -1
-        if type2 == 'self_contact':
-            return 1
-        if type1 == 'group':
-            name1 = model[iter1][Column.JID]
-            if name1:
-                name1 = name1
-            name2 = model[iter2][Column.JID]
-            if name2:
-                name2 = name2
-            if name1 == _('Transports'):
-                return 1
-            if name2 == _('Transports'):
-                return -1
-            if name1 == _('Not in Roster'):
-                return 1
-            if name2 == _('Not in Roster'):
-                return -1
-            if name1 == _('Groupchats'):
-                return 1
-            if name2 == _('Groupchats'):
-                return -1
-        account1 = model[iter1][Column.ACCOUNT]
-        account2 = model[iter2][Column.ACCOUNT]
-        if not account1 or not account2:
-            return 0
-        account1 = account1
-        account2 = account2
-        if type1 == 'account':
-            return locale.strcoll(account1, account2)
-        jid1 = model[iter1][Column.JID]
-        jid2 = model[iter2][Column.JID]
-        if type1 == 'contact':
-            lcontact1 = gajim.contacts.get_contacts(account1, jid1)
-            contact1 = gajim.contacts.get_first_contact_from_jid(account1, jid1)
-            if not contact1:
-                return 0
-            name1 = contact1.get_shown_name()
-        if type2 == 'contact':
-            lcontact2 = gajim.contacts.get_contacts(account2, jid2)
-            contact2 = gajim.contacts.get_first_contact_from_jid(account2, jid2)
-            if not contact2:
-                return 0
-            name2 = contact2.get_shown_name()
-        # We first compare by show if sort_by_show_in_roster is True or if it's
-        # a child contact
-        if type1 == 'contact' and type2 == 'contact' and \
-        gajim.config.get('sort_by_show_in_roster'):
-            cshow = {'chat':0, 'online': 1, 'away': 2, 'xa': 3, 'dnd': 4,
-                'invisible': 5, 'offline': 6, 'not in roster': 7, 'error': 8}
-            s = self.get_show(lcontact1)
-            show1 = cshow.get(s, 9)
-            s = self.get_show(lcontact2)
-            show2 = cshow.get(s, 9)
-            removing1 = False
-            removing2 = False
-            if show1 == 6 and jid1 in gajim.to_be_removed[account1]:
-                removing1 = True
-            if show2 == 6 and jid2 in gajim.to_be_removed[account2]:
-                removing2 = True
-            if removing1 and not removing2:
-                return 1
-            if removing2 and not removing1:
-                return -1
-            sub1 = contact1.sub
-            sub2 = contact2.sub
-            # none and from goes after
-            if sub1 not in ['none', 'from'] and sub2 in ['none', 'from']:
-                return -1
-            if sub1 in ['none', 'from'] and sub2 not in ['none', 'from']:
-                return 1
-            if show1 < show2:
-                return -1
-            elif show1 > show2:
-                return 1
-        # We compare names
-        cmp_result = locale.strcoll(name1.lower(), name2.lower())
-        if cmp_result < 0:
-            return -1
-        if cmp_result > 0:
-            return 1
-        if type1 == 'contact' and type2 == 'contact':
-            # We compare account names
-            cmp_result = locale.strcoll(account1.lower(), account2.lower())
-            if cmp_result < 0:
-                return -1
-            if cmp_result > 0:
-                return 1
-            # We compare jids
-            cmp_result = locale.strcoll(jid1.lower(), jid2.lower())
-            if cmp_result < 0:
-                return -1
-            if cmp_result > 0:
-                return 1
-        return 0
+        return (key1 > key2) - (key1 < key2)
+
+    def _get_sort_key(self, type_, jid, account, contact_instances=None):
+        """
+        Return the key rows are sorted by, they are compared with this tuple
+        only
+
+        Self contact comes first, then special groups go after the others.
+        Contacts are ordered by show when sort_by_show_in_roster is set, then
+        by name, account and jid.
+        """
+        if type_ == 'self_contact':
+            return (0, 0, False, False, 0, '', '', '')
+        if type_ == 'account':
+            return (1, 0, False, False, 0, locale.strxfrm(account), '', '')
+        if type_ == 'group':
+            rank = {_('Groupchats'): 1, _('Not in Roster'): 2,
+                _('Transports'): 3}.get(jid, 0)
+            return (1, rank, False, False, 0, locale.strxfrm(jid.lower()), '',
+                '')
+        if contact_instances is None:
+            contact_instances = gajim.contacts.get_contacts(account, jid)
+        name = jid
+        removing = False
+        no_sub = False
+        show = 0
+        if contact_instances:
+            contact = contact_instances[0]
+            name = contact.get_shown_name()
+            if type_ == 'contact' and gajim.config.get(
+            'sort_by_show_in_roster'):
+                show = SHOW_SORT_RANK.get(self.get_show(contact_instances), 9)
+                removing = show == SHOW_SORT_RANK['offline'] and jid in \
+                    gajim.to_be_removed[account]
+                # none and from goes after
+                no_sub = contact.sub in ('none', 'from')
+        return (1, 0, removing, no_sub, show, locale.strxfrm(name.lower()),
+            locale.strxfrm(account.lower()), locale.strxfrm(jid.lower()))
 
 ################################################################################
 ### FIXME: Methods that don't belong to roster window...
@@ -2581,12 +2575,12 @@ class RosterWindow:
                         jid, account)
 
         if obj.need_redraw:
-            self.draw_contact(jid, account)
+            self.queue_draw_contact(jid, account)
 
         if gajim.jid_is_transport(jid) and jid in jid_list:
             # It must be an agent
             # Update existing iter and group counting
-            self.draw_contact(jid, account)
+            self.queue_draw_contact(jid, account)
             self.draw_group(_('Transports'), account)
             if obj.new_show > 1 and jid in gajim.transport_avatar[account]:
                 # transport just signed in.
@@ -2618,14 +2612,52 @@ class RosterWindow:
                 obj.room_jid)
             if contact:
                 contact.show = obj.show
-                self.draw_contact(obj.room_jid, account)
+                self.queue_draw_contact(obj.room_jid, account)
                 self.draw_group(_('Groupchats'), account)
 
+    def _get_changed_roster_jids(self, roster, account):
+        """
+        Return the jids of roster that are not in the roster window yet, or
+        whose name, groups or subscription changed
+        """
+        changed = []
+        for jid, item in roster.items():
+            contact = gajim.contacts.get_first_contact_from_jid(account, jid)
+            if not contact or not self._get_contact_iter(jid, account,
+            contact, self.model):
+                changed.append(jid)
+                continue
+            groups = item['groups']
+            if gajim.jid_is_transport(jid):
+                groups = [_('Transports')]
+            if contact.name != (item['name'] or '') or \
+            sorted(contact.groups) != sorted(groups) or \
+            contact.sub != item['subscription'] or contact.ask != item['ask']:
+                changed.append(jid)
+        return changed
+
     def _nec_roster_received(self, obj):
         if obj.received_from_server:
-            self.fill_contacts_and_groups_dicts(obj.roster, obj.conn.name)
-            self.add_account_contacts(obj.conn.name, improve_speed=False)
-            self.fire_up_unread_messages_events(obj.conn.name)
+            account = obj.conn.name
+            if account in gajim.contacts.get_accounts() and \
+            gajim.contacts.get_jid_list(account):
+                # The roster is already drawn (we reconnected), only redraw
+                # what changed
+                changed = self._get_changed_roster_jids(obj.roster, account)
+                self.fill_contacts_and_groups_dicts(dict((jid,
+                    obj.roster[jid]) for jid in changed), account)
+                for jid in gajim.contacts.get_jid_list(account):
+                    if jid in changed or not self._get_contact_iter(jid,
+                    account, model=self.model):
+                        self.add_contact(jid, account)
+                        self.queue_draw_contact(jid, account)
+                for group in gajim.groups[account]:
+                    self.draw_group(group, account)
+                self.draw_account(account)
+            else:
+                self.fill_contacts_and_groups_dicts(obj.roster, account)
+                self.add_account_contacts(account, improve_speed=False)
+            self.fire_up_unread_messages_events(account)
         else:
             # add self contact
             if gajim.config.get('show_self_contact') == 'always':
@@ -2690,7 +2722,7 @@ class RosterWindow:
             self.draw_account(obj.conn.name)
 
         if obj.pep_type == 'nickname':
-            self.draw_contact(obj.jid, obj.conn.name)
+            self.queue_draw_contact(obj.jid, obj.conn.name)
         else:
             self.draw_pep(obj.jid, obj.conn.name, obj.pep_type)
 
@@ -5795,10 +5827,10 @@ class RosterWindow:
         self.save_done = False
         # [icon, name, type, jid, account, editable, mood_pixbuf,
         # activity_pixbuf, tune_pixbuf, location_pixbuf, avatar_pixbuf,
-        # padlock_pixbuf]
+        # padlock_pixbuf, sort_key]
         self.columns = [Gtk.Image, str, str, str, str,
             GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf,
-            GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf]
+            GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf, object]
         self.xml = gtkgui_helpers.get_gtk_builder('roster_window.ui')
         self.window = self.xml.get_object('roster_window')
         app.add_window(self.window)
@@ -5864,6 +5896,12 @@ class RosterWindow:
         self.groups_to_draw = {}
         # accounts to draw next time we draw accounts.
         self.accounts_to_draw = []
+        # contacts to draw next time, {(jid, account): None} to keep the order
+        self.contacts_to_draw = {}
+        # source id of the pending redraw of the above
+        self.redraw_id = None
+        # {accounts tuple: {group: [nb online, nb total]}} while drawing groups
+        self.group_counters = {}
 
         # uf_show, img, show, sensitive
         liststore = Gtk.ListStore(str, Gtk.Image, str, bool)
@@ -379,14 +379,9 @@ class GCTooltip(Gtk.Window):
             self.affiliation.show()
 
         # Avatar
-        puny_name = helpers.sanitize_filename(contact.name)
-        puny_room = helpers.sanitize_filename(contact.room_jid)
-        file_ = helpers.get_avatar_path(os.path.join(gajim.AVATAR_PATH,
-            puny_room, puny_name))
-        if file_:
-            with open(file_, 'rb') as file_data:
-                pix = gtkgui_helpers.get_pixbuf_from_data(file_data.read())
-            pix = gtkgui_helpers.get_scaled_pixbuf(pix, 'tooltip')
+        pix = gtkgui_helpers.get_avatar_pixbuf_from_cache(
+            contact.room_jid + '/' + contact.name, kind='tooltip')
+        if pix not in ('ask', None):
             self.avatar.set_from_pixbuf(pix)
             self.avatar.show()
             self.fillelement.show()
@@ -684,13 +679,9 @@ class RosterTooltip(Gtk.Window, StatusTable):
         self._set_idle_time(contact)
 
         # Avatar
-        puny_jid = helpers.sanitize_filename(self.prim_contact.jid)
-        file_ = helpers.get_avatar_path(os.path.join(gajim.AVATAR_PATH,
-            puny_jid))
-        if file_:
-            with open(file_, 'rb') as file_data:
-                pix = gtkgui_helpers.get_pixbuf_from_data(file_data.read())
-            pix = gtkgui_helpers.get_scaled_pixbuf(pix, 'tooltip')
+        pix = gtkgui_helpers.get_avatar_pixbuf_from_cache(
+            self.prim_contact.jid, kind='tooltip')
+        if pix not in ('ask', None):
             self.avatar.set_from_pixbuf(pix)
             self.avatar.show()
 
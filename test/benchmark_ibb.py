@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''
+Send a file over an In-Band Bytestream to a simulated contact and measure the
+throughput. Stanzas go through a link of limited bandwidth and the contact
+acknowledges each of them after a round trip, so the time is simulated, only
+the CPU time is real. One block of 4096 bytes per round trip is what was done
+before.
+
+Usage: python3 benchmark_ibb.py [file size in KiB] [round trip in ms]
+'''
+import base64
+import heapq
+import io
+import os
+import sys
+import time
+
+import lib
+lib.setup_env()
+
+import nbxmpp
+from common import gajim
+from common.file_props import FilesProp
+from common.protocol import bytestream
+
+PEER_JID = 'peer@gajim.org/Gajim'
+# bytes per second the link carries
+BANDWIDTH = 1024 * 1024
+
+class Network:
+    '''
+    Deliver stanzas half a round trip after they left the link, the link
+    carries one stanza at a time
+    '''
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.now = 0
+        self.link_free = 0
+        self.order = 0
+        # (delivery time, order, callback, stanza)
+        self.queue = []
+
+    def send(self, callback, stanza, size=0):
+        self.link_free = max(self.now, self.link_free) + size / BANDWIDTH
+        self.order += 1
+        heapq.heappush(self.queue, (self.link_free + self.rtt / 2,
+            self.order, callback, stanza))
+
+    def run(self):
+        while self.queue:
+            self.now, order, callback, stanza = heapq.heappop(self.queue)
+            callback(stanza)
+
+class Peer:
+    '''
+    The receiving side, it acknowledges every iq
+    '''
+    def __init__(self, network, sender):
+        self.network = network
+        self.sender = sender
+        self.received = 0
+
+    def on_iq(self, stanza):
+        data = stanza.getTagData('data')
+        if data:
+            self.received += len(base64.b64decode(data))
+        reply = nbxmpp.Protocol('iq', typ='result',
+            attrs={'id': stanza.getID()})
+        self.network.send(self.sender.on_iq, reply)
+
+class Connection:
+    def __init__(self, network):
+        self.network = network
+        self.peer = None
+        self.conn = None
+        self.last_id = 0
+
+    def send(self, stanza):
+        if not stanza.getID():
+            self.last_id += 1
+            stanza.setID('ibb%d' % self.last_id)
+        self.network.send(self.peer.on_iq, stanza, len(str(stanza)))
+        return stanza.getID()
+
+    def on_iq(self, stanza):
+        self.conn.IBBAllIqHandler(self, stanza)
+
+class SocksQueue:
+    def __init__(self):
+        self.progress = 0
+
+    def progress_transfer_cb(self, account, file_props):
+        self.progress += 1
+
+    def complete_transfer_cb(self, account, file_props):
+        pass
+
+def send(data, rtt, block_size, window):
+    bytestream.IBB_WINDOW_SIZE = window
+    network = Network(rtt)
+    connection = Connection(network)
+    peer = Peer(network, connection)
+    connection.peer = peer
+    conn = bytestream.ConnectionIBBytestream()
+    conn.name = 'account'
+    conn.connection = connection
+    connection.conn = conn
+    gajim.socks5queue = SocksQueue()
+
+    file_props = FilesProp.getNewFileProp('account', 'ibb')
+    file_props.transport_sid = 'ibb'
+    file_props.type_ = 's'
+    file_props.size = len(data)
+    start = time.perf_counter()
+    conn.OpenStream('ibb', PEER_JID, io.BytesIO(data), block_size)
+    network.run()
+    duration = time.perf_counter() - start
+    conn.cleanup()
+    FilesProp.deleteFileProp(file_props)
+    assert peer.received == len(data) and file_props.completed
+    return network.now, duration, gajim.socks5queue.progress
+
+def main():
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 4 * 1024 * 1024
+    rtt = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.1
+    data = os.urandom(size)
+    max_window = bytestream.IBB_WINDOW_SIZE
+    # 16384 is a block size that can be set with the ibb_block_size option
+    for block_size, window in ((4096, 1), (4096, max_window), (16384, 1),
+    (16384, max_window)):
+        simulated, duration, progress = send(data, rtt, block_size, window)
+        print('block %5d, window %2d: %8.1f KiB/s, %7.2f s simulated, '
+            '%7.2f ms CPU, %4d progress reports' % (block_size, window,
+            size / 1024 / simulated, simulated, duration * 1000, progress))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+'''
+Replay the presences received when joining a large group chat and measure
+the time spent in the occupant index. The time per occupant should not grow
+with the room size.
+
+Usage: python3 benchmark_muc_join.py [number of occupants]
+'''
+import sys
+import time
+
+import lib
+lib.setup_env()
+
+from common.contacts import GC_Contact, GC_Contacts
+
+ROLES = ('moderator', 'participant', 'visitor')
+ROOM_JID = 'room@conference.gajim.org'
+
+def join(nb):
+    gc_contacts = GC_Contacts()
+    start = time.perf_counter()
+    for i in range(nb):
+        nick = 'occupant%d' % i
+        role = ROLES[i % len(ROLES)]
+        # what GroupchatControl does for each presence of a new occupant
+        if gc_contacts.get_gc_contact(ROOM_JID, nick) is None:
+            gc_contacts.add_gc_contact(GC_Contact(room_jid=ROOM_JID,
+                account='account', name=nick, role=role))
+        gc_contacts.get_nb_role_total_gc_contacts(ROOM_JID, role)
+    return time.perf_counter() - start
+
+def main():
+    max_nb = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    nb = 500
+    while nb <= max_nb:
+        duration = join(nb)
+        print('%6d occupants: %8.2f ms, %6.2f us per occupant' % (nb,
+            duration * 1000, duration * 1000000 / nb))
+        nb *= 2
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+'''
+Measure how many events per second go through
+NetworkEventsController.push_incoming_event, with and without skipping
+unhandled events.
+
+Usage: python3 benchmark_nec.py [number of events]
+'''
+import sys
+import time
+
+import lib
+lib.setup_env()
+
+from common import gajim
+from common import ged
+from common import nec
+
+class RawEvent(nec.NetworkIncomingEvent):
+    name = 'raw-bench-received'
+    base_network_events = []
+
+class HandledEvent(nec.NetworkIncomingEvent):
+    name = 'handled-bench-received'
+    base_network_events = ['raw-bench-received']
+
+    def generate(self):
+        self.stanza = self.base_event.stanza
+        return True
+
+def make_unhandled(i):
+    class UnhandledEvent(nec.NetworkIncomingEvent):
+        name = 'unhandled-bench-received-%d' % i
+        base_network_events = ['raw-bench-received']
+        skippable = True
+
+        def generate(self):
+            self.stanza = self.base_event.stanza
+            return True
+    return UnhandledEvent
+
+def run(nb, skip):
+    gajim.nec.skip_unhandled_events = skip
+    start = time.perf_counter()
+    for i in range(nb):
+        gajim.nec.push_incoming_event(RawEvent(None, stanza=i))
+    return nb / (time.perf_counter() - start)
+
+def main():
+    nb = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    gajim.ged = ged.GlobalEventsDispatcher()
+    gajim.nec = nec.NetworkEventsController()
+    gajim.ged.register_event_handler('handled-bench-received', ged.CORE,
+        lambda obj: None)
+    gajim.nec.register_incoming_event(HandledEvent)
+    for i in range(10):
+        gajim.nec.register_incoming_event(make_unhandled(i))
+
+    print('all derived events: %d events/s' % run(nb, False))
+    print('skip unhandled events: %d events/s' % run(nb, True))
+
+if __name__ == '__main__':
+    main()
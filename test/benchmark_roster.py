@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''
+Store and load a synthetic roster and measure the time spent in the logger.
+The bulk replace is compared with one add_or_update_contact() per contact and
+the single query load with one groups query per contact, which is what was
+done before.
+
+Usage: python3 benchmark_roster.py [number of contacts]
+'''
+import sys
+import time
+
+import lib
+lib.setup_env()
+
+from common import check_paths
+from common import logger
+
+ACCOUNT_JID = 'me@gajim.org'
+GROUPS = ('Friends', 'Family', 'Work', 'Gajim', 'Transports')
+
+def make_roster(nb, changed=0, domain='gajim.org'):
+    roster = {}
+    for i in range(nb):
+        name = 'Contact %d' % i
+        if i < changed:
+            name += ' (renamed)'
+        roster['contact%d@%s' % (i, domain)] = {'name': name,
+            'subscription': 'both', 'ask': None,
+            'groups': list(GROUPS[i % len(GROUPS):][:2])}
+    return roster
+
+def per_contact_replace(db, roster):
+    db.remove_roster(ACCOUNT_JID)
+    for jid, item in roster.items():
+        db.add_or_update_contact(ACCOUNT_JID, jid, item['name'],
+            item['subscription'], item['ask'], item['groups'], commit=False)
+    db.con.commit()
+
+def per_contact_load(db):
+    account_jid_id = db.get_jid_id(ACCOUNT_JID)
+    cur = db.con.cursor()
+    cur.execute('SELECT jid_id FROM roster_entry WHERE account_jid_id=?',
+        (account_jid_id,))
+    for (jid_id,) in cur.fetchall():
+        cur.execute('SELECT group_name FROM roster_group WHERE '
+            'account_jid_id=? AND jid_id=?', (account_jid_id, jid_id))
+        cur.fetchall()
+
+def measure(label, func, *args):
+    start = time.perf_counter()
+    func(*args)
+    print('  %-36s %9.2f ms' % (label, (time.perf_counter() - start) * 1000))
+
+def main():
+    nb = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    check_paths.create_log_db()
+    check_paths.create_cache_db()
+    db = logger.Logger()
+    print('%d contacts' % nb)
+
+    def bulk_replace(roster):
+        db.replace_roster_entries(ACCOUNT_JID, roster)
+        db.con.commit()
+
+    measure('bulk replace, new contacts', bulk_replace, make_roster(nb))
+    measure('bulk replace, unchanged', bulk_replace, make_roster(nb))
+    measure('bulk replace, 1% changed', bulk_replace,
+        make_roster(nb, changed=nb // 100))
+    measure('per contact replace, new contacts', per_contact_replace, db,
+        make_roster(nb, domain='example.org'))
+    measure('per contact replace, unchanged', per_contact_replace, db,
+        make_roster(nb, domain='example.org'))
+    measure('single query load', db.get_roster, ACCOUNT_JID)
+    measure('per contact load', per_contact_load, db)
+    db.close_db()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+'''
+Fully resort a roster-like tree model and measure the time spent in the sort
+function. The sort key column built by RosterWindow._get_sort_key() and
+sorted with RosterWindow._compareIters() is compared with a function looking
+up the contact and comparing names on each call, like the roster did before.
+
+Usage: python3 benchmark_roster_sort.py [number of contacts]
+'''
+import sys
+import time
+import locale
+
+import lib
+lib.setup_env()
+
+from gi.repository import Gtk
+
+from common import gajim
+from common.contacts import LegacyContactsAPI
+from roster_window import RosterWindow, Column, SHOW_SORT_RANK
+
+ACCOUNT = 'account'
+NB_GROUPS = 20
+SHOWS = ('online', 'away', 'xa', 'dnd', 'offline', 'offline', 'offline')
+
+# only the sort methods of the roster are used, they don't need a window
+roster = RosterWindow.__new__(RosterWindow)
+
+def lookup_compare(contacts):
+    def compare(model, iter1, iter2, data=None):
+        type1 = model[iter1][Column.TYPE]
+        if type1 == 'group':
+            return locale.strcoll(model[iter1][Column.JID],
+                model[iter2][Column.JID])
+        account1 = model[iter1][Column.ACCOUNT]
+        account2 = model[iter2][Column.ACCOUNT]
+        contact1 = contacts.get_first_contact_from_jid(account1,
+            model[iter1][Column.JID])
+        contact2 = contacts.get_first_contact_from_jid(account2,
+            model[iter2][Column.JID])
+        show1 = SHOW_SORT_RANK.get(contact1.show, 9)
+        show2 = SHOW_SORT_RANK.get(contact2.show, 9)
+        if show1 != show2:
+            return -1 if show1 < show2 else 1
+        return locale.strcoll(contact1.get_shown_name().lower(),
+            contact2.get_shown_name().lower())
+    return compare
+
+def make_row(type_, jid, name):
+    row = [None] * (Column.SORT_KEY + 1)
+    row[Column.NAME] = name
+    row[Column.TYPE] = type_
+    row[Column.JID] = jid
+    row[Column.ACCOUNT] = ACCOUNT
+    row[Column.SORT_KEY] = roster._get_sort_key(type_, jid, ACCOUNT)
+    return row
+
+def fill(nb):
+    gajim.contacts = contacts = LegacyContactsAPI()
+    gajim.to_be_removed[ACCOUNT] = []
+    gajim.config.set('sort_by_show_in_roster', True)
+    model = Gtk.TreeStore(*([str] * Column.SORT_KEY + [object]))
+    groups = []
+    for i in range(NB_GROUPS):
+        group = 'Group %d' % i
+        groups.append(model.append(None, make_row('group', group, group)))
+    for i in range(nb):
+        jid = 'contact%d@gajim.org' % i
+        name = 'Contact %d' % (nb - i)
+        contact = contacts.create_contact(jid=jid, account=ACCOUNT, name=name,
+            show=SHOWS[i % len(SHOWS)])
+        contacts.add_contact(ACCOUNT, contact)
+        model.append(groups[i % NB_GROUPS], make_row('contact', jid, name))
+    return contacts, model
+
+def resort(model, compare):
+    model.set_sort_column_id(Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID,
+        Gtk.SortType.ASCENDING)
+    model.set_sort_func(Column.SORT_KEY, compare)
+    start = time.perf_counter()
+    model.set_sort_column_id(Column.SORT_KEY, Gtk.SortType.ASCENDING)
+    return time.perf_counter() - start
+
+def main():
+    nb = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    print('%d contacts in %d groups' % (nb, NB_GROUPS))
+    for label in ('contact lookup', 'cached sort key'):
+        # rows are added in reverse order of names, so the sort has work to do
+        contacts, model = fill(nb)
+        if label == 'contact lookup':
+            compare = lookup_compare(contacts)
+        else:
+            compare = roster._compareIters
+        duration = resort(model, compare)
+        print('  %-16s %8.2f ms' % (label, duration * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,14 @@ modules = ( 'unit.test_protocol_caps',
             'unit.test_contacts',
             'unit.test_account',
             'unit.test_gui_interface',
+            'unit.test_events',
+            'unit.test_resolver',
+            'unit.test_connection_racer',
+            'unit.test_bootstrap',
+            'unit.test_message_timeline',
+            'unit.test_avatar_store',
+            'unit.test_icon_cache',
+            'unit.test_file_hasher',
           )
 
 if use_x:
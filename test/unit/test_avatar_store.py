@@ -0,0 +1,71 @@
+'''
+Tests for the in-memory avatar store
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from avatar_store import AvatarStore
+
+
+class TestAvatarStore(unittest.TestCase):
+
+    def setUp(self):
+        self.decoded = []
+        self.scaled = []
+        self.store = AvatarStore(self.decode, self.scale, size=4)
+
+    def decode(self, data):
+        self.decoded.append(data)
+        if data == b'broken':
+            return None
+        return ('pixbuf', data)
+
+    def scale(self, pixbuf, size):
+        self.scaled.append((pixbuf, size))
+        return (pixbuf, size)
+
+    def test_unknown(self):
+        self.assertNotIn('a@b', self.store)
+        self.assertRaises(KeyError, self.store.get_pixbuf, 'a@b')
+
+    def test_shared_by_sha(self):
+        self.store.set_avatar('a@b', b'img')
+        self.store.set_avatar('room@muc/nick', b'img')
+        self.assertEqual(self.decoded, [b'img'])
+        self.assertEqual(self.store.get_pixbuf('a@b', (32, 32)),
+            (('pixbuf', b'img'), (32, 32)))
+        self.store.get_pixbuf('room@muc/nick', (32, 32))
+        self.store.get_pixbuf('a@b', (32, 32))
+        self.assertEqual(len(self.scaled), 1)
+
+    def test_no_avatar(self):
+        self.store.set_no_avatar('a@b')
+        self.assertIsNone(self.store.get_pixbuf('a@b', (32, 32)))
+        self.assertIsNone(self.store.set_avatar('c@d', b'broken'))
+        self.assertIsNone(self.store.get_pixbuf('c@d'))
+
+    def test_forget(self):
+        self.store.set_avatar('a@b', b'img')
+        self.store.forget('a@b')
+        self.assertRaises(KeyError, self.store.get_pixbuf, 'a@b')
+
+    def test_lru(self):
+        self.store.set_avatar('a@b', b'img1')
+        self.store.get_pixbuf('a@b', (32, 32))
+        self.store.set_avatar('c@d', b'img2')
+        self.store.get_pixbuf('c@d', (32, 32))
+        self.store.get_pixbuf('a@b')
+        # drops the scaled a@b, then the original c@d (used before a@b)
+        self.store.set_avatar('e@f', b'img3')
+        self.store.get_pixbuf('a@b', (32, 32))
+        self.assertEqual(len(self.store.pixbufs), 4)
+        self.assertEqual(self.store.get_pixbuf('c@d', (32, 32)),
+            (('pixbuf', b'img2'), (32, 32)))
+        self.assertRaises(KeyError, self.store.get_pixbuf, 'c@d', (16, 16))
+        self.assertNotIn('c@d', self.store)
+
+
+if __name__ == '__main__':
+    unittest.main()
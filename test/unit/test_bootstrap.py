@@ -0,0 +1,98 @@
+'''
+Tests for the scheduling of requests sent after login
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common import bootstrap
+from common.bootstrap import Bootstrap
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+class TestBootstrap(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.real_time = bootstrap.time
+        bootstrap.time = self.clock
+        self.sent = []
+        self.finished = []
+        self.b = Bootstrap('account', on_finished=self.finished.append)
+        self.b.add_step('disco', lambda: self.sent.append('disco'))
+        self.b.add_step('metacontacts', lambda: self.sent.append(
+            'metacontacts'))
+        self.b.add_step('delimiter', lambda: self.sent.append('delimiter'))
+        self.b.add_step('privacy', lambda: self.sent.append('privacy'),
+            requires=('disco',))
+        self.b.add_step('roster', lambda: self.sent.append('roster'),
+            requires=('metacontacts', 'delimiter'))
+        self.b.add_step('presence', lambda: self.sent.append('presence'),
+            requires=('roster', 'privacy'), wait=False)
+
+    def tearDown(self):
+        bootstrap.time = self.real_time
+
+    def test_independent_steps_start_together(self):
+        self.b.start()
+        self.assertEqual(self.sent, ['disco', 'metacontacts', 'delimiter'])
+
+    def test_dependencies(self):
+        self.b.start()
+        self.b.done('metacontacts')
+        self.assertNotIn('roster', self.sent)
+        self.b.done('delimiter')
+        self.assertEqual(self.sent[-1], 'roster')
+        self.b.done('roster')
+        self.assertNotIn('presence', self.sent)
+        self.b.done('disco')
+        self.b.done('privacy')
+        self.assertEqual(self.sent[-1], 'presence')
+        self.assertEqual(len(self.finished), 1)
+
+    def test_done_is_idempotent(self):
+        self.b.start()
+        self.b.done('disco')
+        self.b.done('disco')
+        self.b.done('roster')
+        self.assertEqual(self.sent.count('privacy'), 1)
+        self.assertFalse(self.b.is_waiting_for('roster'))
+
+    def test_timings(self):
+        # every answer takes 1 second
+        self.b.start()
+        self.clock.now = 1
+        for name in ('disco', 'metacontacts', 'delimiter'):
+            self.b.done(name)
+        self.clock.now = 2
+        self.b.done('privacy')
+        self.b.done('roster')
+        timings = {name: (offset, duration) for name, offset, duration in \
+            self.b.get_timings()}
+        self.assertEqual(timings['roster'], (1, 1))
+        self.assertEqual(timings['presence'], (2, 0))
+        # sequentially it would have taken 5 round trips
+        self.assertEqual(self.b.finished - self.b.started, 2)
+
+    def test_cancel(self):
+        self.b.start()
+        self.b.cancel()
+        self.b.done('disco')
+        self.assertNotIn('privacy', self.sent)
+        self.assertEqual(self.finished, [])
+
+    def test_unknown_requirement(self):
+        self.assertRaises(ValueError, self.b.add_step, 'bookmarks',
+            lambda: None, requires=('vcard',))
+
+
+if __name__ == '__main__':
+    unittest.main()
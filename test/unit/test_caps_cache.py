@@ -27,10 +27,8 @@ class CommonCapsTest(unittest.TestCase):
         self.features = [NS_MUC, NS_XHTML_IM] # NS_MUC not supported!
 
         # Simulate a filled db
-        db_caps_cache = [
-                        (self.caps_method, self.caps_hash, self.identities, self.features),
-                        ('old', self.node + '#' + self.caps_hash, self.identities, self.features)]
-        self.logger = Mock(returnValues={"iter_caps_data":db_caps_cache})
+        db_caps_data = (self.identities, self.features)
+        self.logger = Mock(returnValues={"get_caps_data": db_caps_data})
 
         self.cc = caps.CapsCache(self.logger)
         caps.capscache = self.cc
@@ -70,6 +68,24 @@ class TestCapsCache(CommonCapsTest):
         self.cc.initialize_from_db()
         self.assertEqual(self.cc[self.client_caps].status, caps.CACHED)
 
+    def test_lru_eviction(self):
+        ''' Least recently used items are dropped and reloaded from db '''
+        self.cc.initialize_from_db()
+        item = self.cc[self.client_caps]
+        for i in range(caps.CAPS_CACHE_SIZE):
+            self.cc[('sha-1', str(i))]
+        new_item = self.cc[self.client_caps]
+        self.assertFalse(item is new_item)
+        self.assertEqual(new_item.status, caps.CACHED)
+        self.assertEqual(new_item.features, frozenset(self.features))
+
+    def test_features_shared(self):
+        ''' Items with the same features share the same set '''
+        self.cc[self.client_caps].features = self.features
+        self.cc[('sha-1', 'other')].features = list(reversed(self.features))
+        self.assertTrue(self.cc[self.client_caps].features is
+            self.cc[('sha-1', 'other')].features)
+
     def test_preload_triggering_query(self):
         ''' Make sure that preload issues a disco '''
         connection = Mock()
@@ -0,0 +1,93 @@
+'''
+Tests for racing connection attempts
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common.connection_racer import ConnectionRacer
+
+
+class TestConnectionRacer(unittest.TestCase):
+
+    def setUp(self):
+        # dict {candidate: (on_success, on_failure)}
+        self.started = {}
+        self.cancelled = []
+        self.won = []
+        self.lost = []
+        self.racer = ConnectionRacer(['a', 'b', 'c'], self._start,
+            self.cancelled.append, self._on_won, self._on_lost)
+
+    def _start(self, candidate, on_success, on_failure):
+        self.started[candidate] = (on_success, on_failure)
+        return 'con-' + candidate
+
+    def _on_won(self, candidate, con, con_type):
+        self.won.append((candidate, con, con_type))
+
+    def _on_lost(self, *args):
+        self.lost.append(args)
+
+    def test_staggered_start(self):
+        self.racer.start()
+        self.assertEqual(list(self.started), ['a'])
+        self.racer._on_delay()
+        self.assertEqual(sorted(self.started), ['a', 'b'])
+
+    def test_failure_starts_next_at_once(self):
+        self.racer.start()
+        self.started['a'][1]()
+        self.assertEqual(sorted(self.started), ['a', 'b'])
+
+    def test_first_success_wins(self):
+        self.racer.start()
+        self.racer._on_delay()
+        self.started['b'][0]('client', 'tls')
+        self.assertEqual(self.won, [('b', 'client', 'tls')])
+        self.assertEqual(self.cancelled, ['con-a'])
+        self.assertEqual(self.racer.pending, ['c'])
+
+        # late callbacks of cancelled attempts are ignored
+        self.started['a'][0]('client', 'ssl')
+        self.started['a'][1]()
+        self.assertEqual(len(self.won), 1)
+        self.assertEqual(self.lost, [])
+        self.racer._on_delay()
+        self.assertNotIn('c', self.started)
+
+    def test_all_failed(self):
+        self.racer.start()
+        self.started['a'][1]()
+        self.started['b'][1]()
+        self.assertEqual(self.lost, [])
+        self.started['c'][1](True)
+        self.assertEqual(self.lost, [(True,)])
+        self.assertEqual(self.won, [])
+
+    def test_synchronous_failure(self):
+        def start(candidate, on_success, on_failure):
+            self.started[candidate] = (on_success, on_failure)
+            if candidate != 'c':
+                on_failure()
+            return candidate
+        racer = ConnectionRacer(['a', 'b', 'c'], start, self.cancelled.append,
+            self._on_won, self._on_lost)
+        racer.start()
+        self.assertEqual(sorted(self.started), ['a', 'b', 'c'])
+        self.started['c'][0]('client', 'tls')
+        self.assertEqual(self.won, [('c', 'client', 'tls')])
+        self.assertEqual(self.cancelled, [])
+
+    def test_cancel(self):
+        self.racer.start()
+        self.racer._on_delay()
+        self.racer.cancel()
+        self.assertEqual(sorted(self.cancelled), ['con-a', 'con-b'])
+        self.started['a'][0]('client', 'tls')
+        self.assertEqual(self.won, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,8 @@ import unittest
 import lib
 lib.setup_env()
 
-from common.contacts import CommonContact, Contact, GC_Contact, LegacyContactsAPI
+from common.contacts import (CommonContact, Contact, GC_Contact,
+    GC_Contacts, LegacyContactsAPI)
 from nbxmpp import NS_MUC
 
 from common import caps_cache
@@ -124,6 +125,65 @@ class TestContacts(unittest.TestCase):
         self.assertEqual(2, len(self.contacts.get_contacts_from_group(account, group)))
         self.assertEqual(0, len(self.contacts.get_contacts_from_group(account, '')))
 
+    def test_nb_online_total_contacts_by_group(self):
+        from common import gajim
+        account = 'account'
+        gajim.config.add_per('accounts', account)
+        for jid, groups, show in (('a@gajim.org', ['A'], 'online'),
+        ('b@gajim.org', ['A', 'B'], 'offline'),
+        ('c@gajim.org', [], 'away'),
+        ('icq.gajim.org', [], 'online')):
+            self.contacts.add_contact(account, self.contacts.create_contact(
+                jid=jid, account=account, groups=groups, show=show))
+
+        counters = self.contacts.get_nb_online_total_contacts_by_group()
+        for group in ('A', 'B', _('General'), _('Transports')):
+            self.assertEqual(tuple(counters[group]),
+                self.contacts.get_nb_online_total_contacts(groups=[group]),
+                msg='Wrong counters for group %s' % group)
+        self.assertEqual(counters['A'], [1, 2])
+
+
+class TestGC_Contacts(unittest.TestCase):
+
+    def setUp(self):
+        self.gc_contacts = GC_Contacts()
+        self.room_jid = 'room@conference.gajim.org'
+
+    def _add(self, nick, role):
+        gc_contact = GC_Contact(room_jid=self.room_jid, account='account',
+            name=nick, role=role)
+        self.gc_contacts.add_gc_contact(gc_contact)
+        return gc_contact
+
+    def test_get_gc_contact(self):
+        gc_contact = self._add('nick', 'participant')
+        self.assertTrue(gc_contact is self.gc_contacts.get_gc_contact(
+            self.room_jid, 'nick'))
+        self.assertEqual(None, self.gc_contacts.get_gc_contact(self.room_jid,
+            'other'))
+        self.assertEqual(None, self.gc_contacts.get_gc_contact('other@gajim.org',
+            'nick'))
+
+    def test_role_counters(self):
+        self._add('nick1', 'participant')
+        gc_contact = self._add('nick2', 'participant')
+        self._add('nick3', 'moderator')
+        self.assertEqual((2, 3), self.gc_contacts.get_nb_role_total_gc_contacts(
+            self.room_jid, 'participant'))
+
+        # role changes are a remove and an add
+        self.gc_contacts.remove_gc_contact(gc_contact)
+        self._add('nick2', 'moderator')
+        self.assertEqual((1, 3), self.gc_contacts.get_nb_role_total_gc_contacts(
+            self.room_jid, 'participant'))
+        self.assertEqual((2, 3), self.gc_contacts.get_nb_role_total_gc_contacts(
+            self.room_jid, 'moderator'))
+
+        self.gc_contacts.remove_room(self.room_jid)
+        self.assertEqual((0, 0), self.gc_contacts.get_nb_role_total_gc_contacts(
+            self.room_jid, 'moderator'))
+
 
 if __name__ == "__main__":
     unittest.main()
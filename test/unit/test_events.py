@@ -0,0 +1,67 @@
+'''
+Tests for the pending events queue
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common.events import Events, Event
+
+class TestEvent(Event):
+    type_ = 'test'
+
+class OtherEvent(Event):
+    type_ = 'other'
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.events = Events()
+        self.events.add_account('acc1')
+        self.events.add_account('acc2')
+
+    def testCounters(self):
+        ev1 = TestEvent(time_=3, show_in_roster=True)
+        ev2 = OtherEvent(time_=1, show_in_systray=False)
+        ev3 = TestEvent(time_=2)
+        self.events.add_event('acc1', 'a@b', ev1)
+        self.events.add_event('acc1', 'a@b', ev2)
+        self.events.add_event('acc2', 'c@d', ev3)
+
+        self.assertEqual(self.events.get_nb_events(), 3)
+        self.assertEqual(self.events.get_nb_events(types=['test']), 2)
+        self.assertEqual(self.events.get_nb_systray_events(), 2)
+        self.assertEqual(self.events.get_nb_roster_events(), 1)
+        self.assertEqual(self.events.get_nb_events(account='acc1'), 2)
+        self.assertEqual(self.events.get_nb_events(['test', 'other'],
+            'acc1'), 2)
+
+        self.events.remove_events('acc1', 'a@b', types=['test'])
+        self.assertEqual(self.events.get_nb_events(), 2)
+        self.assertEqual(self.events.get_nb_roster_events(), 0)
+
+        self.events.change_jid('acc1', 'a@b', 'e@f')
+        self.assertEqual(self.events.get_nb_events(['other'], 'acc1'), 1)
+        self.assertEqual(self.events.get_first_event(), ('acc1', 'e@f', ev2))
+
+    def testFirstEvent(self):
+        ev1 = TestEvent(time_=3)
+        ev2 = TestEvent(time_=1, show_in_systray=False)
+        ev3 = TestEvent(time_=2)
+        self.events.add_event('acc1', 'a@b', ev1)
+        self.events.add_event('acc1', 'a@b', ev2)
+        self.events.add_event('acc2', 'c@d', ev3)
+
+        self.assertEqual(self.events.get_first_event(), ('acc1', 'a@b', ev2))
+        self.assertEqual(self.events.get_first_systray_event(),
+            ('acc2', 'c@d', ev3))
+        self.events.remove_events('acc2', 'c@d', event=ev3)
+        self.assertEqual(self.events.get_first_systray_event(),
+            ('acc1', 'a@b', ev1))
+        self.events.remove_account('acc1')
+        self.assertEqual(self.events.get_first_event(), (None, None, None))
+        self.assertEqual(self.events.get_nb_events(), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+'''
+Tests for hashing received files while they are written
+'''
+import unittest
+import hashlib
+
+import lib
+lib.setup_env()
+
+from common.file_props import FilesProp, FileHasher
+
+
+class TestFileHasher(unittest.TestCase):
+
+    def test_unknown_algo(self):
+        hasher = FileHasher()
+        hasher.update(b'abc')
+        hasher.update(b'def')
+        self.assertEqual(hasher.length, 6)
+        self.assertEqual(hasher.get_hash('sha-256'),
+            hashlib.sha256(b'abcdef').hexdigest())
+        self.assertEqual(hasher.get_hash('sha-1'),
+            hashlib.sha1(b'abcdef').hexdigest())
+
+    def test_known_algo(self):
+        hasher = FileHasher('sha-512')
+        hasher.update(b'abc')
+        self.assertEqual(list(hasher.hashes), ['sha-512'])
+        self.assertIsNone(hasher.get_hash('sha-1'))
+        self.assertEqual(FileHasher('unknown').hashes, {})
+
+    def test_received_hash(self):
+        file_props = FilesProp.getNewFileProp('account', 'sid-hasher')
+        file_props.size = 3
+        file_props.algo = 'sha-1'
+        self.assertIsNone(file_props.get_received_hash())
+        file_props.hasher = FileHasher()
+        file_props.hasher.update(b'ab')
+        # not the whole file
+        self.assertIsNone(file_props.get_received_hash())
+        file_props.hasher.update(b'c')
+        self.assertEqual(file_props.get_received_hash(),
+            hashlib.sha1(b'abc').hexdigest())
+        FilesProp.deleteFileProp(file_props)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+'''
+Tests for the iconset cache
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from icon_cache import IconCache
+
+
+class TestIconCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = IconCache()
+        self.loaded = []
+
+    def get(self, iconset, category, name):
+        def load():
+            self.loaded.append((iconset, category, name))
+            return iconset + '/' + name
+        return self.cache.get(iconset, category, name, 16, load)
+
+    def test_loaded_once(self):
+        self.assertEqual(self.get('dcraven', 'status', 'online'),
+            'dcraven/online')
+        self.get('dcraven', 'status', 'online')
+        self.get('default', 'mood', 'happy')
+        self.assertEqual(len(self.loaded), 2)
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['cached'], 2)
+
+    def test_missing_icon_is_cached(self):
+        self.cache.get('default', 'mood', 'nope', 16, lambda: None)
+        self.assertIsNone(self.cache.get('default', 'mood', 'nope', 16,
+            lambda: self.fail('loaded again')))
+
+    def test_iconset_changed(self):
+        self.get('dcraven', 'status', 'online')
+        self.get('default', 'mood', 'happy')
+        self.assertEqual(self.get('gnome', 'status', 'online'),
+            'gnome/online')
+        # icons of the previous iconset are dropped, other categories kept
+        self.assertEqual(sorted(self.cache.icons), [
+            ('default', 'mood', 'happy', 16),
+            ('gnome', 'status', 'online', 16)])
+        self.assertEqual(self.cache.get_stats()['invalidations'], 1)
+
+    def test_invalidate(self):
+        self.get('dcraven', 'status', 'online')
+        self.cache.invalidate('status')
+        self.get('dcraven', 'status', 'online')
+        self.assertEqual(len(self.loaded), 2)
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get_stats()['cached'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
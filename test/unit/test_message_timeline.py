@@ -0,0 +1,83 @@
+'''
+Tests for the ordered list of lines printed in a conversation
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from common.message_timeline import MessageTimeline
+
+
+class Mark:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return 'Mark(%s)' % self.name
+
+
+class TestMessageTimeline(unittest.TestCase):
+
+    def setUp(self):
+        self.timeline = MessageTimeline()
+        self.marks = {}
+        for tim, name in ((10, 'a'), (20, 'b'), (30, 'c')):
+            self.marks[name] = Mark(name)
+            self.timeline.add(tim, self.marks[name], name)
+
+    def names(self):
+        return [line[2] for line in self.timeline]
+
+    def test_insert_point(self):
+        self.assertEqual(self.timeline.get_insert_point(30), (None, None))
+        self.assertEqual(self.timeline.get_insert_point(40), (None, None))
+        self.assertEqual(self.timeline.get_insert_point(5),
+            (self.marks['a'], 0))
+        # equal timestamps go after the lines already printed
+        self.assertEqual(self.timeline.get_insert_point(20),
+            (self.marks['c'], 2))
+
+    def test_add_delayed(self):
+        mark, index = self.timeline.get_insert_point(15)
+        self.timeline.add(15, Mark('d'), 'd', index)
+        self.timeline.add(1, Mark('e'), 'e')
+        self.assertEqual(self.names(), ['e', 'a', 'd', 'b', 'c'])
+
+    def test_find(self):
+        self.timeline.add(20, Mark('d'), 'd')
+        self.assertEqual(self.timeline.find('b', self.marks['b']), 1)
+        self.assertEqual(self.timeline.find('b', self.marks['a']), None)
+        self.assertEqual(self.timeline.find('x', self.marks['a']), None)
+        self.assertEqual(self.timeline.get_next_mark(1).name, 'd')
+        self.assertEqual(self.timeline.get_next_mark(3), None)
+
+    def test_same_stanza_id(self):
+        # two occupants of a group chat sent a message with the same id
+        other_mark = Mark('b')
+        self.timeline.add(25, other_mark, 'b')
+        self.assertEqual(self.timeline.find('b', self.marks['b']), 1)
+        self.assertEqual(self.timeline.find('b', other_mark), 2)
+
+    def test_replace(self):
+        new_mark = Mark('b2')
+        self.timeline.replace(1, new_mark, 'b2')
+        self.assertEqual(self.names(), ['a', 'b2', 'c'])
+        self.assertEqual(self.timeline.find('b', self.marks['b']), None)
+        self.assertEqual(self.timeline.find('b2', new_mark), 1)
+        # the corrected line keeps the timestamp of the original
+        self.assertEqual(self.timeline[1][0], 20)
+
+    def test_prune(self):
+        removed = self.timeline.prune(2)
+        self.assertEqual([line[2] for line in removed], ['a'])
+        self.assertEqual(self.names(), ['b', 'c'])
+        self.assertEqual(self.timeline.find('a', self.marks['a']), None)
+        self.assertEqual(self.timeline.find('c', self.marks['c']), 1)
+        self.assertEqual(self.timeline.prune(2), [])
+        self.assertEqual(self.timeline.get_insert_point(15),
+            (self.marks['b'], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
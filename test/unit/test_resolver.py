@@ -0,0 +1,112 @@
+'''
+Tests for the caching DNS resolver
+'''
+import unittest
+import time
+
+import lib
+lib.setup_env()
+
+from common import resolver
+
+
+class FakeGioResolver:
+    def __init__(self):
+        self.lookups = []
+
+    def lookup_records_async(self, host, record_type, cancellable, callback):
+        self.lookups.append((host, record_type, callback))
+
+
+class FakeResult:
+    def __init__(self, records):
+        self.records = records
+
+    def lookup_records_finish(self, result):
+        return self.records
+
+
+class FakeStore:
+    def __init__(self, rows=None):
+        self.rows = rows or []
+        self.saved = []
+
+    def get_resolver_cache(self):
+        return self.rows
+
+    def set_resolver_cache(self, host, type_, records, expires):
+        self.saved.append((host, type_, records, expires))
+
+
+class TestResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.results = []
+
+    def _make_resolver(self, store=None):
+        res = resolver.GioResolver(store)
+        res.gio_resolver = FakeGioResolver()
+        return res
+
+    def _on_ready(self, host, result_list):
+        self.results.append((host, result_list))
+
+    def _answer(self, res, records):
+        host, record_type, callback = res.gio_resolver.lookups[-1]
+        callback(FakeResult(records), None)
+
+    def test_srv_miss_then_hit(self):
+        res = self._make_resolver()
+        res.resolve('_xmpp-client._tcp.example.org', self._on_ready)
+        res.resolve('_xmpp-client._tcp.example.org', self._on_ready)
+        self.assertEqual(len(res.gio_resolver.lookups), 1,
+            msg='Concurrent lookups of the same host must be merged')
+
+        self._answer(res, [(5, 0, 5222, 'xmpp.example.org')])
+        expected = [{'prio': 5, 'weight': 0, 'port': 5222,
+            'host': 'xmpp.example.org'}]
+        self.assertEqual(self.results,
+            [('_xmpp-client._tcp.example.org', expected)] * 2)
+
+        res.resolve('_xmpp-client._tcp.example.org', self._on_ready)
+        self.assertEqual(len(res.gio_resolver.lookups), 1)
+        self.assertEqual(self.results[-1][1], expected)
+        stats = res.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_txt(self):
+        res = self._make_resolver()
+        res.resolve('_xmppconnect.example.org', self._on_ready, type_='txt')
+        self._answer(res, [(['_xmpp-client-xbosh=', 'https://example.org'],)])
+        self.assertEqual(self.results, [('_xmppconnect.example.org',
+            ['_xmpp-client-xbosh=https://example.org'])])
+
+    def test_stale_entry_is_served_and_refreshed(self):
+        store = FakeStore([('example.org', 'srv', ['old'],
+            int(time.time()) - 10)])
+        res = self._make_resolver(store)
+        res.resolve('example.org', self._on_ready)
+        self.assertEqual(self.results, [('example.org', ['old'])],
+            msg='Stale entry must be returned without waiting')
+        self.assertEqual(len(res.gio_resolver.lookups), 1,
+            msg='Stale entry must be resolved again')
+        self.assertEqual(res.get_stats()['stale_hits'], 1)
+
+        self._answer(res, [(0, 0, 5222, 'new.example.org')])
+        self.assertEqual(len(self.results), 1)
+        self.assertEqual(store.saved[-1][0], 'example.org')
+        self.assertGreater(store.saved[-1][3], time.time())
+
+        res.resolve('example.org', self._on_ready)
+        self.assertEqual(self.results[-1][1][0]['host'], 'new.example.org')
+
+    def test_empty_host(self):
+        res = self._make_resolver()
+        res.resolve('', self._on_ready)
+        self.assertEqual(self.results, [('', [])])
+        self.assertEqual(res.gio_resolver.lookups, [])
+
+
+if __name__ == '__main__':
+    unittest.main()